@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import User, UserProfile
+from .models import Tenant, User, UserProfile
 
+admin.site.register(Tenant)
 admin.site.register(User)
 
 @admin.register(UserProfile)
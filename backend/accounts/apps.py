@@ -5,3 +5,4 @@ class AccountConfig(AppConfig):
 
     def ready(self):
         import accounts.signals
+        import accounts.profiling
@@ -0,0 +1,212 @@
+"""
+削除アカウントログ（DeletedUserLog）のアーカイブ。
+古い行は日付ごとの gzip 圧縮 JSONL（<root>/YYYY/MM/YYYY-MM-DD.<segment>.jsonl.gz、1 バッチ 1 セグメント）へ
+移してテーブルから消す。
+エクスポートはアーカイブ → テーブルの順に 1 行ずつ読むので、どちらも全件をメモリに載せない。
+"""
+import gzip
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+from datetime import date
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DeletedUserLog
+from .tenancy import UNSCOPED, scope_queryset
+
+ARCHIVE_DIR = getattr(
+    settings, "ACCOUNTS_DELETED_LOG_ARCHIVE_DIR",
+    os.path.join(settings.BASE_DIR, "archive", "deleted_logs"),
+)
+ARCHIVE_BATCH_SIZE = getattr(settings, "ACCOUNTS_DELETED_LOG_ARCHIVE_BATCH_SIZE", 5000)
+
+LOG_FIELDS = ("id", "user_id", "username", "email", "name", "deleted_at", "deleted_by__username", "tenant_id")
+
+
+def archive_path(root, day, segment=None):
+    """日付のファイル（segment を付けると 1 バッチ分のセグメント）"""
+    name = f"{day:%Y-%m-%d}.jsonl.gz" if segment is None else f"{day:%Y-%m-%d}.{segment}.jsonl.gz"
+    return os.path.join(root, f"{day:%Y}", f"{day:%m}", name)
+
+
+def log_record(row):
+    """values(*LOG_FIELDS) の 1 行をアーカイブ / エクスポート用の dict にする"""
+    return {
+        "user_id": str(row["user_id"]),
+        "username": row["username"],
+        "email": row["email"],
+        "name": row["name"],
+        "deleted_at": row["deleted_at"].isoformat(),
+        "deleted_by": row["deleted_by__username"],
+        "tenant_id": row["tenant_id"],
+    }
+
+
+def iter_live_rows(queryset=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """(deleted_at, id) のキーセットで古い順に読む（OFFSET を使わない）"""
+    queryset = (queryset if queryset is not None else DeletedUserLog.objects.all()).order_by("deleted_at", "id")
+    last = None
+    while True:
+        batch = queryset
+        if last is not None:
+            batch = batch.filter(Q(deleted_at__gt=last[0]) | Q(deleted_at=last[0], id__gt=last[1]))
+        rows = list(batch.values(*LOG_FIELDS)[:batch_size])
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last = (rows[-1]["deleted_at"], rows[-1]["id"])
+
+
+def archive_logs(before, root=ARCHIVE_DIR, batch_size=ARCHIVE_BATCH_SIZE, dry_run=False):
+    """
+    deleted_at が before より前の行をアーカイブへ移す。{日付: 件数} を返す。
+    バッチごとに日付別のセグメントを一時ファイル（.tmp）へ書いて fsync し、行の削除をコミットしてから
+    本来の名前に変える。削除に失敗した場合は一時ファイルを消すので、同じ行がアーカイブとテーブルの
+    両方に残ることはない。コミットと改名の間で止まった場合は、次の実行の最初に recover_pending() が片付ける。
+    日付の区切りは TIME_ZONE に従う。
+    """
+    queryset = DeletedUserLog.objects.filter(deleted_at__lt=before).order_by("deleted_at", "id")
+    if dry_run:
+        counts = queryset.order_by().annotate(day=TruncDate("deleted_at")).values("day").annotate(n=Count("id"))
+        return {row["day"]: row["n"] for row in counts.order_by("day")}
+
+    recover_pending(root)
+    archived = defaultdict(int)
+    while True:
+        rows = list(queryset.values(*LOG_FIELDS)[:batch_size])
+        if not rows:
+            break
+
+        by_day = defaultdict(list)
+        for row in rows:
+            by_day[timezone.localdate(row["deleted_at"])].append(row)
+
+        segment = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        pending = _write_pending(root, segment, by_day, [row["id"] for row in rows])
+        try:
+            with transaction.atomic():
+                DeletedUserLog.objects.filter(id__in=pending["ids"]).delete()
+        except Exception:
+            _discard(root, pending)
+            raise
+        _publish(root, pending)
+
+        for day, day_rows in by_day.items():
+            archived[day] += len(day_rows)
+        if len(rows) < batch_size:
+            break
+
+    return dict(archived)
+
+
+def _pending_path(root, segment):
+    return os.path.join(root, f".pending-{segment}.json")
+
+
+def _write_pending(root, segment, by_day, ids):
+    """セグメントを .tmp に書き、対象の id と一緒に控えを残す（どちらも fsync 済み）"""
+    pending = {"segment": segment, "ids": ids, "files": []}
+    for day, day_rows in by_day.items():
+        path = archive_path(root, day, segment)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                for row in day_rows:
+                    f.write(json.dumps(log_record(row), ensure_ascii=False).encode() + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        pending["files"].append(path)
+    _write_json(_pending_path(root, segment), pending)
+    return pending
+
+
+def _write_json(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(value, f, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _publish(root, pending):
+    for path in pending["files"]:
+        if os.path.exists(path + ".tmp"):
+            os.replace(path + ".tmp", path)
+    os.remove(_pending_path(root, pending["segment"]))
+
+
+def _discard(root, pending):
+    for path in pending["files"]:
+        if os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+    os.remove(_pending_path(root, pending["segment"]))
+
+
+def recover_pending(root=ARCHIVE_DIR):
+    """
+    前回の実行が途中で止まったセグメントを片付ける。対象の行がテーブルに残っていれば削除は
+    コミットされていないので破棄し、残っていなければコミット済みなので公開する。
+    """
+    if not os.path.isdir(root):
+        return
+    for filename in sorted(os.listdir(root)):
+        if not (filename.startswith(".pending-") and filename.endswith(".json")):
+            continue
+        with open(os.path.join(root, filename), encoding="utf-8") as f:
+            pending = json.load(f)
+        if DeletedUserLog.all_tenants.filter(id__in=pending["ids"]).exists():
+            _discard(root, pending)
+        else:
+            _publish(root, pending)
+
+
+def archive_files(root=ARCHIVE_DIR):
+    """アーカイブ済みの (日付, パス) を古い順に返す（同じ日付のセグメントは書いた順）"""
+    files = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith(".jsonl.gz"):
+                parts = filename.split(".")
+                # セグメント導入前の日付ファイル（YYYY-MM-DD.jsonl.gz）を先に読む
+                files.append((date.fromisoformat(parts[0]), len(parts), filename, os.path.join(dirpath, filename)))
+    return [(day, path) for day, _, _, path in sorted(files)]
+
+
+def archive_days(root=ARCHIVE_DIR):
+    """アーカイブ済みの日付を古い順に返す"""
+    return sorted({day for day, _ in archive_files(root)})
+
+
+def iter_archived(root=ARCHIVE_DIR, since=None, until=None):
+    """アーカイブの行（dict）を日付順に 1 行ずつ返す。since / until は date（両端を含む）"""
+    for day, path in archive_files(root):
+        if (since and day < since) or (until and day > until):
+            continue
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def iter_deleted_logs(root=ARCHIVE_DIR, since=None, until=None, tenant=UNSCOPED):
+    """
+    アーカイブとテーブルをまとめて古い順に返す。tenant（None は tenant が NULL）を渡すとそのテナントの行だけにする
+    （レスポンスを流す時点ではリクエストのテナントが外れていることがあるので、マネージャには頼らない）
+    """
+    for record in iter_archived(root, since, until):
+        if tenant is UNSCOPED or record.get("tenant_id") == tenant:
+            yield record
+
+    queryset = scope_queryset(DeletedUserLog.all_tenants.all(), tenant)
+    if since:
+        queryset = queryset.filter(deleted_at__date__gte=since)
+    if until:
+        queryset = queryset.filter(deleted_at__date__lte=until)
+    for row in iter_live_rows(queryset):
+        yield log_record(row)
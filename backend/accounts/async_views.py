@@ -0,0 +1,256 @@
+"""
+読み取り系エンドポイントの非同期版（ASGI で動かす）。
+DB 待ちの間もイベントループが他のリクエストを処理できるので、
+授業開始直後に /me/ が集中してもワーカーあたりの同時処理数が増える。
+settings.ACCOUNTS_ASYNC_READ_VIEWS = True のとき、urls.py が同期版と同じパスに割り当てる。
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.utils.timezone import now
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.pagination import Cursor
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.request import Request
+
+from points.permissions import IsTeacherOrAdmin
+from .authentication import CookieJWTAuthentication
+from .cache import aget_me_snapshot
+from .events import broker
+from .images import image_url, profile_image_urls
+from .models import User
+from .pagination import UsernameCursorPagination
+from .renderers import FastJSONRenderer
+from .routers import reads_from_replica, replica_reads
+from .views import (ACCOUNT_DETAIL_FIELDS, RESET_PAYLOAD, UserProfileMeView, account_delta_payload,
+                    account_delta_querysets, account_detail_payload, account_list_queryset, account_list_row,
+                    decode_sync_cursor, delta_is_stale, delta_is_too_large, encode_sync_cursor)
+
+# 無通信で切られないためのコメント行の間隔（秒）
+STREAM_HEARTBEAT = getattr(settings, "ACCOUNTS_EVENT_STREAM_HEARTBEAT", 25)
+# 1 接続の最長時間（秒）。切れたらブラウザが再接続し、その時点の Cookie で認証し直す
+STREAM_MAX_AGE = getattr(settings, "ACCOUNTS_EVENT_STREAM_MAX_AGE", 300)
+STREAM_RETRY_MS = getattr(settings, "ACCOUNTS_EVENT_STREAM_RETRY_MS", 3000)
+
+
+class AsyncAPIView(View):
+    """
+    DRF の APIView のうち、Cookie/JWT 認証・権限チェック・JSON 出力だけを行う非同期ビュー。
+    エラー時のレスポンス（ステータス・{"detail": ...}）は DRF と同じ形にする。
+    """
+    permission_classes = [IsAuthenticated]
+    authenticator = CookieJWTAuthentication()
+    renderer = FastJSONRenderer()
+    # True のビューは同期版の ReplicaReadMixin と同じくリードレプリカを読む
+    use_read_replica = False
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # APIView と同じく CSRF は認証側に任せる（Cookie 認証でも同期版と挙動を揃える）
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not (self.use_read_replica and reads_from_replica(request)):
+            return await self.handle(request, *args, **kwargs)
+        with replica_reads():
+            return await self.handle(request, *args, **kwargs)
+
+    async def handle(self, request, *args, **kwargs):
+        try:
+            await self.initial(request)
+        except exceptions.APIException as exc:
+            return self.handle_exception(exc)
+
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return self.handle_exception(exc)
+
+    async def initial(self, request):
+        result = await self.authenticator.aauthenticate(request)
+        if result is None:
+            request.user, request.auth = AnonymousUser(), None
+        else:
+            request.user, request.auth = result
+
+        for permission in (permission() for permission in self.permission_classes):
+            # 権限クラスは request.user / profile（取得済み）しか見ないので同期のまま呼べる
+            if not permission.has_permission(request, self):
+                if request.auth is None:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(getattr(permission, "message", None))
+
+    def handle_exception(self, exc):
+        response = self.respond(
+            exc.detail if isinstance(exc.detail, (list, dict)) else {"detail": exc.detail},
+            status=exc.status_code,
+        )
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            response["WWW-Authenticate"] = self.authenticator.authenticate_header(self.request)
+        return response
+
+    def respond(self, data=None, status=200):
+        body = b"" if data is None else self.renderer.render(data)
+        return HttpResponse(body, status=status, content_type="application/json")
+
+
+class AsyncMeView(AsyncAPIView):
+    use_read_replica = True
+
+    async def get(self, request):
+        snapshot = await aget_me_snapshot(request)
+        etag = snapshot["etag"]
+
+        # If-None-Match が一致すれば本文なしの 304
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+        if etag in if_none_match or "*" in if_none_match:
+            response = self.respond(status=304)
+        else:
+            response = self.respond(snapshot["data"])
+
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
+
+class MeStreamView(AsyncAPIView):
+    """
+    /me/ と同じ内容を Server-Sent Events で送り続ける。
+    接続直後に現在の値を送り、以降は残高・プロフィールが変わったときだけ送る。
+    """
+
+    async def get(self, request):
+        response = StreamingHttpResponse(self.stream(request), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # nginx にバッファさせない
+        return response
+
+    def event(self, name, data):
+        return b"event: " + name.encode() + b"\ndata: " + self.renderer.render(data) + b"\n\n"
+
+    async def stream(self, request):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STREAM_MAX_AGE
+
+        # 購読してから現在値を読む（間の変更を取りこぼさない）
+        async with broker.subscribe(request.user.pk) as events:
+            data = (await aget_me_snapshot(request))["data"]
+            yield f"retry: {STREAM_RETRY_MS}\n".encode() + self.event("me", data)
+
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    event = await asyncio.wait_for(events.get(), min(STREAM_HEARTBEAT, remaining))
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+
+                if event["type"] == "balance":
+                    # 残高だけならクエリせずに差し替える
+                    if event["point_balance"] == data["point_balance"]:
+                        continue
+                    data = {**data, "point_balance": event["point_balance"]}
+                elif event["type"] != "deleted":
+                    try:
+                        data = (await aget_me_snapshot(request, refresh=True))["data"]
+                    except User.DoesNotExist:
+                        event = {"type": "deleted"}
+
+                if event["type"] == "deleted":
+                    yield self.event("logout", {})
+                    return
+                yield self.event("me", data)
+
+
+class AsyncUserProfileMeView(AsyncAPIView):
+    """GET だけ非同期。PATCH（画像アップロードを含む）は同期版にそのまま渡す"""
+    sync_view = staticmethod(UserProfileMeView.as_view())
+
+    async def get(self, request):
+        user = request.user
+        profile = user.profile
+
+        return self.respond({
+            "name": user.name or user.username,
+            "comment": profile.comment,
+            "image": image_url(profile.image),
+            **profile_image_urls(profile),
+        })
+
+    async def patch(self, request):
+        return await sync_to_async(self.sync_view)(request)
+
+
+class AsyncAccountsListView(AsyncAPIView):
+    use_read_replica = True
+    permission_classes = [IsAuthenticated, IsTeacherOrAdmin]
+
+    async def get(self, request):
+        sync_cursor = encode_sync_cursor(now())
+        if "since" in request.GET:
+            return await self.get_delta(request, sync_cursor)
+
+        # クエリパラメータとカーソルの解釈は同期版（DRF の CursorPagination）と共通
+        drf_request = Request(request)
+        paginator = UsernameCursorPagination()
+        paginator.base_url = request.build_absolute_uri()
+        page_size = paginator.get_page_size(drf_request)
+        cursor = paginator.decode_cursor(drf_request)
+        users = account_list_queryset(drf_request.query_params)
+
+        # username は一意なので、カーソルの位置より後（前）を LIMIT で取るだけでよい
+        reverse = cursor is not None and cursor.reverse
+        if cursor is not None and cursor.position is not None:
+            users = users.filter(**{"username__lt" if reverse else "username__gt": cursor.position})
+        if reverse:
+            users = users.order_by("-username")
+
+        rows = [row async for row in users[:page_size + 1]]
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        has_next = not reverse and has_more or reverse and bool(rows)
+        has_previous = reverse and has_more or not reverse and cursor is not None and bool(rows)
+
+        return self.respond({
+            "next": paginator.encode_cursor(Cursor(0, False, rows[-1]["username"])) if has_next else None,
+            "previous": paginator.encode_cursor(Cursor(0, True, rows[0]["username"])) if has_previous else None,
+            "results": [account_list_row(u) for u in rows],
+            "cursor": sync_cursor,
+        })
+
+    async def get_delta(self, request, sync_cursor):
+        since = decode_sync_cursor(request.GET["since"])
+        if delta_is_stale(since):
+            return self.respond(RESET_PAYLOAD)
+
+        user_ids, profile_ids, deleted_ids = [
+            [user_id async for user_id in queryset] for queryset in account_delta_querysets(since)
+        ]
+        changed_ids = set(user_ids) | set(profile_ids)
+        if delta_is_too_large(changed_ids, deleted_ids):
+            return self.respond(RESET_PAYLOAD)
+
+        rows = []
+        if changed_ids:
+            rows = [row async for row in account_list_queryset(request.GET).filter(id__in=changed_ids)]
+        return self.respond(account_delta_payload(rows, changed_ids, deleted_ids, sync_cursor))
+
+
+class AsyncAccountDetailView(AsyncAPIView):
+    use_read_replica = True
+    permission_classes = [IsAuthenticated, IsTeacherOrAdmin]
+
+    async def get(self, request, user_id):
+        user = await User.objects.filter(id=user_id).values(*ACCOUNT_DETAIL_FIELDS).afirst()
+        if user is None:
+            return self.respond({"error": "ユーザーが存在しません"}, status=404)
+
+        return self.respond(account_detail_payload(user))
@@ -0,0 +1,184 @@
+"""
+アカウントの監査ログ（ログイン成否・退会・再開・削除・プロフィール編集など）。
+ビューは record() でプロセス内のバッファに積むだけで、INSERT はバックグラウンドの writer が
+件数（AUDIT_FLUSH_SIZE）か時間（AUDIT_FLUSH_INTERVAL 秒）のどちらかに達したら bulk_create でまとめて行う。
+writer が動いていれば、プロセス終了時（atexit）に残りを書き出してから止まる。
+"""
+import atexit
+import ipaddress
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.timezone import now
+
+from .models import AuditEvent
+from .tenancy import current_tenant, is_scoped
+from .throttling import client_ident
+
+logger = logging.getLogger(__name__)
+
+AUDIT_FLUSH_SIZE = getattr(settings, "ACCOUNTS_AUDIT_FLUSH_SIZE", 200)
+AUDIT_FLUSH_INTERVAL = getattr(settings, "ACCOUNTS_AUDIT_FLUSH_INTERVAL", 1.0)
+# writer が追いつかない場合に溜める上限（超えたら古いものから捨てて dropped に数える）
+AUDIT_BUFFER_LIMIT = getattr(settings, "ACCOUNTS_AUDIT_BUFFER_LIMIT", 50000)
+
+
+def client_ip(request):
+    """NUM_PROXIES に従って決めたクライアント IP。IP として読めない値は None（ip 列に入らないため）"""
+    try:
+        return str(ipaddress.ip_address(client_ident(request)))
+    except ValueError:
+        return None
+
+
+class AuditLog:
+    def __init__(self, flush_size=AUDIT_FLUSH_SIZE, flush_interval=AUDIT_FLUSH_INTERVAL,
+                 limit=AUDIT_BUFFER_LIMIT):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._buffer = deque(maxlen=limit)
+        self._wakeup = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def record(self, action, actor_id=None, target_id=None, request=None, tenant_id=None, **detail):
+        """
+        イベントを 1 件積む（DB には触らない）。
+        tenant_id を省くとリクエストのテナント（管理者・リクエストの外では NULL）で記録する。
+        """
+        if not getattr(settings, "ACCOUNTS_AUDIT_ENABLED", True):
+            return
+        if tenant_id is None and is_scoped():
+            tenant_id = current_tenant()
+        event = (action, actor_id, target_id, client_ip(request) if request is not None else None,
+                 tenant_id, detail, now())
+        with self._wakeup:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append(event)
+            self.recorded += 1
+            if len(self._buffer) >= self.flush_size:
+                self._wakeup.notify()
+
+        if self._thread is None and getattr(settings, "ACCOUNTS_AUDIT_BACKGROUND", True):
+            self._start()
+
+    def _start(self):
+        with self._wakeup:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="accounts-audit-writer", daemon=True)
+                self._thread.start()
+
+    def _take(self, limit):
+        with self._wakeup:
+            return [self._buffer.popleft() for _ in range(min(limit, len(self._buffer)))]
+
+    def flush(self):
+        """溜まっている分をすべて書き出し、書いた件数を返す"""
+        total = 0
+        while batch := self._take(self.flush_size):
+            events = [
+                AuditEvent(action=action, actor_id=actor_id, target_id=target_id, ip=ip,
+                           tenant_id=tenant_id, detail=detail, created_at=created_at)
+                for action, actor_id, target_id, ip, tenant_id, detail, created_at in batch
+            ]
+            try:
+                AuditEvent.objects.bulk_create(events)
+                written = len(events)
+            except Exception:
+                # 1 件の不正な値でバッチ全体を失わないよう、1 件ずつ入れ直す
+                logger.exception("failed to write %d audit events, retrying one by one", len(events))
+                written = self._write_each(events)
+            self.written += written
+            total += written
+        return total
+
+    def _write_each(self, events):
+        written = 0
+        for event in events:
+            try:
+                event.save(force_insert=True)
+                written += 1
+            except Exception:
+                logger.exception("failed to write audit event %s", event.action)
+                self.failed += 1
+        return written
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closed and len(self._buffer) < self.flush_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._wakeup.wait(remaining)
+                closed = self._closed
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+            if closed:
+                return
+
+    def close(self, timeout=10):
+        """writer を止め、残りを書き出す（atexit から呼ばれる）"""
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def stats(self):
+        with self._wakeup:
+            return {
+                "buffered": len(self._buffer),
+                "recorded": self.recorded,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+            }
+
+
+audit_log = AuditLog()
+
+
+@atexit.register
+def _close_on_exit():
+    # writer を起動していない場合（テストなど）は、終了時に勝手に書き出さない
+    if audit_log.running:
+        audit_log.close()
+
+
+def record(action, actor_id=None, target_id=None, request=None, tenant_id=None, **detail):
+    audit_log.record(action, actor_id=actor_id, target_id=target_id, request=request, tenant_id=tenant_id, **detail)
+
+
+def query_events(actor_id=None, target_id=None, actions=None, since=None, until=None):
+    """保存済みの監査ログを絞り込む（新しい順の QuerySet を返す。リクエストのテナントの分だけ）"""
+    events = AuditEvent.objects.order_by("-created_at", "-id")
+    if actor_id is not None:
+        events = events.filter(actor_id=actor_id)
+    if target_id is not None:
+        events = events.filter(target_id=target_id)
+    if actions:
+        events = events.filter(action__in=actions)
+    if since is not None:
+        events = events.filter(created_at__gte=since)
+    if until is not None:
+        events = events.filter(created_at__lt=until)
+    return events
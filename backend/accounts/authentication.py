@@ -14,12 +14,30 @@
 #         validated_token = self.get_validated_token(raw_token)
 #         return self.get_user(validated_token), validated_token
 # accounts/authentication.py
+from asgiref.sync import sync_to_async
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .cache import cache_user, get_cached_user
+from .profiling import timed
+from .revocation import revocations
+from .tenancy import activate_tenant
 
 class CookieJWTAuthentication(JWTAuthentication):
     def authenticate(self, request):
+        # Server-Timing の auth（計測していなければそのまま）
+        with timed("auth"):
+            return self._authenticate(request)
+
+    async def aauthenticate(self, request):
+        """authenticate の非同期版（accounts.async_views 用、Django の HttpRequest を受け取る）"""
+        with timed("auth"):
+            return await self._aauthenticate(request)
+
+    def _authenticate(self, request):
         # 1) Authorizationヘッダ優先（Bearer対応）
         header_auth = super().authenticate(request)
         if header_auth is not None:
@@ -36,3 +54,80 @@ class CookieJWTAuthentication(JWTAuthentication):
         except InvalidToken:
             # ★ここで500を出さず401にする（Cookieはここで消さない）
             raise AuthenticationFailed("Invalid or expired token")
+
+    async def _aauthenticate(self, request):
+        raw_token = None
+        header = self.get_header(request)
+        if header is not None:
+            raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            raw_token = request.COOKIES.get('access_token')
+        if not raw_token:
+            return None
+
+        try:
+            validated_token = self.get_validated_token(raw_token)
+        except InvalidToken:
+            raise AuthenticationFailed("Invalid or expired token")
+        return await self.aget_user(validated_token), validated_token
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+    def get_user(self, validated_token):
+        # JWTAuthentication.get_user と同じ検証を、profile 込みのキャッシュ越しに行う
+        user_id = self.get_user_id(validated_token)
+        revocations.sync_if_due()
+
+        user = get_cached_user(user_id)
+        if user is None:
+            try:
+                user = (
+                    self.user_model.objects
+                    .select_related("profile")
+                    .get(**{api_settings.USER_ID_FIELD: user_id})
+                )
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed("User not found", code="user_not_found")
+            cache_user(user)
+
+        return self.check_user(user, validated_token)
+
+    async def aget_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        if revocations.sync_due():
+            await sync_to_async(revocations.sync)()
+
+        user = get_cached_user(user_id)
+        if user is None:
+            try:
+                user = await (
+                    self.user_model.objects
+                    .select_related("profile")
+                    .aget(**{api_settings.USER_ID_FIELD: user_id})
+                )
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed("User not found", code="user_not_found")
+            cache_user(user)
+
+        return self.check_user(user, validated_token)
+
+    def check_user(self, user, validated_token):
+        if not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+
+        # ログアウト・退会・削除で失効したトークン（プロセス内の一覧を引くだけ）
+        if revocations.is_revoked(validated_token):
+            raise AuthenticationFailed("Token has been revoked", code="token_revoked")
+
+        # 以降のこのリクエストのクエリをユーザーのテナントに絞る（accounts.tenancy）
+        activate_tenant(user)
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed("The user's password has been changed.", code="password_changed")
+
+        return user
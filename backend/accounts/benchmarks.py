@@ -0,0 +1,246 @@
+import itertools
+import statistics
+import time
+import tracemalloc
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .cache import auth_user_cache
+from .models import UserProfile
+from .revocation import revocations
+from .seeding import BENCH_PASSWORD
+from .throttling import backend as throttle_backend
+from .views import encode_sync_cursor
+
+
+# トランザクション制御文は実行環境（TestCase の savepoint など）で数が変わるので予算に含めない
+TRANSACTION_STATEMENTS = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT", "BEGIN", "COMMIT")
+
+
+def data_statements(captured):
+    return [
+        q["sql"] for q in captured
+        if not q["sql"].upper().startswith(TRANSACTION_STATEMENTS)
+    ]
+
+
+def client_for(user=None):
+    client = APIClient()
+    if user is not None:
+        refresh = RefreshToken.for_user(user)
+        client.cookies["access_token"] = str(refresh.access_token)
+        client.cookies["refresh_token"] = str(refresh)
+    return client
+
+
+def reset_caches():
+    cache.clear()
+    auth_user_cache.clear()
+    revocations.reset()
+
+
+def reset_throttles():
+    # 同じ IP・同じユーザーで繰り返し叩くので、ログイン・登録の制限に掛からないようにする
+    throttle_backend.clear()
+
+
+class BenchContext:
+    """seed_accounts() の結果からベンチ用のクライアントと対象ユーザーを用意する"""
+
+    def __init__(self, seeded):
+        self.prefix = reverse("me")[:-len("me/")]
+        self.admin = seeded["admin"]
+        self.teacher = seeded["teachers"][0]
+        self.students = seeded["students"]
+        self.student = UserProfile.objects.select_related("user").get(user_id=self.students[0]).user
+
+        self.anonymous = client_for()
+        self.student_client = client_for(self.student)
+        self.teacher_client = client_for(self.teacher)
+        self.admin_client = client_for(self.admin)
+
+        # 書き込み系のルートは毎回別の生徒を対象にする（先頭は閲覧用に残す）
+        self._targets = iter(self.students[1:])
+        self._serial = itertools.count()
+
+    def url(self, path):
+        return self.prefix + path
+
+    def take(self, count=1, inactive=False):
+        ids = [next(self._targets) for _ in range(count)]
+        if inactive:
+            UserProfile.objects.filter(user_id__in=ids).update(is_active_student=False)
+        return ids
+
+    def serial(self):
+        return next(self._serial)
+
+
+class Route:
+    """
+    budget: キャッシュが空の状態での最大クエリ数（認証を含み、トランザクション制御文は除く）
+    setup:  計測前に実行する準備（戻り値が call に渡る）
+    """
+
+    def __init__(self, name, budget, call, setup=None):
+        self.name = name
+        self.budget = budget
+        self.call = call
+        self.setup = setup or (lambda ctx: None)
+
+
+def _signup(ctx):
+    n = ctx.serial()
+    return {"username": f"signup_{n}", "email": f"signup_{n}@example.com", "password": BENCH_PASSWORD, "name": "x"}
+
+
+def _bulk_rows(ctx):
+    n = ctx.serial()
+    return {"students": [
+        {"username": f"bulk_{n}_{i}", "email": f"bulk_{n}_{i}@example.com", "password": BENCH_PASSWORD}
+        for i in range(10)
+    ]}
+
+
+def _drain(response):
+    """ストリーミングの本文は読み進めるときにクエリを出すので、計測の範囲内で読み切る"""
+    if response.streaming:
+        b"".join(response.streaming_content)
+    return response
+
+
+# logout / 退会 / 削除はトークンの失効を 1 文（bulk_create）で記録する
+ROUTES = [
+    Route("signup", 3,
+          lambda ctx, body: ctx.anonymous.post(ctx.url("signup/"), body, format="json"),
+          setup=_signup),
+    Route("login", 2,
+          lambda ctx, _: ctx.anonymous.post(
+              ctx.url("login/"), {"username": ctx.student.username, "password": BENCH_PASSWORD}, format="json")),
+    # logout はクライアントの Cookie を消すので使い捨てのクライアントで呼ぶ
+    Route("logout", 2,
+          lambda ctx, client: client.post(ctx.url("logout/")),
+          setup=lambda ctx: client_for(ctx.student)),
+    Route("token-refresh", 1,
+          lambda ctx, _: ctx.anonymous.post(
+              ctx.url("token/refresh/"), {"refresh": str(RefreshToken.for_user(ctx.student))}, format="json")),
+    Route("clear-tokens", 0,
+          lambda ctx, _: ctx.anonymous.post(ctx.url("clear-tokens/"))),
+    Route("csrf", 0,
+          lambda ctx, _: ctx.anonymous.get(ctx.url("csrf/"))),
+    Route("me", 2,
+          lambda ctx, _: ctx.student_client.get(ctx.url("me/"))),
+    Route("bootstrap", 2,
+          lambda ctx, _: ctx.student_client.get(ctx.url("bootstrap/"))),
+    Route("bootstrap-anonymous", 0,
+          lambda ctx, _: ctx.anonymous.get(ctx.url("bootstrap/"))),
+    Route("profile-me-get", 1,
+          lambda ctx, _: ctx.student_client.get(ctx.url("profile/me/"))),
+    Route("profile-me-patch", 2,
+          lambda ctx, _: ctx.student_client.patch(ctx.url("profile/me/"), {"comment": "hi"}, format="json")),
+    Route("register", 3,
+          lambda ctx, body: ctx.anonymous.post(ctx.url("register/"), body, format="json"),
+          setup=_signup),
+    Route("register-bulk", 5,
+          lambda ctx, body: ctx.teacher_client.post(ctx.url("register/bulk/"), body, format="json"),
+          setup=_bulk_rows),
+    Route("account-list", 2,
+          lambda ctx, _: ctx.teacher_client.get(ctx.url("account/list/"))),
+    Route("account-list-delta", 5,
+          lambda ctx, cursor: ctx.teacher_client.get(ctx.url(f"account/list/?since={cursor}")),
+          setup=lambda ctx: encode_sync_cursor(now())),
+    # EXPORT_CHUNK_SIZE ごとに 1 クエリ（ベンチの名簿は 1 チャンクに収まる）
+    Route("account-export", 2,
+          lambda ctx, _: _drain(ctx.teacher_client.get(ctx.url("account/export/?output=csv&role=student")))),
+    Route("account-export-jsonl", 2,
+          lambda ctx, _: _drain(ctx.teacher_client.get(ctx.url("account/export/?output=jsonl")))),
+    Route("account-detail", 2,
+          lambda ctx, _: ctx.teacher_client.get(ctx.url(f"account/{ctx.student.id}/detail/"))),
+    Route("account-deactivate", 5,
+          lambda ctx, ids: ctx.teacher_client.post(ctx.url(f"account/{ids[0]}/deactivate/")),
+          setup=lambda ctx: ctx.take()),
+    Route("account-reactivate", 4,
+          lambda ctx, ids: ctx.teacher_client.post(ctx.url(f"account/{ids[0]}/reactivate/")),
+          setup=lambda ctx: ctx.take(inactive=True)),
+    Route("account-delete", 12,
+          lambda ctx, ids: ctx.teacher_client.delete(ctx.url(f"account/{ids[0]}/delete/")),
+          setup=lambda ctx: ctx.take(inactive=True)),
+    Route("deleted-logs", 2,
+          lambda ctx, _: ctx.teacher_client.get(ctx.url("account/deleted/logs/"))),
+    # アーカイブ分はファイルから読むので、テーブル側は ARCHIVE_BATCH_SIZE ごとに 1 クエリ
+    Route("deleted-logs-export", 2,
+          lambda ctx, _: _drain(ctx.teacher_client.get(ctx.url("account/deleted/logs/export/")))),
+    Route("bulk-deactivate", 4,
+          lambda ctx, ids: ctx.teacher_client.post(
+              ctx.url("account/bulk/deactivate/"), {"user_ids": [str(i) for i in ids]}, format="json"),
+          setup=lambda ctx: ctx.take(10)),
+    Route("bulk-reactivate", 3,
+          lambda ctx, ids: ctx.teacher_client.post(
+              ctx.url("account/bulk/reactivate/"), {"user_ids": [str(i) for i in ids]}, format="json"),
+          setup=lambda ctx: ctx.take(10, inactive=True)),
+    Route("bulk-delete", 13,
+          lambda ctx, ids: ctx.teacher_client.post(
+              ctx.url("account/bulk/delete/"), {"user_ids": [str(i) for i in ids]}, format="json"),
+          setup=lambda ctx: ctx.take(10, inactive=True)),
+    Route("class-roster", 3,
+          lambda ctx, _: ctx.teacher_client.get(ctx.url("account/classes/roster/?class_ref=1&class_ref=2"))),
+    Route("metrics", 1,
+          lambda ctx, _: ctx.admin_client.get(ctx.url("metrics/"))),
+    Route("audit-events", 2,
+          lambda ctx, _: ctx.teacher_client.get(ctx.url("audit/?action=login_success,deactivate"))),
+]
+
+
+def count_queries(ctx, route):
+    """キャッシュを空にして 1 回呼び、(レスポンス, クエリ数) を返す"""
+    prepared = route.setup(ctx)
+    reset_caches()
+    reset_throttles()
+    # 失効一覧の同期は同期間隔ごとに 1 回なので、リクエストの予算には含めない
+    revocations.sync()
+    with CaptureQueriesContext(connection) as queries:
+        response = route.call(ctx, prepared)
+    return response, len(data_statements(queries.captured_queries))
+
+
+def measure(ctx, route, iterations, warm=False):
+    """クエリ数・p50/p99 レイテンシ(ms)・ピークメモリ(KiB) を計測する"""
+    response, queries = count_queries(ctx, route)
+
+    timings = []
+    for _ in range(iterations):
+        prepared = route.setup(ctx)
+        if not warm:
+            reset_caches()
+        reset_throttles()
+        started = time.perf_counter()
+        route.call(ctx, prepared)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    prepared = route.setup(ctx)
+    if not warm:
+        reset_caches()
+    reset_throttles()
+    tracemalloc.start()
+    try:
+        route.call(ctx, prepared)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "route": route.name,
+        "status": response.status_code,
+        "queries": queries,
+        "budget": route.budget,
+        "p50_ms": round(statistics.median(timings), 2),
+        "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 2),
+        "peak_kib": round(peak / 1024, 1),
+    }
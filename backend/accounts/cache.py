@@ -0,0 +1,225 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+
+from points.models import PointManager
+from .models import User, UserProfile
+from .routers import replica_cache_timeout
+from .tenancy import UNSCOPED, current_tenant
+
+ME_SNAPSHOT_TIMEOUT = getattr(settings, "ACCOUNTS_ME_CACHE_TIMEOUT", 300)
+CLASS_TOTALS_TIMEOUT = getattr(settings, "ACCOUNTS_CLASS_TOTALS_TIMEOUT", 600)
+AUTH_USER_CACHE_SIZE = getattr(settings, "ACCOUNTS_AUTH_USER_CACHE_SIZE", 1024)
+AUTH_USER_CACHE_TTL = getattr(settings, "ACCOUNTS_AUTH_USER_CACHE_TTL", 30)
+
+
+def me_snapshot_key(user_id):
+    return f"accounts:me:{user_id}"
+
+
+def with_point_balance(queryset):
+    """point_balance を相関サブクエリとして同じ SELECT に載せる"""
+    balance = PointManager.objects.filter(user=OuterRef("pk")).values("point_balance")[:1]
+    return queryset.annotate(prefetched_point_balance=Subquery(balance))
+
+
+# =======================================
+# /me/ スナップショット
+# =======================================
+ME_SNAPSHOT_FIELDS = (
+    "id", "username", "name", "prefetched_point_balance",
+    "profile__image", "profile__image_thumb", "profile__image_medium",
+    "profile__role", "profile__is_totp_verified",
+)
+
+
+def me_snapshot_queryset(user_id):
+    # 必要なカラムだけを 1 クエリで取得（User + profile + point_balance）
+    return with_point_balance(User.objects.filter(pk=user_id)).values(*ME_SNAPSHOT_FIELDS)
+
+
+def snapshot_from_row(row, base):
+    from .images import image_url, variant_urls
+
+    image = image_url(row["profile__image"])
+    variants = variant_urls(row["profile__image"], row["profile__image_thumb"], row["profile__image_medium"])
+
+    # MeView / async_views.me / BootstrapView の "user" が返す形（フロントの AuthContext が読む）
+    data = {
+        "id": str(row["id"]),
+        "username": row["username"],
+        "name": row["name"],
+        "profile": {
+            "image": urljoin(base, image) if image else None,
+            "image_thumb": urljoin(base, variants["image_thumb"]) if variants["image_thumb"] else None,
+            "image_medium": urljoin(base, variants["image_medium"]) if variants["image_medium"] else None,
+            "role": row["profile__role"],
+            "is_totp_verified": row["profile__is_totp_verified"],
+        },
+        "point_balance": row["prefetched_point_balance"] or 0,
+    }
+
+    body = json.dumps(data, sort_keys=True)
+    etag = '"%s"' % hashlib.md5(body.encode()).hexdigest()
+
+    return {"data": data, "etag": etag}
+
+
+def build_me_snapshot(request):
+    return snapshot_from_row(me_snapshot_queryset(request.user.pk).get(), request.build_absolute_uri("/"))
+
+
+def get_me_snapshot(request):
+    key = me_snapshot_key(request.user.pk)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_me_snapshot(request)
+        cache.set(key, snapshot, replica_cache_timeout(ME_SNAPSHOT_TIMEOUT))
+    return snapshot
+
+
+async def aget_me_snapshot(request, refresh=False):
+    key = me_snapshot_key(request.user.pk)
+    snapshot = None if refresh else await cache.aget(key)
+    if snapshot is None:
+        row = await me_snapshot_queryset(request.user.pk).aget()
+        snapshot = snapshot_from_row(row, request.build_absolute_uri("/"))
+        await cache.aset(key, snapshot, replica_cache_timeout(ME_SNAPSHOT_TIMEOUT))
+    return snapshot
+
+
+def invalidate_me_snapshot(*user_ids):
+    cache.delete_many([me_snapshot_key(user_id) for user_id in user_ids])
+
+
+# =======================================
+# クラスごとの集計（在籍数・ポイント合計）
+# =======================================
+# クラスは複数のテナントにまたがり得るので、集計はテナントごと（管理者向けは全体）に持つ
+def class_totals_key(class_id, tenant=UNSCOPED):
+    scope = "all" if tenant is UNSCOPED else tenant if tenant is not None else "none"
+    return f"accounts:class_totals:{scope}:{class_id}"
+
+
+def get_class_totals(class_ids):
+    """
+    {class_id: {"active_count", "total_points"}} を返す。未キャッシュ分だけ 1 クエリで集計する。
+    リクエストのテナントの生徒だけを数える。
+    """
+    tenant = current_tenant()
+    keys = {class_totals_key(class_id, tenant): class_id for class_id in class_ids}
+    cached = cache.get_many(list(keys))
+    totals = {keys[key]: value for key, value in cached.items()}
+
+    missing = [class_id for class_id in class_ids if class_id not in totals]
+    if missing:
+        rows = (
+            UserProfile.objects
+            .filter(class_ref_id__in=missing, role="student")
+            .values("class_ref_id")
+            .annotate(
+                active_count=Count("pk", filter=Q(is_active_student=True), distinct=True),
+                total_points=Sum("user__pointmanager__point_balance"),
+            )
+        )
+        computed = {class_id: {"active_count": 0, "total_points": 0} for class_id in missing}
+        for row in rows:
+            computed[row["class_ref_id"]] = {
+                "active_count": row["active_count"],
+                "total_points": row["total_points"] or 0,
+            }
+        cache.set_many(
+            {class_totals_key(class_id, tenant): value for class_id, value in computed.items()},
+            CLASS_TOTALS_TIMEOUT,
+        )
+        totals.update(computed)
+
+    return totals
+
+
+def invalidate_class_totals(*class_ids, tenant_id=None):
+    """変更された生徒のテナント（tenant_id）の集計と、全体の集計を破棄する"""
+    keys = [
+        class_totals_key(class_id, tenant)
+        for class_id in class_ids if class_id is not None
+        for tenant in (UNSCOPED, tenant_id)
+    ]
+    if keys:
+        cache.delete_many(keys)
+
+
+# =======================================
+# 認証ユーザーのプロセス内キャッシュ
+# =======================================
+class TTLCache:
+    """
+    件数上限つきの TTL/LRU キャッシュ（プロセス内・スレッドセーフ）。
+    ワーカー間では共有されないので、他プロセスでの変更は TTL 経過で反映される。
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+auth_user_cache = TTLCache(AUTH_USER_CACHE_SIZE, AUTH_USER_CACHE_TTL)
+
+
+def get_cached_user(user_id):
+    """profile 込みの User を返す（キャッシュ上のインスタンスはリクエスト間で共有しない）"""
+    user = auth_user_cache.get(str(user_id))
+    return copy.deepcopy(user) if user is not None else None
+
+
+def cache_user(user):
+    auth_user_cache.set(str(user.pk), copy.deepcopy(user), replica_cache_timeout(auth_user_cache.ttl))
+
+
+def invalidate_cached_user(*user_ids):
+    auth_user_cache.delete(*(str(user_id) for user_id in user_ids))
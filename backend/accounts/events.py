@@ -0,0 +1,109 @@
+"""
+ユーザーごとの変更通知（/me/stream/ の SSE 用）。
+PointManager / UserProfile / User の保存シグナルからコミット後に publish し、
+購読中の接続だけが受け取る。待機中の接続は asyncio.Queue を 1 つ持つだけなので、
+/me/ をポーリングするより遥かに安い。
+
+配信先の管理は backend に任せる。既定の LocalEventBackend は同一プロセス内だけで配るので、
+複数ワーカーで動かす場合は settings.ACCOUNTS_EVENT_BACKEND に
+Redis の pub/sub などを使う backend（publish / subscribe / unsubscribe を持つクラス）を指定する。
+"""
+import asyncio
+import itertools
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+EVENT_BACKEND = getattr(settings, "ACCOUNTS_EVENT_BACKEND", "accounts.events.LocalEventBackend")
+# 1 接続あたりに溜める件数の上限（超えたら溜まった分を捨てて全体の再取得を促す）
+EVENT_QUEUE_SIZE = getattr(settings, "ACCOUNTS_EVENT_QUEUE_SIZE", 16)
+
+
+class LocalEventBackend:
+    """同一プロセス内の購読者に配る（callback はスレッドセーフであること）"""
+
+    def __init__(self):
+        self._subscribers = defaultdict(dict)
+        self._handles = itertools.count()
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event):
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, {}).values())
+        for callback in callbacks:
+            callback(event)
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            handle = next(self._handles)
+            self._subscribers[channel][handle] = callback
+        return handle
+
+    def unsubscribe(self, channel, handle):
+        with self._lock:
+            callbacks = self._subscribers.get(channel)
+            if callbacks is not None:
+                callbacks.pop(handle, None)
+                if not callbacks:
+                    del self._subscribers[channel]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "channels": len(self._subscribers),
+                "subscribers": sum(len(callbacks) for callbacks in self._subscribers.values()),
+            }
+
+
+class EventBroker:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def publish(self, user_id, event):
+        self.backend.publish(str(user_id), event)
+
+    def publish_on_commit(self, user_id, event):
+        # コミット前に通知すると、受け取った側が古い行を読んでしまう
+        transaction.on_commit(lambda: self.publish(user_id, event))
+
+    @asynccontextmanager
+    async def subscribe(self, user_id):
+        """呼び出し元のイベントループで受け取る asyncio.Queue を返す"""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+
+        def put(event):
+            if events.full():
+                # 遅れている接続には差分ではなく全体を送り直させる
+                while not events.empty():
+                    events.get_nowait()
+                event = {"type": "resync"}
+            events.put_nowait(event)
+
+        def deliver(event):
+            # publish はコミット後のフックから呼ばれるので、ループが閉じていても書き込み側に例外を返さない
+            try:
+                loop.call_soon_threadsafe(put, event)
+            except RuntimeError:  # ワーカーの終了などでループが閉じた。以降は配らない
+                self.backend.unsubscribe(str(user_id), handle)
+
+        handle = self.backend.subscribe(str(user_id), deliver)
+        try:
+            yield events
+        finally:
+            self.backend.unsubscribe(str(user_id), handle)
+
+    def stats(self):
+        stats = getattr(self.backend, "stats", None)
+        return stats() if stats is not None else {}
+
+
+broker = EventBroker(import_string(EVENT_BACKEND)())
+
+
+def publish_user_event(user_id, event_type, **payload):
+    broker.publish_on_commit(user_id, {"type": event_type, **payload})
@@ -0,0 +1,127 @@
+"""
+全アカウントのエクスポート（CSV / JSONL）。
+User に profile・ClassMaster・PointManager を JOIN した行を username のキーセットで
+EXPORT_CHUNK_SIZE 件ずつ読み、読んだ分から書き出す。メモリは 1 チャンク分で一定で、
+最初のチャンクを読んだ時点でレスポンスが流れ始める。
+ASGI で動かすときは streaming_response() が非同期のイテレータに包む（Django は同期のイテレータを
+sync_to_async(list) で全部読んでから送るため）。
+"""
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+from .models import User
+
+EXPORT_CHUNK_SIZE = getattr(settings, "ACCOUNTS_EXPORT_CHUNK_SIZE", 2000)
+# ClassMaster の表示名のフィールド（指定すると class_name 列を JOIN して出す）
+EXPORT_CLASS_LABEL_FIELD = getattr(settings, "ACCOUNTS_EXPORT_CLASS_LABEL_FIELD", None)
+
+EXPORT_COLUMNS = (
+    "id", "username", "name", "email", "role", "class_ref", "is_active_student", "point_balance", "created_at",
+)
+
+
+def export_fields():
+    fields = [
+        "id", "username", "name", "email", "created_at", "profile__role", "profile__class_ref_id",
+        "profile__is_active_student", "pointmanager__point_balance",
+    ]
+    if EXPORT_CLASS_LABEL_FIELD:
+        fields.append(f"profile__class_ref__{EXPORT_CLASS_LABEL_FIELD}")
+    return fields
+
+
+def export_columns():
+    return EXPORT_COLUMNS + (("class_name",) if EXPORT_CLASS_LABEL_FIELD else ())
+
+
+def export_record(row):
+    record = {
+        "id": str(row["id"]),
+        "username": row["username"],
+        "name": row["name"],
+        "email": row["email"],
+        "role": row["profile__role"],
+        "class_ref": row["profile__class_ref_id"],
+        "is_active_student": row["profile__is_active_student"],
+        "point_balance": row["pointmanager__point_balance"] or 0,
+        "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+    }
+    if EXPORT_CLASS_LABEL_FIELD:
+        record["class_name"] = row[f"profile__class_ref__{EXPORT_CLASS_LABEL_FIELD}"]
+    return record
+
+
+def iter_accounts(queryset=None, chunk_size=None):
+    """
+    username 順に 1 件ずつ返す。チャンクごとに短いクエリを投げるので、
+    長時間のサーバーサイドカーソルやトランザクションを開いたままにしない
+    """
+    queryset = (queryset if queryset is not None else User.objects.all()).order_by("username")
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    last = None
+    while True:
+        batch = queryset if last is None else queryset.filter(username__gt=last)
+        rows = list(batch.values(*export_fields())[:chunk_size])
+        for row in rows:
+            yield export_record(row)
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]["username"]
+
+
+class _Echo:
+    """csv.writer の書き込み先（書いた 1 行をそのまま返す）"""
+
+    def write(self, value):
+        return value
+
+
+# 表計算ソフトで数式として解釈される先頭文字（CSV インジェクション）
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def csv_cell(value):
+    """生徒が入力できる値が数式として実行されないよう、先頭に ' を付ける"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv(records):
+    writer = csv.writer(_Echo())
+    columns = export_columns()
+    # Excel で開いても日本語が化けないように BOM を付ける
+    yield "\ufeff" + writer.writerow(columns)
+    for record in records:
+        yield writer.writerow([csv_cell(record[column]) for column in columns])
+
+
+def iter_jsonl(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+# ASGI で 1 回のスレッド呼び出しで読む行数
+ASYNC_STREAM_LINES = getattr(settings, "ACCOUNTS_EXPORT_ASYNC_LINES", 500)
+
+
+async def aiter_lines(lines, size=None):
+    """同期のイテレータを size 行ずつスレッドで読みながら返す（同じスレッドなので DB 接続も同じ）"""
+    size = size or ASYNC_STREAM_LINES
+    iterator = iter(lines)
+    take = sync_to_async(lambda: "".join(islice(iterator, size)), thread_sensitive=True)
+    while chunk := await take():
+        yield chunk
+
+
+def streaming_response(request, lines, content_type):
+    """WSGI ではそのまま、ASGI では非同期のイテレータで流す"""
+    if isinstance(getattr(request, "_request", request), ASGIRequest):
+        lines = aiter_lines(lines)
+    return StreamingHttpResponse(lines, content_type=content_type)
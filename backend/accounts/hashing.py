@@ -0,0 +1,165 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.hashers import make_password
+from rest_framework.exceptions import APIException
+
+HASH_PROCESSES = getattr(settings, "ACCOUNTS_HASH_PROCESSES", None) or os.cpu_count() or 1
+HASH_WORKERS = getattr(settings, "ACCOUNTS_HASH_WORKERS", 2)
+HASH_QUEUE_LIMIT = getattr(settings, "ACCOUNTS_HASH_QUEUE_LIMIT", 4)
+HASH_TIMEOUT = getattr(settings, "ACCOUNTS_HASH_TIMEOUT", 10)
+HASH_RETRY_AFTER = getattr(settings, "ACCOUNTS_HASH_RETRY_AFTER", 2)
+
+_process_pool = None
+
+
+def _init_worker():
+    # spawn の子プロセスは設定を読み直すので、hasher 設定を使えるようにする
+    django.setup()
+
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # gthread ワーカーはスレッドを持つので fork しない（他スレッドが握ったロックごと複製されて固まることがある）
+        _process_pool = ProcessPoolExecutor(
+            max_workers=HASH_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+    return _process_pool
+
+
+def hash_passwords(raw_passwords):
+    """複数パスワードをプロセスプールで並列にハッシュ化（順序は入力どおり）"""
+    raw_passwords = list(raw_passwords)
+    if len(raw_passwords) < 2 or HASH_PROCESSES < 2:
+        return [make_password(raw) for raw in raw_passwords]
+
+    chunksize = max(1, len(raw_passwords) // (HASH_PROCESSES * 4))
+    return list(_get_process_pool().map(make_password, raw_passwords, chunksize=chunksize))
+
+
+# =======================================
+# ログイン・登録用の上限つきハッシュ実行器
+# =======================================
+class HashingBusy(APIException):
+    status_code = 503
+    default_detail = "ただいま混み合っています。しばらくしてから再度お試しください"
+    default_code = "hashing_busy"
+
+    def __init__(self, wait=None):
+        super().__init__()
+        # DRF の exception_handler が Retry-After ヘッダにする
+        self.wait = wait
+
+
+class HashingExecutor:
+    """
+    パスワードハッシュ専用のスレッドプール。
+    PBKDF2 は GIL を解放するので、同時実行数を workers に絞りつつ
+    実行中 + 待ち行列が workers + queue_limit を超えたら即座に HashingBusy を返す。
+    上限はプロセスごとなので、1 プロセスが同時に扱うリクエスト数（gunicorn の gthread の threads）が
+    workers + queue_limit より大きいときに効く（sync ワーカーでは常に 1 件なので効かない）。
+    """
+
+    def __init__(self, workers, queue_limit, timeout, retry_after):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.retry_after = retry_after
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._latencies = deque(maxlen=1024)
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HashingBusy(self.retry_after)
+
+        with self._lock:
+            self._in_flight += 1
+
+        future = self._executor.submit(self._timed, fn, *args)
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # 待ち行列にあるだけなら取り消せる。実行中のものは止められないので、
+            # 枠は終わったとき（_release）に返る
+            future.cancel()
+            raise HashingBusy(self.retry_after)
+
+    def _timed(self, fn, *args):
+        with self._lock:
+            self._running += 1
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._latencies.append(elapsed)
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def metrics(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            in_flight = self._in_flight
+            running = self._running
+            completed = self._completed
+            rejected = self._rejected
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "in_flight": in_flight,
+            "queue_depth": in_flight - running,
+            "completed": completed,
+            "rejected": rejected,
+            "latency_ms": {
+                "p50": percentile(0.50),
+                "p99": percentile(0.99),
+                "max": round(latencies[-1] * 1000, 2) if latencies else None,
+            },
+        }
+
+
+password_executor = HashingExecutor(HASH_WORKERS, HASH_QUEUE_LIMIT, HASH_TIMEOUT, HASH_RETRY_AFTER)
+
+
+def hash_password(raw_password):
+    if raw_password is None:
+        return make_password(None)  # 使用不可パスワード（ハッシュ計算なし）
+    return password_executor.run(make_password, raw_password)
+
+
+def verify_password(raw_password, encoded):
+    """(一致したか, 再ハッシュが必要か) を返す"""
+    return password_executor.run(hashers.verify_password, raw_password, encoded)
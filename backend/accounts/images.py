@@ -0,0 +1,179 @@
+import functools
+import hashlib
+import io
+import logging
+import os
+import queue
+import threading
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils.timezone import now
+from PIL import Image, ImageOps
+
+from .cache import invalidate_cached_user, invalidate_me_snapshot
+from .events import publish_user_event
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+# variant 名 → 出力サイズ（正方形にトリミング）
+VARIANT_SIZES = getattr(settings, "ACCOUNTS_PROFILE_IMAGE_VARIANTS", {
+    "thumb": (96, 96),
+    "medium": (512, 512),
+})
+DEFAULT_IMAGE = UserProfile._meta.get_field("image").default
+WEBP_QUALITY = getattr(settings, "ACCOUNTS_PROFILE_IMAGE_QUALITY", 82)
+# テストなどでワーカースレッドを使わず同期処理する
+PIPELINE_SYNC = getattr(settings, "ACCOUNTS_IMAGE_PIPELINE_SYNC", False)
+
+
+def is_image(upload):
+    """ヘッダだけ読んで画像かどうかを確認する"""
+    try:
+        Image.open(upload).verify()
+        return True
+    except Exception:
+        return False
+    finally:
+        upload.seek(0)
+
+
+def content_hash(chunks):
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()[:20]
+
+
+def store_upload(upload, storage=None):
+    """
+    アップロードを内容ハッシュ名でストレージに書き出し、保存名を返す。
+    同じ名前は常に同じ内容なので immutable でキャッシュできる。
+    """
+    storage = storage or default_storage
+    ext = os.path.splitext(upload.name)[1].lower() or ".img"
+
+    name = f"profile/uploads/{content_hash(upload.chunks())}{ext}"
+    upload.seek(0)
+    if storage.exists(name):
+        return name
+    return storage.save(name, upload)
+
+
+def render_variants(source_name, storage=None):
+    """元画像から WebP の各サイズを作り、内容ハッシュ名で保存して {variant: 保存名} を返す"""
+    storage = storage or default_storage
+
+    with storage.open(source_name, "rb") as f:
+        image = ImageOps.exif_transpose(Image.open(f))
+        image.load()
+    image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    names = {}
+    for variant, size in VARIANT_SIZES.items():
+        buffer = io.BytesIO()
+        ImageOps.fit(image, size, Image.LANCZOS).save(buffer, "WEBP", quality=WEBP_QUALITY)
+        data = buffer.getvalue()
+
+        name = f"profile/variants/{hashlib.sha256(data).hexdigest()[:20]}_{variant}.webp"
+        if not storage.exists(name):
+            name = storage.save(name, ContentFile(data))
+        names[variant] = name
+    return names
+
+
+@functools.lru_cache(maxsize=None)
+def _versioned_default_url(name):
+    """共有のデフォルト画像は名前が固定なので、内容ハッシュを ?v= に付ける（プロセスで 1 回だけ計算）"""
+    url = default_storage.url(name)
+    try:
+        with default_storage.open(name, "rb") as f:
+            return f"{url}?v={content_hash(f.chunks())}"
+    except OSError:
+        return url
+
+
+def default_image_version():
+    """(デフォルト画像の URL のパス, image_url() が付ける ?v= の値)。ハッシュを取れなければ値は None"""
+    url, _, version = _versioned_default_url(DEFAULT_IMAGE).partition("?v=")
+    return urlsplit(url).path, version or None
+
+
+def image_url(field):
+    """FieldFile でも values() で取った保存名でも受け付ける"""
+    name = getattr(field, "name", field)
+    if not name:
+        return None
+    if name == DEFAULT_IMAGE:
+        return _versioned_default_url(name)
+    return default_storage.url(name)
+
+
+def variant_urls(image, image_thumb, image_medium):
+    """variant がまだ無ければ元画像の URL を返す"""
+    original = image_url(image)
+    return {
+        "image_thumb": image_url(image_thumb) or original,
+        "image_medium": image_url(image_medium) or original,
+    }
+
+
+def profile_image_urls(profile):
+    return variant_urls(profile.image, profile.image_thumb, profile.image_medium)
+
+
+# =======================================
+# バックグラウンド処理
+# =======================================
+class ImagePipeline:
+    def __init__(self, storage=None):
+        self.storage = storage
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, profile_id, user_id, source_name):
+        if PIPELINE_SYNC:
+            self.process(profile_id, user_id, source_name)
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profile-image-pipeline", daemon=True)
+                self._thread.start()
+        self._queue.put((profile_id, user_id, source_name))
+
+    def process(self, profile_id, user_id, source_name):
+        variants = render_variants(source_name, self.storage)
+
+        # 処理中に別の画像へ差し替えられていたら書き込まない
+        updated = UserProfile.objects.filter(pk=profile_id, image=source_name).update(
+            image_thumb=variants["thumb"],
+            image_medium=variants["medium"],
+            updated_at=now(),
+        )
+        if updated:
+            invalidate_me_snapshot(user_id)
+            invalidate_cached_user(user_id)
+            publish_user_event(user_id, "profile")
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self.process(*job)
+            except Exception:
+                logger.exception("profile image processing failed: %s", job)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+
+image_pipeline = ImagePipeline()
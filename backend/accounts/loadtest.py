@@ -0,0 +1,209 @@
+"""
+授業開始直後のログイン集中を再現する負荷シミュレーター。
+起動中のサーバーに対して、生徒は /csrf/ → /login/ → /me/、
+教師は /csrf/ → /login/ → /me/ → /account/list/ を実際の Cookie / CSRF の流れで叩く。
+me_reads を増やすとログイン後の /me/ ポーリングが重なり、WSGI と ASGI の同時処理能力の差が見える。
+"""
+import http.cookiejar
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Session:
+    """1 ユーザー分の Cookie を保持する HTTP クライアント"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def cookie(self, name):
+        for cookie in self.cookies:
+            if cookie.name == name:
+                return cookie.value
+        return None
+
+    def request(self, method, path, body=None):
+        headers = {"Accept": "application/json"}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        csrf_token = self.cookie("csrftoken")
+        if csrf_token and method != "GET":
+            headers["X-CSRFToken"] = csrf_token
+
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as exc:
+            return exc.code
+        except (urllib.error.URLError, OSError):
+            return 0  # 接続エラー・タイムアウト
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        # 例外で途中終了したユーザー（リクエストの失敗ではなくシミュレーター側の失敗）
+        self.failed_flows = []
+
+    def add(self, endpoint, status, elapsed):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((status, elapsed))
+
+
+def _timed(recorder, session, endpoint, method, path, body=None):
+    started = time.perf_counter()
+    try:
+        status = session.request(method, path, body)
+    except Exception:
+        # 途中で落ちたユーザーも、落ちたエンドポイントのエラー率に入れる（run_login_rush が failed_flows にも数える）
+        recorder.add(endpoint, 0, time.perf_counter() - started)
+        raise
+    recorder.add(endpoint, status, time.perf_counter() - started)
+    return status
+
+
+def _student_flow(recorder, base_url, timeout, username, password, me_path, me_reads):
+    session = Session(base_url, timeout)
+    _timed(recorder, session, "csrf", "GET", "csrf/")
+    status = _timed(recorder, session, "login", "POST", "login/", {"username": username, "password": password})
+    if status == 200:
+        for _ in range(me_reads):
+            _timed(recorder, session, "me", "GET", me_path)
+
+
+def _teacher_flow(recorder, base_url, timeout, username, password, me_path, me_reads):
+    session = Session(base_url, timeout)
+    _timed(recorder, session, "csrf", "GET", "csrf/")
+    status = _timed(recorder, session, "login", "POST", "login/", {"username": username, "password": password})
+    if status == 200:
+        for _ in range(me_reads):
+            _timed(recorder, session, "me", "GET", me_path)
+        _timed(recorder, session, "account-list", "GET", "account/list/")
+
+
+def run_login_rush(base_url, students, teachers, password, concurrency, timeout=30, me_path="me/", me_reads=1):
+    """
+    students / teachers はユーザー名のリスト。
+    全員を同時に開始させ（concurrency が同時実行数の上限）、エンドポイント別の集計を返す。
+    """
+    recorder = Recorder()
+    jobs = [(_teacher_flow, name) for name in teachers] + [(_student_flow, name) for name in students]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {
+            pool.submit(flow, recorder, base_url, timeout, username, password, me_path, me_reads): username
+            for flow, username in jobs
+        }
+    duration = time.perf_counter() - started
+
+    # 例外は result() で取り出さないと握りつぶされるので、ユーザー単位のエラーとして数える
+    for future, username in futures.items():
+        exc = future.exception()
+        if exc is not None:
+            recorder.failed_flows.append(f"{username}: {exc!r}")
+
+    result = summarize(recorder.samples, duration, {
+        "base_url": base_url,
+        "students": len(students),
+        "teachers": len(teachers),
+        "concurrency": concurrency,
+        "me_reads": me_reads,
+    })
+    result["failed_flows"] = recorder.failed_flows
+    return result
+
+
+def _percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def summarize(samples, duration, scenario):
+    endpoints = {}
+    for endpoint, rows in sorted(samples.items()):
+        latencies = sorted(elapsed * 1000 for _, elapsed in rows)
+        errors = sum(1 for status, _ in rows if status == 0 or status >= 400)
+        endpoints[endpoint] = {
+            "requests": len(rows),
+            "throughput_rps": round(len(rows) / duration, 2) if duration else None,
+            "error_rate": round(errors / len(rows), 4),
+            "p50_ms": round(statistics.median(latencies), 2),
+            "p95_ms": round(_percentile(latencies, 0.95), 2),
+            "p99_ms": round(_percentile(latencies, 0.99), 2),
+            "max_ms": round(latencies[-1], 2),
+        }
+    return {"scenario": scenario, "duration_s": round(duration, 3), "endpoints": endpoints}
+
+
+def compare(baseline, candidate):
+    """2 回分の結果を比較し、エンドポイントごとの差分（candidate - baseline）を返す"""
+    rows = {}
+    for endpoint in sorted(set(baseline["endpoints"]) | set(candidate["endpoints"])):
+        before = baseline["endpoints"].get(endpoint)
+        after = candidate["endpoints"].get(endpoint)
+        if before is None or after is None:
+            rows[endpoint] = None  # 片方の実行にしか無い
+            continue
+        rows[endpoint] = {
+            metric: {
+                "baseline": before[metric],
+                "candidate": after[metric],
+                "change_pct": round((after[metric] - before[metric]) / before[metric] * 100, 1)
+                if before[metric] else None,
+            }
+            for metric in ("throughput_rps", "error_rate", "p50_ms", "p95_ms", "p99_ms")
+        }
+    return {
+        "baseline": baseline["scenario"],
+        "candidate": candidate["scenario"],
+        "duration_s": {"baseline": baseline["duration_s"], "candidate": candidate["duration_s"]},
+        "failed_flows": {
+            "baseline": len(baseline.get("failed_flows", [])),
+            "candidate": len(candidate.get("failed_flows", [])),
+        },
+        "endpoints": rows,
+    }
+
+
+def format_report(result):
+    lines = [
+        f"duration: {result['duration_s']}s  scenario: {json.dumps(result['scenario'], ensure_ascii=False)}",
+        f"{'endpoint':<14}{'requests':>9}{'rps':>9}{'errors':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+    ]
+    for endpoint, row in result["endpoints"].items():
+        lines.append(
+            f"{endpoint:<14}{row['requests']:>9}{row['throughput_rps']:>9}{row['error_rate']:>9.2%}"
+            f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}"
+        )
+    failed = result.get("failed_flows", [])
+    if failed:
+        lines.append(f"failed flows: {len(failed)}")
+        lines.extend(f"  {line}" for line in failed[:10])
+    return "\n".join(lines)
+
+
+def format_comparison(result):
+    lines = [f"{'endpoint':<14}{'metric':<16}{'baseline':>12}{'candidate':>12}{'change':>10}"]
+    failed = result.get("failed_flows")
+    if failed and (failed["baseline"] or failed["candidate"]):
+        lines.append(f"{'-':<14}{'failed_flows':<16}{failed['baseline']:>12}{failed['candidate']:>12}{'-':>10}")
+    for endpoint, metrics in result["endpoints"].items():
+        if metrics is None:
+            lines.append(f"{endpoint:<14}(only in one run)")
+            continue
+        for metric, row in metrics.items():
+            change = f"{row['change_pct']:+.1f}%" if row["change_pct"] is not None else "-"
+            lines.append(f"{endpoint:<14}{metric:<16}{row['baseline']:>12}{row['candidate']:>12}{change:>10}")
+    return "\n".join(lines)
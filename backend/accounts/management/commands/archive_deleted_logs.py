@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from accounts.archive import ARCHIVE_BATCH_SIZE, ARCHIVE_DIR, archive_logs
+
+
+class Command(BaseCommand):
+    help = "古い削除アカウントログを日付ごとの gzip 圧縮 JSONL へ移し、テーブルから削除する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=int, default=180, help="この日数より前のログを対象にする")
+        parser.add_argument("--dir", default=ARCHIVE_DIR, help="アーカイブの出力先")
+        parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument("--dry-run", action="store_true", help="対象の件数だけ表示する")
+
+    def handle(self, *args, **options):
+        archived = archive_logs(
+            before=now() - timedelta(days=options["older_than"]),
+            root=options["dir"],
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+        )
+
+        for day, count in sorted(archived.items()):
+            self.stdout.write(f"{day}: {count}")
+        verb = "would archive" if options["dry_run"] else "archived"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {sum(archived.values())} logs into {options['dir']}"))
@@ -0,0 +1,74 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from accounts.benchmarks import ROUTES, BenchContext, measure
+from accounts.seeding import seed_accounts
+
+
+class Command(BaseCommand):
+    help = (
+        "テスト用 DB に名簿を投入し、accounts の全ルートのクエリ数・p50/p99・ピークメモリを計測する。"
+        "クエリ数が予算を超えたルートがあれば失敗終了する。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,100000",
+                            help="生徒数（カンマ区切り）")
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--deleted-ratio", type=float, default=0.1,
+                            help="生徒数に対する削除ログの件数比")
+        parser.add_argument("--routes", default="", help="計測するルート名（カンマ区切り、空なら全て）")
+        parser.add_argument("--warm", action="store_true", help="計測ごとにキャッシュを空にしない")
+        parser.add_argument("--plain-json", action="store_true",
+                            help="FastJSONRenderer を無効にして DRF の JSONRenderer で計測する")
+        parser.add_argument("--keepdb", action="store_true")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["sizes"].split(",") if size]
+        names = {name for name in options["routes"].split(",") if name}
+        routes = [route for route in ROUTES if not names or route.name in names]
+        # 書き込み系ルートが対象の生徒を使い切らないように余裕を持たせる
+        spare = (options["iterations"] + 2) * 10 * len(routes)
+
+        if options["plain_json"]:
+            override_settings(ACCOUNTS_FAST_JSON_VIEWS=()).enable()
+
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+
+        over_budget = []
+        try:
+            for size in sizes:
+                call_command("flush", interactive=False, verbosity=0)
+                seeded = seed_accounts(
+                    students=size + spare,
+                    teachers=5,
+                    deleted_logs=int(size * options["deleted_ratio"]),
+                )
+                ctx = BenchContext(seeded)
+
+                self.stdout.write(f"\n== students={size} ==")
+                self.stdout.write(f"{'route':<22}{'status':>7}{'queries':>9}{'budget':>8}"
+                                  f"{'p50 ms':>10}{'p99 ms':>10}{'peak KiB':>11}")
+                for route in routes:
+                    result = measure(ctx, route, options["iterations"], warm=options["warm"])
+                    flag = ""
+                    if result["queries"] > result["budget"]:
+                        flag = "  << over budget"
+                        over_budget.append((size, route.name, result["queries"], route.budget))
+                    self.stdout.write(
+                        f"{result['route']:<22}{result['status']:>7}{result['queries']:>9}{result['budget']:>8}"
+                        f"{result['p50_ms']:>10}{result['p99_ms']:>10}{result['peak_kib']:>11}{flag}"
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        if over_budget:
+            raise CommandError("query budget exceeded: " + ", ".join(
+                f"{name}@{size} ({queries}>{budget})" for size, name, queries, budget in over_budget
+            ))
+        self.stdout.write(self.style.SUCCESS("all routes within query budget"))
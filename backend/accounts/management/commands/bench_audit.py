@@ -0,0 +1,71 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from accounts.audit import AuditLog
+from accounts.benchmarks import ROUTES, BenchContext, measure
+from accounts.models import AuditEvent
+from accounts.seeding import seed_accounts
+
+AUDITED_ROUTES = ("login", "logout", "account-deactivate", "account-reactivate", "bulk-deactivate")
+
+
+class Command(BaseCommand):
+    help = (
+        "監査ログの 1 件あたりの記録コスト（µs）・bulk_create の書き込み速度と、"
+        "監査ログの有無によるルートごとのレイテンシ差を計測する"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=100000, help="record() を呼ぶ回数")
+        parser.add_argument("--iterations", type=int, default=50, help="ルートごとの計測回数")
+        parser.add_argument("--keepdb", action="store_true")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        try:
+            self.bench_record(options["events"])
+            self.bench_routes(options["iterations"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+    def bench_record(self, count):
+        # writer を起動せずに積むだけのコストと、まとめて書き出す速度を分けて測る
+        log = AuditLog(limit=count)
+        timings = []
+        with override_settings(ACCOUNTS_AUDIT_BACKGROUND=False):
+            for i in range(count):
+                started = time.perf_counter_ns()
+                log.record("login_success", reason="bench", n=i)
+                timings.append(time.perf_counter_ns() - started)
+
+        started = time.perf_counter()
+        written = log.flush()
+        elapsed = time.perf_counter() - started
+
+        timings.sort()
+        self.stdout.write(f"record(): p50={timings[len(timings) // 2] / 1000:.2f}µs "
+                          f"p99={timings[int(len(timings) * 0.99)] / 1000:.2f}µs "
+                          f"mean={statistics.fmean(timings) / 1000:.2f}µs")
+        self.stdout.write(f"flush(): {written} events in {elapsed:.2f}s "
+                          f"({written / elapsed:,.0f} events/s, batch={log.flush_size})")
+        AuditEvent.objects.all().delete()
+
+    def bench_routes(self, iterations):
+        seeded = seed_accounts(students=(iterations + 2) * 40, teachers=2)
+        ctx = BenchContext(seeded)
+        routes = [route for route in ROUTES if route.name in AUDITED_ROUTES]
+
+        self.stdout.write(f"\n{'route':<22}{'off p50':>10}{'on p50':>10}{'off p99':>10}{'on p99':>10}")
+        for route in routes:
+            with override_settings(ACCOUNTS_AUDIT_ENABLED=False):
+                off = measure(ctx, route, iterations)
+            on = measure(ctx, route, iterations)
+            self.stdout.write(f"{route.name:<22}{off['p50_ms']:>10}{on['p50_ms']:>10}"
+                              f"{off['p99_ms']:>10}{on['p99_ms']:>10}")
@@ -0,0 +1,84 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from accounts.benchmarks import ROUTES, BenchContext, measure, reset_throttles
+from accounts.seeding import seed_accounts
+from accounts.throttling import CacheBucketBackend, LocalBucketBackend, LoginThrottle
+
+
+class Command(BaseCommand):
+    help = (
+        "ログイン制限の 1 回あたりの判定コスト（µs）と、"
+        "制限を超えたログイン（429）と通常のログインのレイテンシを比較する"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--checks", type=int, default=100000, help="allow_request() を呼ぶ回数")
+        parser.add_argument("--keys", type=int, default=1000, help="使うユーザー名の種類")
+        parser.add_argument("--iterations", type=int, default=50, help="ルートごとの計測回数")
+        parser.add_argument("--keepdb", action="store_true")
+
+    def handle(self, *args, **options):
+        for backend in (LocalBucketBackend(), CacheBucketBackend()):
+            self.bench_check(backend, options["checks"], options["keys"])
+
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        try:
+            self.bench_login(options["iterations"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+    def bench_check(self, backend, count, keys):
+        factory = APIRequestFactory()
+        view = APIView()
+        requests = [
+            view.initialize_request(factory.post("/login/", {"username": f"user{i}"}, format="json"))
+            for i in range(keys)
+        ]
+        throttle = LoginThrottle(backend)
+        # request.data の解析はビュー側でも行うので、先に済ませて判定だけを測る
+        for request in requests:
+            request.data
+
+        timings = []
+        rejected = 0
+        with override_settings(ACCOUNTS_THROTTLE_RATES={"login_ip": f"{count}/min"}):
+            for i in range(count):
+                request = requests[i % keys]
+                started = time.perf_counter_ns()
+                allowed = throttle.allow_request(request, view)
+                timings.append(time.perf_counter_ns() - started)
+                rejected += not allowed
+
+        timings.sort()
+        self.stdout.write(f"{type(backend).__name__:<20} p50={timings[len(timings) // 2] / 1000:.2f}µs "
+                          f"p99={timings[int(len(timings) * 0.99)] / 1000:.2f}µs "
+                          f"mean={statistics.fmean(timings) / 1000:.2f}µs rejected={rejected}/{count}")
+
+    def bench_login(self, iterations):
+        ctx = BenchContext(seed_accounts(students=40, teachers=1))
+        login = next(route for route in ROUTES if route.name == "login")
+
+        allowed = measure(ctx, login, iterations)
+        # 1 回で使い切る制限にして、2 回目以降が 429 になる状態を測る
+        with override_settings(ACCOUNTS_THROTTLE_RATES={"login_username": "1/day"}):
+            reset_throttles()
+            login.call(ctx, login.setup(ctx))
+            throttled = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                response = login.call(ctx, login.setup(ctx))
+                throttled.append((time.perf_counter() - started) * 1000)
+        throttled.sort()
+        self.stdout.write(f"\nlogin (allowed):   p50={allowed['p50_ms']}ms p99={allowed['p99_ms']}ms")
+        self.stdout.write(f"login (throttled): p50={throttled[len(throttled) // 2]:.2f}ms "
+                          f"p99={throttled[int(len(throttled) * 0.99)]:.2f}ms status={response.status_code}")
@@ -0,0 +1,74 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.loadtest import format_report, run_login_rush
+from accounts.models import User
+from accounts.seeding import BENCH_PASSWORD, seed_accounts
+
+
+class Command(BaseCommand):
+    help = (
+        "授業開始時のログイン集中（生徒: csrf → login → me / 教師: csrf → login → me → account/list）を"
+        "起動中のサーバーに対して再現し、エンドポイント別のスループット・レイテンシ・エラー率を出力する"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000/api/")
+        parser.add_argument("--students", type=int, default=140)
+        parser.add_argument("--teachers", type=int, default=5)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--prefix", default="bench", help="seed_accounts で投入したユーザー名の接頭辞")
+        parser.add_argument("--password", default=BENCH_PASSWORD)
+        parser.add_argument("--me-path", default="me/", help="/me/ として叩くパス（非同期版との比較用）")
+        parser.add_argument("--me-reads", type=int, default=1,
+                            help="ログイン後に /me/ を読む回数（WSGI / ASGI の同時処理能力の比較用）")
+        parser.add_argument("--timeout", type=float, default=30)
+        parser.add_argument("--seed", action="store_true",
+                            help="実行前に設定中の DB へ生徒・教師を投入する（サーバーと同じ DB を使う場合のみ）")
+        parser.add_argument("--output", help="結果を JSON で保存する（login_rush_compare で比較できる）")
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            self.seed(options)
+
+        prefix = options["prefix"]
+        result = run_login_rush(
+            base_url=options["base_url"],
+            students=[f"{prefix}_student_{i:06d}" for i in range(options["students"])],
+            teachers=[f"{prefix}_teacher_{i:06d}" for i in range(options["teachers"])],
+            password=options["password"],
+            concurrency=options["concurrency"],
+            timeout=options["timeout"],
+            me_path=options["me_path"],
+            me_reads=options["me_reads"],
+        )
+
+        self.stdout.write(format_report(result))
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f"saved: {options['output']}"))
+
+    def seed(self, options):
+        """投入済みなら何もしない（2 回目以降の --seed で一意制約に掛からないように）"""
+        prefix = options["prefix"]
+        existing = {
+            role: User.all_tenants.filter(username__startswith=f"{prefix}_{role}_").count()
+            for role in ("admin", "teacher", "student")
+        }
+        if not any(existing.values()):
+            seed_accounts(
+                students=options["students"],
+                teachers=options["teachers"],
+                password=options["password"],
+                prefix=prefix,
+            )
+            return
+
+        if existing["teacher"] < options["teachers"] or existing["student"] < options["students"]:
+            raise CommandError(
+                f"{prefix} の投入済みユーザー（教師 {existing['teacher']} 人・生徒 {existing['student']} 人）が"
+                "足りません。別の --prefix を指定してください"
+            )
+        self.stdout.write(f"{prefix} のユーザーは投入済みなので --seed を省略します")
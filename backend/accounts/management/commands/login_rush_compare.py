@@ -0,0 +1,26 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from accounts.loadtest import compare, format_comparison
+
+
+class Command(BaseCommand):
+    help = "login_rush --output で保存した 2 回分の結果を比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("baseline")
+        parser.add_argument("candidate")
+        parser.add_argument("--output", help="比較結果を JSON で保存する")
+
+    def handle(self, *args, **options):
+        with open(options["baseline"]) as f:
+            baseline = json.load(f)
+        with open(options["candidate"]) as f:
+            candidate = json.load(f)
+
+        result = compare(baseline, candidate)
+        self.stdout.write(format_comparison(result))
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from accounts.images import image_pipeline
+from accounts.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "variant が未作成のプロフィール画像を同期的に処理する（取りこぼしの再処理・移行用）"
+
+    def handle(self, *args, **options):
+        profiles = (
+            UserProfile.objects
+            .exclude(image="")
+            .filter(image_thumb="")
+            .values_list("pk", "user_id", "image")
+        )
+
+        done = failed = 0
+        for profile_id, user_id, image in profiles.iterator():
+            try:
+                image_pipeline.process(profile_id, user_id, image)
+                done += 1
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f"{image}: {exc}")
+
+        self.stdout.write(self.style.SUCCESS(f"processed={done} failed={failed}"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from accounts.seeding import BENCH_PASSWORD, seed_accounts
+
+
+class Command(BaseCommand):
+    help = "ベンチマーク・負荷試験用の生徒・教師・削除ログを bulk_create で投入する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=1000)
+        parser.add_argument("--teachers", type=int, default=5)
+        parser.add_argument("--deleted-logs", type=int, default=0)
+        parser.add_argument("--password", default=BENCH_PASSWORD)
+        parser.add_argument("--prefix", default="bench")
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        seed_accounts(
+            students=options["students"],
+            teachers=options["teachers"],
+            deleted_logs=options["deleted_logs"],
+            password=options["password"],
+            prefix=options["prefix"],
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"seeded students={options['students']} teachers={options['teachers']} "
+            f"deleted_logs={options['deleted_logs']} (password: {options['password']})"
+        ))
@@ -0,0 +1,149 @@
+import os
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from .images import default_image_version
+from .profiling import collect, profile_requested, profiled, server_timing_enabled, wants_profile
+from .routers import SAFE_METHODS, pin_to_primary
+
+# store_upload / render_variants が付ける内容ハッシュ名
+HASHED_NAME = re.compile(r"/[0-9a-f]{20}(_[a-z]+)?\.[a-z0-9]+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class ImmutableMediaMiddleware:
+    """
+    内容ハッシュ名のメディアと、image_url() が発行した ?v=（内容ハッシュ）付きのデフォルト画像に
+    長期キャッシュヘッダを付ける。それ以外の ?v= は内容と結び付いていないので対象にしない。
+    （S3 + CloudFront 配信の場合は、ストレージ側のオブジェクト属性で同じ Cache-Control を設定する）
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.media_url = "/" + (settings.MEDIA_URL or "media/").lstrip("/")
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if response.status_code == 200 and request.path.startswith(self.media_url):
+            if HASHED_NAME.search(request.path) or self.is_current_default(request):
+                response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    def is_current_default(self, request):
+        version = request.GET.get("v")
+        return version is not None and (request.path, version) == default_image_version()
+
+
+
+class ReplicaStickyMiddleware:
+    """
+    書き込み（unsafe メソッドが 4xx/5xx 以外で終わった）後は、そのクライアントの読み取りを
+    ACCOUNTS_REPLICA_STICKY_SECONDS の間プライマリへ戻す（accounts.routers 参照）。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process(request, await self.get_response(request))
+
+    def process(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            pin_to_primary(response)
+        return response
+
+
+class ServerTimingMiddleware:
+    """
+    ACCOUNTS_SERVER_TIMING が有効なら Server-Timing（auth / db / serialize / render / total）を付ける。
+    X-Profile: 1 を付けた管理者のリクエストは一定の割合で cProfile を取り、ACCOUNTS_PROFILE_DIR に保存する
+    （accounts.profiling 参照）。どちらも無効なら何もせずに次へ渡す。
+    ASGI では非同期のまま通す（スレッドを挟まない）。cProfile はイベントループのスレッドだけを記録する。
+    ストリーミングのレスポンスは本文を流す前に返るので、Server-Timing は付けない。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        profile = wants_profile(request)
+        if not profile and not server_timing_enabled():
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        request._server_timing_marks = {}
+        path = None
+        with collect() as timings:
+            if profile:
+                with profiled(request) as path:
+                    response = self.get_response(request)
+            else:
+                response = self.get_response(request)
+        return self.finish(request, response, timings, started, path)
+
+    async def __acall__(self, request):
+        # 管理者かどうかの確認（DB を読むことがある）は、選ばれたリクエストだけスレッドで行う
+        profile = profile_requested(request) and await sync_to_async(wants_profile)(request, True)
+        if not profile and not server_timing_enabled():
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        request._server_timing_marks = {}
+        path = None
+        with collect() as timings:
+            if profile:
+                with profiled(request) as path:
+                    response = await self.get_response(request)
+            else:
+                response = await self.get_response(request)
+        return self.finish(request, response, timings, started, path)
+
+    def finish(self, request, response, timings, started, path):
+        finished = time.perf_counter()
+        marks = request._server_timing_marks
+
+        view = render = None
+        if "view" in marks:
+            view = marks.get("render", finished) - marks["view"]
+        if "render" in marks:
+            render = finished - marks["render"]
+        if not response.streaming:
+            response["Server-Timing"] = timings.header(finished - started, view, render)
+        if path is not None:
+            response["X-Profile-File"] = os.path.basename(path)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        marks = getattr(request, "_server_timing_marks", None)
+        if marks is not None:
+            marks["view"] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF の Response はこの直後に描画される
+        marks = getattr(request, "_server_timing_marks", None)
+        if marks is not None:
+            marks["render"] = time.perf_counter()
+        return response
@@ -5,12 +5,28 @@ from django.utils.timezone import now
 from django.conf import settings
 import uuid
 from points.models import ClassMaster
+from . import hashing
+from .tenancy import TenantManager, TenantScopedManagerMixin
 
 def generate_totp_secret():
     return pyotp.random_base32()
 
 
-class UserManager(BaseUserManager):
+class Tenant(models.Model):
+    """教室（学校）単位の区切り。教師・生徒・削除ログはいずれかのテナントに属する（accounts.tenancy 参照）"""
+    name = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class UserManager(TenantScopedManagerMixin, BaseUserManager):
+    def get_by_natural_key(self, username):
+        # ModelBackend のログイン用。username は全テナントで一意なので、残っている別テナントの Cookie で
+        # リクエストが絞り込まれていても引けるようにする
+        return self.model.all_tenants.get(**{self.model.USERNAME_FIELD: username})
+
     def create_user(self, username, email, password=None, name="", created_via_admin=False):
         if not email:
             raise ValueError('Users must have an email address')
@@ -40,15 +56,41 @@ class User(AbstractBaseUser):
     is_admin = models.BooleanField(default=False)
     created_via_admin = models.BooleanField(default=False)
     created_at = models.DateTimeField(default=now, null=True, blank=True)
+    # 名簿の差分同期（?since=）用。update() で書き換える箇所では明示的に now() を入れる
+    updated_at = models.DateTimeField(auto_now=True)
+    # 変更するときは UserProfile.tenant も揃える
+    tenant = models.ForeignKey(Tenant, null=True, blank=True, on_delete=models.PROTECT, related_name="users",
+                               db_index=False)  # Meta の tenant から始まる索引で足りる
 
     objects = UserManager()
+    all_tenants = models.Manager()
 
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = ['email']
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["updated_at"], name="user_updated_idx"),
+            models.Index(fields=["tenant", "username"], name="user_tenant_username_idx"),
+            models.Index(fields=["tenant", "updated_at"], name="user_tenant_updated_idx"),
+        ]
+
     def __str__(self):
         return self.username
 
+    # ハッシュ計算は上限つきの実行器に回す（LoginView / 登録系で共通）
+    def set_password(self, raw_password):
+        self.password = hashing.hash_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        is_correct, must_update = hashing.verify_password(raw_password, self.password)
+        if is_correct and must_update:
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=["password"])
+        return is_correct
+
     @property
     def is_staff(self):
         return self.is_admin
@@ -68,6 +110,9 @@ class UserProfile(models.Model):
 
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="profile")
     image = models.ImageField(upload_to="profile/", default="profile/default.webp", blank=True)
+    # accounts.images.ImagePipeline が作る WebP（未作成なら空）
+    image_thumb = models.ImageField(upload_to="profile/variants/", blank=True, default="")
+    image_medium = models.ImageField(upload_to="profile/variants/", blank=True, default="")
     totp_secret = models.CharField(max_length=32, default=generate_totp_secret)
     is_totp_verified = models.BooleanField(default=False)
 
@@ -75,6 +120,29 @@ class UserProfile(models.Model):
     comment = models.CharField(max_length=255, blank=True, default="")
     is_active_student = models.BooleanField(default=True)  
     class_ref = models.ForeignKey(ClassMaster, null=True, blank=True, on_delete=models.SET_NULL)
+    updated_at = models.DateTimeField(auto_now=True)
+    # user.tenant の複製（profile 側の絞り込みも tenant から始まる索引で引けるように）
+    tenant = models.ForeignKey(Tenant, null=True, blank=True, on_delete=models.PROTECT, related_name="+",
+                               db_index=False)
+
+    objects = TenantManager()
+    all_tenants = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["role", "is_active_student"], name="profile_role_active_idx"),
+            models.Index(fields=["class_ref", "role", "is_active_student"], name="profile_class_role_idx"),
+            models.Index(fields=["updated_at"], name="profile_updated_idx"),
+            models.Index(fields=["tenant", "role", "is_active_student"], name="profile_tenant_role_idx"),
+            models.Index(fields=["tenant", "updated_at"], name="profile_tenant_updated_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # クラス変更時に移動元の集計キャッシュも破棄できるよう、読み込み時の値を覚えておく
+        instance._loaded_class_ref_id = instance.__dict__.get("class_ref_id")
+        return instance
 
     def __str__(self):
         return self.user.username
@@ -92,6 +160,78 @@ class DeletedUserLog(models.Model):
         null=True,
         related_name="deleted_accounts"
     )
+    tenant = models.ForeignKey(Tenant, null=True, blank=True, on_delete=models.PROTECT, related_name="+",
+                               db_index=False)
+
+    objects = TenantManager()
+    all_tenants = models.Manager()
+
+    class Meta:
+        indexes = [
+            # 一覧のキーセットページネーションとアーカイブ対象の絞り込み用
+            models.Index(fields=["deleted_at", "id"], name="deleted_log_at_idx"),
+            models.Index(fields=["tenant", "deleted_at", "id"], name="deleted_log_tenant_idx"),
+        ]
 
     def __str__(self):
         return f"{self.username} deleted at {self.deleted_at}"
+
+
+class AuditEvent(models.Model):
+    """アカウントの監査ログ（accounts.audit の writer がまとめて書き込む）"""
+    ACTION_CHOICES = [
+        ("login_success", "ログイン成功"),
+        ("login_failure", "ログイン失敗"),
+        ("logout", "ログアウト"),
+        ("register", "登録"),
+        ("deactivate", "退会"),
+        ("reactivate", "再開"),
+        ("delete", "削除"),
+        ("profile_update", "プロフィール編集"),
+    ]
+
+    # 削除済みユーザーのイベントも残すので外部キーにしない
+    actor_id = models.UUIDField(null=True, blank=True)
+    target_id = models.UUIDField(null=True, blank=True)
+    action = models.CharField(max_length=32, choices=ACTION_CHOICES)
+    ip = models.GenericIPAddressField(null=True, blank=True)
+    detail = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField()
+    # 対象（なければ操作した人）のテナント
+    tenant = models.ForeignKey(Tenant, null=True, blank=True, on_delete=models.PROTECT, related_name="+",
+                               db_index=False)
+
+    objects = TenantManager()
+    all_tenants = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["tenant", "created_at"], name="audit_tenant_idx"),
+            models.Index(fields=["target_id", "created_at"], name="audit_target_idx"),
+            models.Index(fields=["actor_id", "created_at"], name="audit_actor_idx"),
+            models.Index(fields=["action", "created_at"], name="audit_action_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.target_id} at {self.created_at}"
+
+
+class TokenRevocation(models.Model):
+    """
+    ログアウト・退会・削除で無効にしたトークン（accounts.revocation がプロセス内に同期する）。
+    jti があればそのトークンだけ、なければ user_id に revoked_at 以前に発行した全トークンを無効にする。
+    """
+    jti = models.CharField(max_length=64, null=True, blank=True)
+    user_id = models.UUIDField(null=True, blank=True)
+    revoked_at = models.DateTimeField()
+    # 対象のトークンがすべて期限切れになる時刻（以降は不要なので prune で消す）
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # 各プロセスの差分同期は主キー（id）で引く
+            models.Index(fields=["expires_at"], name="revocation_expires_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.jti or self.user_id} revoked at {self.revoked_at}"
@@ -0,0 +1,24 @@
+from rest_framework.pagination import CursorPagination
+
+
+class UsernameCursorPagination(CursorPagination):
+    """username 順のキーセットページネーション（OFFSET を使わない）"""
+    ordering = "username"
+    page_size = 100
+    page_size_query_param = "limit"
+    max_page_size = 500
+
+
+class DeletedLogCursorPagination(CursorPagination):
+    """削除日時の新しい順（deleted_log_at_idx を逆順に読む）"""
+    ordering = ("-deleted_at", "-id")
+    page_size = 100
+    page_size_query_param = "limit"
+    max_page_size = 500
+
+
+class AuditEventCursorPagination(CursorPagination):
+    ordering = ("-created_at", "-id")
+    page_size = 100
+    page_size_query_param = "limit"
+    max_page_size = 500
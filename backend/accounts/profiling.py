@@ -0,0 +1,164 @@
+"""
+リクエストごとの処理時間の内訳（Server-Timing ヘッダ）と、管理者向けのサンプリングプロファイル。
+
+    MIDDLEWARE = ["accounts.middleware.ServerTimingMiddleware", ...]   # できるだけ先頭に置く
+    ACCOUNTS_SERVER_TIMING = True          # Server-Timing を付ける
+    ACCOUNTS_PROFILE_SAMPLE_RATE = 0.1     # X-Profile: 1 を付けた管理者のリクエストのうちプロファイルする割合
+    ACCOUNTS_PROFILE_DIR = "/var/tmp/accounts-profiles"
+
+内訳は auth（DB を除く認証）・db（全クエリの時間と件数）・serialize（ビュー内の DB・認証以外）・
+render（レスポンスの描画）。無効のときは ContextVar を 1 回読むだけで、計測のための処理は行わない。
+"""
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+
+_current = ContextVar("accounts_request_timings", default=None)
+# cProfile は同時に 1 つしか有効にできない
+_profile_lock = threading.Lock()
+
+
+def server_timing_enabled():
+    return getattr(settings, "ACCOUNTS_SERVER_TIMING", False)
+
+
+def profile_sample_rate():
+    return getattr(settings, "ACCOUNTS_PROFILE_SAMPLE_RATE", 0)
+
+
+def profile_dir():
+    return getattr(settings, "ACCOUNTS_PROFILE_DIR", os.path.join(settings.BASE_DIR, "profiles"))
+
+
+class RequestTimings:
+    __slots__ = ("phases", "db", "queries")
+
+    def __init__(self):
+        self.phases = {}
+        self.db = 0.0
+        self.queries = 0
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def header(self, total, view=None, render=None):
+        """Server-Timing の値（ミリ秒）"""
+        auth = self.phases.get("auth", 0.0)
+        entries = [("auth", auth, None), ("db", self.db, f"{self.queries} queries")]
+        if view is not None:
+            entries.append(("serialize", max(view - auth - self.db, 0.0), None))
+        if render is not None:
+            entries.append(("render", render, None))
+        entries.append(("total", total, None))
+        return ", ".join(
+            f'{name};dur={seconds * 1000:.2f}' + (f';desc="{desc}"' if desc else "")
+            for name, seconds, desc in entries
+        )
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def collect():
+    """この中のクエリ・timed() の区間を RequestTimings に集める"""
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(phase):
+    """計測中なら区間の時間を phase に足す（区間内の DB の時間は db にだけ数える）"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started, db_before = time.perf_counter(), timings.db
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - started - (timings.db - db_before))
+
+
+def record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - started
+        timings.queries += 1
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # 接続ごとに 1 回だけ登録する（計測していないときは ContextVar を読んでそのまま実行する）
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# ---- プロファイル ----
+def profile_requested(request):
+    """X-Profile: 1 を付けたリクエストを ACCOUNTS_PROFILE_SAMPLE_RATE の割合で選ぶ（DB には触らない）"""
+    rate = profile_sample_rate()
+    return bool(rate) and request.META.get(PROFILE_HEADER) == "1" and random.random() < rate
+
+
+def wants_profile(request, requested=None):
+    """profile_requested() に選ばれた管理者のリクエストか"""
+    if not (profile_requested(request) if requested is None else requested):
+        return False
+
+    # DRF の認証はビューの中で行われるので、ここでは Cookie / ヘッダのトークンを直接確かめる
+    from rest_framework.exceptions import AuthenticationFailed
+    from .authentication import CookieJWTAuthentication
+    try:
+        auth = CookieJWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return auth is not None and auth[0].is_admin
+
+
+def profile_path(request, root):
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", request.path).strip("-") or "root"
+    return os.path.join(root, f"{time.strftime('%Y%m%d-%H%M%S')}-{request.method}-{slug}-{uuid.uuid4().hex[:8]}.prof")
+
+
+@contextmanager
+def profiled(request, root=None):
+    """cProfile を有効にし、終わったらファイルへ書き出す。書き出し先（他で使用中なら None）を返す"""
+    root = root or profile_dir()
+    if not _profile_lock.acquire(blocking=False):
+        yield None
+        return
+    path = profile_path(request, root)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield path
+        finally:
+            profiler.disable()
+        os.makedirs(root, exist_ok=True)
+        profiler.dump_stats(path)
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,38 @@
+from django.conf import settings
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+DEFAULT_FAST_JSON_VIEWS = (
+    "MeView", "BootstrapView", "AccountsListView", "AccountDetailView", "DeletedAccountListView",
+)
+
+try:
+    import orjson
+except ImportError:  # orjson が無い環境では DRF の JSONRenderer と同じ動作
+    orjson = None
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    orjson で書き出す JSONRenderer。
+    UUID / datetime は orjson がそのまま扱い、それ以外（Decimal・遅延文字列など）は DRF の encoder に任せる。
+    """
+    _default = encoders.JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=self._default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONMixin:
+    """
+    ACCOUNTS_FAST_JSON_VIEWS に名前があるビューだけ FastJSONRenderer を使う。
+    設定から外せば同じビューを DRF の JSONRenderer で計測できる。
+    """
+
+    def get_renderers(self):
+        renderer_list = super().get_renderers()
+        if type(self).__name__ not in getattr(settings, "ACCOUNTS_FAST_JSON_VIEWS", DEFAULT_FAST_JSON_VIEWS):
+            return renderer_list
+        return [FastJSONRenderer()] + [r for r in renderer_list if type(r) is not renderers.JSONRenderer]
@@ -0,0 +1,166 @@
+"""
+JWT の失効管理（ログアウト・退会・削除）。
+失効は TokenRevocation に記録し、各プロセスは REVOCATION_SYNC_INTERVAL 秒ごとに差分だけを読んで
+プロセス内の dict（jti → 期限、user_id → 失効時刻）に反映する。
+認証時の判定はこの dict を引くだけなので、リクエストごとの DB アクセスは増えない。
+
+差分は自動採番の id で取る。時刻（revoked_at）はアプリ側の時計で INSERT 時に決まるので、
+コミットが遅れた行やプロセス間の時計のずれで読み落とすことがある。id も採番順にコミットされるとは限らないため、
+読んだ最大 id より小さいのにまだ見ていない id（未コミットかロールバック）は REVOCATION_GAP_TIMEOUT 秒まで読み直す。
+
+同じプロセスで記録した失効はコミット後すぐに効き、他のプロセスへは最大で同期間隔 + コミットまでの時間だけ遅れて届く。
+期限切れの行は prune_token_revocations コマンドで消す。
+"""
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils.timezone import now
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import TokenRevocation
+
+# 抜けている id を読み直し続ける秒数（どのトランザクションもこれより長くは開いていない前提）と、覚えておく上限
+REVOCATION_GAP_TIMEOUT = getattr(settings, "ACCOUNTS_REVOCATION_GAP_TIMEOUT", 300)
+REVOCATION_MAX_GAPS = getattr(settings, "ACCOUNTS_REVOCATION_MAX_GAPS", 1000)
+
+
+def sync_interval():
+    return getattr(settings, "ACCOUNTS_REVOCATION_SYNC_INTERVAL", 1.0)
+
+
+def token_lifetime():
+    """発行済みトークンがすべて期限切れになるまでの時間"""
+    return max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME)
+
+
+class RevocationList:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.syncs = 0
+        self.reset()
+
+    def reset(self):
+        """プロセス内の一覧を捨てる（次の同期で期限内のものをすべて読み直す）"""
+        with self._lock:
+            self._jtis = {}
+            self._epochs = {}
+            self._last_id = None
+            self._gaps = {}
+            self._synced_at = None
+
+    # ---- 判定（DB には触らない） ----
+    def is_revoked(self, token):
+        jti = token.get(api_settings.JTI_CLAIM)
+        if jti is not None and jti in self._jtis:
+            return True
+        epoch = self._epochs.get(str(token.get(api_settings.USER_ID_CLAIM)))
+        # iat は秒単位なので、失効と同じ秒に発行したトークン（再開直後の再ログイン）は残す
+        return epoch is not None and token.get("iat", 0) < epoch
+
+    # ---- 同期 ----
+    def sync_due(self):
+        return self._synced_at is None or time.monotonic() - self._synced_at >= sync_interval()
+
+    def sync_if_due(self):
+        if self.sync_due():
+            self.sync()
+
+    def sync(self):
+        """前回以降に記録された失効を読み込む（初回は期限内のものをすべて）"""
+        started = now()
+        rows = TokenRevocation.objects.filter(expires_at__gt=started)
+        if self._last_id is None:
+            # 起点は期限切れの行も含めた最大 id（読まなかった期限切れの行を抜け番にしない）
+            last_id = TokenRevocation.objects.aggregate(last_id=Max("id"))["last_id"] or 0
+        else:
+            last_id = self._last_id
+            rows = rows.filter(Q(id__gt=last_id) | Q(id__in=list(self._gaps)))
+        rows = list(rows.values_list("id", "jti", "user_id", "revoked_at", "expires_at"))
+
+        with self._lock:
+            for _, jti, user_id, revoked_at, expires_at in rows:
+                self._apply(jti, user_id, revoked_at.timestamp(), expires_at.timestamp())
+            self._prune(started.timestamp())
+            self._track_gaps(last_id, {row[0] for row in rows})
+            self._synced_at = time.monotonic()
+            self.syncs += 1
+
+    def _track_gaps(self, last_id, seen):
+        """読んだ id から次回の起点と、読み直す抜け番を更新する"""
+        clock = time.monotonic()
+        gaps = {
+            row_id: first_missed for row_id, first_missed in self._gaps.items()
+            if row_id not in seen and clock - first_missed < REVOCATION_GAP_TIMEOUT
+        }
+        top = max(seen, default=last_id)
+        gaps.update((row_id, clock) for row_id in range(last_id + 1, top) if row_id not in seen)
+        if len(gaps) > REVOCATION_MAX_GAPS:
+            gaps = dict(sorted(gaps.items())[-REVOCATION_MAX_GAPS:])
+        self._gaps = gaps
+        self._last_id = max(top, last_id)
+
+    def _apply(self, jti, user_id, revoked_at, expires_at):
+        if jti:
+            self._jtis[jti] = expires_at
+        elif user_id is not None:
+            key = str(user_id)
+            self._epochs[key] = max(self._epochs.get(key, 0), int(revoked_at))
+
+    def _prune(self, at):
+        # 辞書は差し替える（判定側はロックを取らずに読むため）
+        self._jtis = {jti: expires for jti, expires in self._jtis.items() if expires > at}
+        horizon = at - token_lifetime().total_seconds()
+        self._epochs = {key: epoch for key, epoch in self._epochs.items() if epoch > horizon}
+
+    # ---- 記録 ----
+    def revoke_tokens(self, *tokens):
+        """個々のトークン（ログアウト時の access / refresh）を失効させる"""
+        revoked_at = now()
+        rows = [
+            TokenRevocation(
+                jti=token[api_settings.JTI_CLAIM],
+                user_id=token.get(api_settings.USER_ID_CLAIM),
+                revoked_at=revoked_at,
+                expires_at=datetime.fromtimestamp(token["exp"], tz=dt_timezone.utc),
+            )
+            for token in tokens if token is not None
+        ]
+        self._save(rows)
+
+    def revoke_users(self, *user_ids):
+        """ユーザーにこれまで発行したトークンをすべて失効させる（退会・削除）"""
+        revoked_at = now()
+        rows = [
+            TokenRevocation(user_id=user_id, revoked_at=revoked_at, expires_at=revoked_at + token_lifetime())
+            for user_id in user_ids
+        ]
+        self._save(rows)
+
+    def _save(self, rows):
+        if not rows:
+            return
+        TokenRevocation.objects.bulk_create(rows)
+
+        def apply():
+            with self._lock:
+                for row in rows:
+                    self._apply(row.jti, row.user_id, row.revoked_at.timestamp(), row.expires_at.timestamp())
+
+        # 呼び出し元のトランザクションがロールバックしたら、このプロセスでも失効させない
+        transaction.on_commit(apply)
+
+    def stats(self):
+        return {"jtis": len(self._jtis), "users": len(self._epochs), "gaps": len(self._gaps), "syncs": self.syncs}
+
+
+revocations = RevocationList()
+
+
+def prune_expired(at=None):
+    """期限切れの失効記録を消し、件数を返す"""
+    deleted, _ = TokenRevocation.objects.filter(expires_at__lte=at or now()).delete()
+    return deleted
@@ -0,0 +1,100 @@
+"""
+読み取り専用エンドポイントをリードレプリカへ振り分ける DB ルーター。
+
+    DATABASES = {"default": {...primary...}, "replica": {...}}
+    DATABASE_ROUTERS = ["accounts.routers.ReplicaRouter"]
+    MIDDLEWARE = [..., "accounts.middleware.ReplicaStickyMiddleware", ...]
+    ACCOUNTS_READ_REPLICAS = ["replica"]
+    ACCOUNTS_REPLICA_STICKY_SECONDS = 5   # レプリカの遅延の上限に合わせる
+
+ReplicaReadMixin を付けたビューへの GET/HEAD だけがレプリカを読む。
+書き込みを行ったクライアントは STICKY_SECONDS の間プライマリを読む（read-your-writes）。
+それ以外（書き込み・管理コマンド・シグナル・バックグラウンド処理）は常にプライマリ。
+ローカルでは SQLite を 2 つ用意し（replica はプライマリのファイルのコピー）、
+テストでは DATABASES["replica"]["TEST"] = {"MIRROR": "default"} にする。
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# 書き込み後にプライマリを読ませる期限（UNIX 時刻）を持つ Cookie
+STICKY_COOKIE = "db_primary_until"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_read_alias = ContextVar("accounts_read_alias", default=None)
+
+
+def read_replicas():
+    return list(getattr(settings, "ACCOUNTS_READ_REPLICAS", ()))
+
+
+def sticky_seconds():
+    return getattr(settings, "ACCOUNTS_REPLICA_STICKY_SECONDS", 5)
+
+
+def is_pinned_to_primary(request):
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def pin_to_primary(response):
+    seconds = sticky_seconds()
+    if seconds > 0:
+        response.set_cookie(STICKY_COOKIE, f"{time.time() + seconds:.3f}", max_age=seconds,
+                            httponly=True, samesite="Lax")
+
+
+@contextmanager
+def replica_reads():
+    """この中の読み取りをレプリカ（設定されていれば）へ送る"""
+    replicas = read_replicas()
+    token = _read_alias.set(random.choice(replicas) if replicas else None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def replica_cache_timeout(timeout):
+    """
+    レプリカから読んだ値は遅延で古い可能性があるので、キャッシュする期間を遅延の上限までに抑える
+    （書き込み直後の破棄のあとに古い値が長く残らないように）
+    """
+    if _read_alias.get() is None:
+        return timeout
+    return min(timeout, sticky_seconds())
+
+
+def reads_from_replica(request):
+    return request.method in SAFE_METHODS and not is_pinned_to_primary(request)
+
+
+class ReplicaReadMixin:
+    """読み取り専用のビューに付ける。書き込み直後のクライアント以外はレプリカを読む"""
+
+    def dispatch(self, request, *args, **kwargs):
+        if not reads_from_replica(request):
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリの複製なので同じ DB とみなす
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in read_replicas()
@@ -0,0 +1,79 @@
+import random
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.utils.timezone import now
+
+from points.models import PointManager
+from .models import DeletedUserLog, User, UserProfile
+
+BENCH_PASSWORD = "bench-pass-1234"
+
+
+def seed_accounts(students, teachers=1, deleted_logs=0, password=BENCH_PASSWORD,
+                  prefix="bench", batch_size=5000, seed=0, tenant=None):
+    """
+    ベンチマーク用の名簿を bulk_create で投入する。
+    パスワードは 1 回だけハッシュして全員で共有する（投入を速くするため）。
+    戻り値は {"admin": User, "teachers": [...], "students": [...]}（students は id のリスト）
+    tenant を渡すと教師・生徒・削除ログをそのテナントに入れる（admin はテナントを持たない）。
+    """
+    rng = random.Random(seed)
+    encoded = make_password(password)
+    created_at = now()
+
+    def build(count, role, start=0):
+        users, profiles, managers = [], [], []
+        for i in range(start, start + count):
+            user = User(
+                id=uuid.uuid4(),
+                username=f"{prefix}_{role}_{i:06d}",
+                email=f"{prefix}_{role}_{i:06d}@example.com",
+                name=f"{role} {i}",
+                password=encoded,
+                is_admin=role == "admin",
+                created_at=created_at,
+                tenant=None if role == "admin" else tenant,
+            )
+            users.append(user)
+            profiles.append(UserProfile(user=user, role=role, totp_secret="A" * 32, tenant=user.tenant))
+            managers.append(PointManager(user=user, point_balance=rng.randint(0, 500)))
+        return users, profiles, managers
+
+    def insert(count, role):
+        ids = []
+        for start in range(0, count, batch_size):
+            users, profiles, managers = build(min(batch_size, count - start), role, start)
+            User.objects.bulk_create(users, batch_size=batch_size)
+            UserProfile.objects.bulk_create(profiles, batch_size=batch_size)
+            PointManager.objects.bulk_create(managers, batch_size=batch_size)
+            ids.extend(user.id for user in users)
+        return ids
+
+    admin_id = insert(1, "admin")[0]
+    teacher_ids = insert(teachers, "teacher")
+    student_ids = insert(students, "student")
+
+    for start in range(0, deleted_logs, batch_size):
+        DeletedUserLog.objects.bulk_create([
+            DeletedUserLog(
+                user_id=uuid.uuid4(),
+                username=f"{prefix}_deleted_{i:06d}",
+                email=f"{prefix}_deleted_{i:06d}@example.com",
+                deleted_by_id=teacher_ids[0] if teacher_ids else admin_id,
+                tenant=tenant,
+            )
+            for i in range(start, min(start + batch_size, deleted_logs))
+        ], batch_size=batch_size)
+
+    # deleted_at は auto_now_add なので、分布を持たせるため後から散らす
+    if deleted_logs:
+        for days, log_id in enumerate(DeletedUserLog.objects.values_list("id", flat=True)[:1000]):
+            DeletedUserLog.objects.filter(id=log_id).update(deleted_at=created_at - timedelta(days=days))
+
+    return {
+        "admin": User.objects.get(id=admin_id),
+        "teachers": list(User.objects.filter(id__in=teacher_ids[:1])),
+        "students": student_ids,
+    }
@@ -28,9 +28,11 @@
 
 
 from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
 from django.contrib.auth import get_user_model
-from .models import UserProfile
-from points.models import PointManager
+from .revocation import revocations
+from .services import RegistrationError, register_user
  
 User = get_user_model()
 
@@ -40,19 +42,22 @@ class SignupSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['username', 'email', 'password', 'name']
+        # 重複は register_user が一意制約エラーから判定する（事前 exists() を省く）
+        extra_kwargs = {
+            'username': {'validators': []},
+            'email': {'validators': []},
+        }
 
     def create(self, validated_data):
-        password = validated_data.pop("password")
-        name = validated_data.pop("name")
-
-        user = User(
-            username=validated_data["username"],
-            email=validated_data["email"],
-            name=name,
-        )
-        user.set_password(password)
-        user.save()
-        return user
+        try:
+            return register_user(
+                username=validated_data["username"],
+                email=validated_data["email"],
+                password=validated_data["password"],
+                name=validated_data.get("name", ""),
+            )
+        except RegistrationError as exc:
+            raise serializers.ValidationError({exc.field: [f"この {exc.field} は既に登録されています"]})
 # class SignupSerializer(serializers.ModelSerializer):
 #     password = serializers.CharField(write_only=True)
 
@@ -87,38 +92,12 @@ class SignupSerializer(serializers.ModelSerializer):
 #         return saved
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = UserProfile
-        fields = ["image", "role", "is_totp_verified"]
-
-
-    def get_image(self, obj):
-        request = self.context.get("request")
-        if obj.image:
-            return request.build_absolute_uri(obj.image.url)
-        return None
-
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    """ログアウト・退会・削除で失効した refresh トークンでは再発行しない"""
 
-class UserSerializer(serializers.ModelSerializer):
-    profile = UserProfileSerializer(read_only=True)
-
-    # ★ 追加：point_balance を MeView に含める
-    point_balance = serializers.SerializerMethodField()
-
-    class Meta:
-        model = User
-        fields = [
-            "id",
-            "username",
-            "name",
-            "profile",
-            "point_balance", 
-        ]
-
-    def get_point_balance(self, obj):
-        try:
-            pm = PointManager.objects.get(user=obj)
-            return pm.point_balance
-        except PointManager.DoesNotExist:
-            return 0
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        revocations.sync_if_due()
+        if revocations.is_revoked(refresh):
+            raise InvalidToken("Token has been revoked")
+        return super().validate(attrs)
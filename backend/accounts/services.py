@@ -0,0 +1,361 @@
+import re
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from points.models import ClassMaster, PointManager
+from .cache import invalidate_cached_user, invalidate_class_totals, invalidate_me_snapshot
+from .hashing import hash_passwords
+from .models import DeletedUserLog, User, UserProfile
+from .revocation import revocations
+
+BULK_BATCH_SIZE = getattr(settings, "ACCOUNTS_BULK_BATCH_SIZE", 500)
+
+
+# =======================================
+# ユーザー登録
+# =======================================
+class RegistrationError(Exception):
+    """username / email の一意制約違反（field に衝突したカラム名）"""
+
+    def __init__(self, field):
+        super().__init__(field)
+        self.field = field
+
+
+# MySQL（mysqlclient）は (errno, message) の 2 引数で送出する。1062 が一意制約違反
+MYSQL_DUP_ENTRY = 1062
+
+# 一意制約違反のメッセージから制約（キー）名だけを取り出す。値はメッセージに含まれるので、全体を検索しない
+CONSTRAINT_PATTERNS = (
+    re.compile(r"for key '([^']+)'\s*$"),                               # MySQL: Duplicate entry '...' for key '...'
+    re.compile(r'^duplicate key value violates unique constraint "([^"]+)"'),  # PostgreSQL
+    re.compile(r"^UNIQUE constraint failed: ([\w.]+)"),                   # SQLite
+)
+
+
+def conflicting_field(exc):
+    """IntegrityError が username / email のどちらの一意制約か（どちらでもなければ None）"""
+    if not exc.args:
+        return None
+    # str(exc) は引数が 2 つだとタプルの repr になるので、メッセージ本体（最後の引数）を見る
+    if len(exc.args) > 1 and isinstance(exc.args[0], int) and exc.args[0] != MYSQL_DUP_ENTRY:
+        return None
+    message = str(exc.args[-1])
+    for pattern in CONSTRAINT_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            break
+    else:
+        return None
+
+    name = match.group(1)
+    table = User._meta.db_table
+    for field in ("username", "email"):
+        if name in (field, f"{table}.{field}", f"{table}_{field}_key"):
+            return field
+    return None
+
+
+def register_user(username, email, password, name="", role="student", tenant_id=None):
+    """
+    User / UserProfile / PointManager を 1 トランザクションで作成する。
+    事前の exists() は行わず、重複は一意制約エラーから判定する。
+    tenant_id を渡すと profile も同じテナントに入る（create_related_models）。
+    """
+    user = User(
+        username=username,
+        email=User.objects.normalize_email(email),
+        name=name or "",
+        tenant_id=tenant_id,
+    )
+    user.set_password(password)
+    # create_related_models シグナルが最終的な role で profile を作る
+    user._profile_role = role
+
+    try:
+        with transaction.atomic():
+            user.save(force_insert=True)
+    except IntegrityError as exc:
+        field = conflicting_field(exc)
+        if field is None:
+            raise
+        raise RegistrationError(field)
+
+    return user
+
+
+# =======================================
+# 生徒の一括登録
+# =======================================
+def _row_error(index, username, message):
+    return {"row": index, "username": username, "error": message}
+
+
+def _validate_rows(rows):
+    """必須項目・ファイル内重複・class_ref をチェックし、登録候補とエラーに分ける"""
+    candidates = []
+    errors = []
+    seen_usernames = set()
+    seen_emails = set()
+
+    for index, row in enumerate(rows, start=1):
+        username = str(row.get("username") or "").strip()
+        email = str(row.get("email") or "").strip()
+        password = str(row.get("password") or "")
+        name = str(row.get("name") or "").strip()
+        class_ref = str(row.get("class_ref") or "").strip()
+
+        if not username or not email or not password:
+            errors.append(_row_error(index, username, "username, email, password は必須です"))
+            continue
+
+        email = User.objects.normalize_email(email)
+
+        # MySQL の照合順序は大文字小文字を区別しないので、重複も区別せずに調べる
+        if username.casefold() in seen_usernames:
+            errors.append(_row_error(index, username, "ファイル内で username が重複しています"))
+            continue
+        if email.casefold() in seen_emails:
+            errors.append(_row_error(index, username, "ファイル内で email が重複しています"))
+            continue
+        if class_ref and not class_ref.isdigit():
+            errors.append(_row_error(index, username, "class_ref は数値で指定してください"))
+            continue
+
+        seen_usernames.add(username.casefold())
+        seen_emails.add(email.casefold())
+        candidates.append({
+            "row": index,
+            "username": username,
+            "email": email,
+            "password": password,
+            "name": name,
+            "class_ref": int(class_ref) if class_ref else None,
+        })
+
+    # 存在しないクラスは 1 クエリでまとめて確認
+    class_ids = {c["class_ref"] for c in candidates if c["class_ref"] is not None}
+    if class_ids:
+        known = set(ClassMaster.objects.filter(pk__in=class_ids).values_list("pk", flat=True))
+        valid = []
+        for c in candidates:
+            if c["class_ref"] is not None and c["class_ref"] not in known:
+                errors.append(_row_error(c["row"], c["username"], "クラスが存在しません"))
+            else:
+                valid.append(c)
+        candidates = valid
+
+    return candidates, errors
+
+
+DUPLICATE_MESSAGES = {
+    "username": "この username は既に存在します",
+    "email": "この email は既に登録済みです",
+}
+
+
+def _reject_existing(batch, errors):
+    """バッチ内の username / email を 1 クエリで既存ユーザーと突き合わせる（一意制約と同じく全テナントが対象）"""
+    existing = User.all_tenants.filter(
+        Q(username__in=[c["username"] for c in batch]) | Q(email__in=[c["email"] for c in batch])
+    ).values_list("username", "email")
+
+    taken_usernames = {username.casefold() for username, _ in existing}
+    taken_emails = {email.casefold() for _, email in existing}
+
+    fresh = []
+    for c in batch:
+        if c["username"].casefold() in taken_usernames:
+            errors.append(_row_error(c["row"], c["username"], DUPLICATE_MESSAGES["username"]))
+        elif c["email"].casefold() in taken_emails:
+            errors.append(_row_error(c["row"], c["username"], DUPLICATE_MESSAGES["email"]))
+        else:
+            fresh.append(c)
+    return fresh
+
+
+def _insert_students(batch, hashed, tenant_id):
+    users = [
+        User(
+            username=c["username"],
+            email=c["email"],
+            name=c["name"],
+            password=password,
+            tenant_id=tenant_id,
+        )
+        for c, password in zip(batch, hashed)
+    ]
+    User.objects.bulk_create(users)
+    UserProfile.objects.bulk_create([
+        UserProfile(user=user, role="student", class_ref_id=c["class_ref"], tenant_id=tenant_id)
+        for c, user in zip(batch, users)
+    ])
+    PointManager.objects.bulk_create([PointManager(user=user) for user in users])
+    return list(zip(batch, users))
+
+
+def _insert_each(batch, hashed, tenant_id, errors):
+    """バッチの一括 INSERT が一意制約で失敗したとき、1 件ずつ入れ直して衝突した行だけをエラーにする"""
+    inserted = []
+    for c, password in zip(batch, hashed):
+        try:
+            with transaction.atomic():
+                inserted.extend(_insert_students([c], [password], tenant_id))
+        except IntegrityError as exc:
+            field = conflicting_field(exc)
+            if field is None:
+                raise
+            errors.append(_row_error(c["row"], c["username"], DUPLICATE_MESSAGES[field]))
+    return inserted
+
+
+def bulk_register_students(rows, tenant_id=None):
+    """
+    生徒をまとめて登録する。
+    User / UserProfile / PointManager は bulk_create するので
+    create_related_models シグナルは通らない（ここで明示的に作成する）。
+    """
+    candidates, errors = _validate_rows(rows)
+    created = []
+
+    with transaction.atomic():
+        for start in range(0, len(candidates), BULK_BATCH_SIZE):
+            batch = _reject_existing(candidates[start:start + BULK_BATCH_SIZE], errors)
+            if not batch:
+                continue
+
+            hashed = hash_passwords(c["password"] for c in batch)
+            try:
+                with transaction.atomic():
+                    inserted = _insert_students(batch, hashed, tenant_id)
+            except IntegrityError:
+                # 確認の後に別のリクエストが同じ username / email を登録した場合など
+                inserted = _insert_each(batch, hashed, tenant_id, errors)
+
+            created.extend(
+                {"row": c["row"], "user_id": str(user.id), "username": user.username}
+                for c, user in inserted
+            )
+
+    invalidate_class_totals(*{c["class_ref"] for c in candidates}, tenant_id=tenant_id)
+    errors.sort(key=lambda e: e["row"])
+    return created, errors
+
+
+# =======================================
+# 退会・再開・削除の一括処理
+# =======================================
+def _load_targets(user_ids=None, class_ref=None):
+    """
+    対象の (role, is_active_student, class_ref_id, tenant_id) を 1 クエリで取得する。
+    transaction.atomic() の中で呼び、書き込みまでの間に役割・状態が変わらないよう行をロックする。
+    """
+    profiles = UserProfile.objects.select_for_update()
+    if class_ref is not None:
+        profiles = profiles.filter(class_ref_id=class_ref)
+    else:
+        profiles = profiles.filter(user_id__in=user_ids)
+
+    targets = {
+        str(user_id): (role, is_active_student, class_id, tenant_id)
+        for user_id, role, is_active_student, class_id, tenant_id
+        in profiles.values_list("user_id", "role", "is_active_student", "class_ref_id", "tenant_id")
+    }
+    # 同じ id が重ねて指定されても結果は 1 行にする
+    requested = list(dict.fromkeys(str(user_id) for user_id in user_ids)) if class_ref is None else list(targets)
+    return requested, targets
+
+
+def _invalidate_target_classes(targets, user_ids):
+    for class_id, tenant_id in {targets[user_id][2:] for user_id in user_ids}:
+        invalidate_class_totals(class_id, tenant_id=tenant_id)
+
+
+def _set_active_students(user_ids, class_ref, active):
+    results = []
+    changed = []
+
+    with transaction.atomic():
+        requested, targets = _load_targets(user_ids, class_ref)
+        for user_id in requested:
+            if user_id not in targets:
+                results.append({"user_id": user_id, "status": "not_found"})
+                continue
+
+            role, is_active_student, _, _ = targets[user_id]
+            if role != "student":
+                results.append({"user_id": user_id, "status": "forbidden"})
+            elif is_active_student == active:
+                results.append({"user_id": user_id, "status": "already_active" if active else "already_inactive"})
+            else:
+                results.append({"user_id": user_id, "status": "reactivated" if active else "deactivated"})
+                changed.append(user_id)
+
+        if changed:
+            UserProfile.objects.filter(user_id__in=changed).update(is_active_student=active, updated_at=now())
+            if not active:
+                revocations.revoke_users(*changed)
+
+    if changed:
+        # update() はシグナルを通らないのでキャッシュを明示的に破棄
+        invalidate_me_snapshot(*changed)
+        invalidate_cached_user(*changed)
+        _invalidate_target_classes(targets, changed)
+
+    return results
+
+
+def bulk_deactivate_students(user_ids=None, class_ref=None):
+    return _set_active_students(user_ids, class_ref, active=False)
+
+
+def bulk_reactivate_students(user_ids=None, class_ref=None):
+    return _set_active_students(user_ids, class_ref, active=True)
+
+
+def bulk_delete_students(deleted_by, user_ids=None, class_ref=None):
+    results = []
+    deletable = []
+
+    with transaction.atomic():
+        requested, targets = _load_targets(user_ids, class_ref)
+        for user_id in requested:
+            if user_id not in targets:
+                results.append({"user_id": user_id, "status": "not_found"})
+                continue
+
+            role, is_active_student, _, _ = targets[user_id]
+            if role != "student":
+                results.append({"user_id": user_id, "status": "forbidden"})
+            elif is_active_student:
+                results.append({"user_id": user_id, "status": "still_active"})
+            else:
+                results.append({"user_id": user_id, "status": "deleted"})
+                deletable.append(user_id)
+
+        if deletable:
+            users = User.objects.filter(id__in=deletable).values_list("id", "username", "email", "name", "tenant_id")
+            DeletedUserLog.objects.bulk_create([
+                DeletedUserLog(
+                    user_id=user_id,
+                    username=username,
+                    email=email,
+                    name=name,
+                    deleted_by=deleted_by,
+                    tenant_id=tenant_id,
+                )
+                for user_id, username, email, name, tenant_id in users
+            ])
+            # profile / PointManager は CASCADE で一緒に消える
+            User.objects.filter(id__in=deletable).delete()
+            revocations.revoke_users(*deletable)
+
+    if deletable:
+        invalidate_me_snapshot(*deletable)
+        invalidate_cached_user(*deletable)
+        _invalidate_target_classes(targets, deletable)
+
+    return results
@@ -1,13 +1,75 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.conf import settings
 from points.models import PointManager
 from .models import UserProfile, User
+from .cache import invalidate_cached_user, invalidate_class_totals, invalidate_me_snapshot
+from .events import publish_user_event
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_related_models(sender, instance, created, **kwargs):
     if created:
-        UserProfile.objects.create(user=instance)
+        UserProfile.objects.create(user=instance, role=getattr(instance, "_profile_role", "student"),
+                                   tenant_id=instance.tenant_id)
         PointManager.objects.create(user=instance)
 
+
+# /me/ スナップショットの破棄
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_snapshot(sender, instance, **kwargs):
+    invalidate_me_snapshot(instance.pk)
+    invalidate_cached_user(instance.pk)
+
+
+# 退会・再開・削除はいずれも profile の save/delete を通る
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_profile_caches(sender, instance, **kwargs):
+    invalidate_me_snapshot(instance.user_id)
+    invalidate_cached_user(instance.user_id)
+    invalidate_class_totals(instance.class_ref_id, getattr(instance, "_loaded_class_ref_id", None),
+                            tenant_id=instance.tenant_id)
+
+
+@receiver(post_delete, sender=PointManager)
+def invalidate_point_snapshot(sender, instance, **kwargs):
+    # User 削除のカスケードでは profile 側の削除でクラス集計も破棄される
+    invalidate_me_snapshot(instance.user_id)
+
+
+@receiver(post_save, sender=PointManager)
+def invalidate_point_caches(sender, instance, created, **kwargs):
+    invalidate_me_snapshot(instance.user_id)
+    if created:
+        return  # 登録直後はクラス未所属
+    class_id, tenant_id = (
+        UserProfile.all_tenants
+        .filter(user_id=instance.user_id)
+        .values_list("class_ref_id", "tenant_id")
+        .first()
+    ) or (None, None)
+    invalidate_class_totals(class_id, tenant_id=tenant_id)
+
+
+# /me/stream/ への通知（コミット後に配信）
+@receiver(post_save, sender=PointManager)
+def publish_balance(sender, instance, **kwargs):
+    if isinstance(instance.point_balance, int):
+        publish_user_event(instance.user_id, "balance", point_balance=instance.point_balance)
+    else:
+        # F() 式で更新された場合は保存後の値が分からないので再取得させる
+        publish_user_event(instance.user_id, "resync")
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_save, sender=UserProfile)
+def publish_profile(sender, instance, created=False, **kwargs):
+    if not created:
+        publish_user_event(getattr(instance, "user_id", instance.pk), "profile")
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def publish_deleted(sender, instance, **kwargs):
+    publish_user_event(instance.pk, "deleted")
@@ -0,0 +1,80 @@
+"""
+教室（テナント）ごとのデータの分離。
+認証したユーザーの tenant をリクエストの間 ContextVar に置き、User / UserProfile / DeletedUserLog の
+既定のマネージャ（objects）が作る QuerySet に tenant_id の条件を付ける。索引はいずれも tenant から始まるので、
+テナントの数が増えても 1 テナントあたりのクエリのコストは変わらない。
+
+次の場合は絞り込まない（UNSCOPED）:
+    - 管理者（is_admin）のリクエスト
+    - リクエストの外（管理コマンド・バックグラウンド処理）
+tenant を持たないユーザー（単一教室のときから居る教師・生徒）は tenant が NULL の行だけを見る。
+一意性の確認やクラス集計など、テナントをまたいで見る必要がある処理は all_tenants マネージャを使う。
+QuerySet は作った時点の tenant で絞り込まれるので、StreamingHttpResponse で後から評価しても範囲は変わらない。
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.core.signals import request_finished, request_started
+from django.db import models
+from django.dispatch import receiver
+
+
+class _Unscoped:
+    def __repr__(self):
+        return "UNSCOPED"
+
+
+# テナントで絞り込まないことを表す（None は「tenant が NULL の行」）
+UNSCOPED = _Unscoped()
+
+_current_tenant = ContextVar("accounts_tenant", default=UNSCOPED)
+
+
+def current_tenant():
+    return _current_tenant.get()
+
+
+def is_scoped():
+    return _current_tenant.get() is not UNSCOPED
+
+
+def tenant_for(user):
+    """ユーザーが見てよいテナント（UNSCOPED は絞り込みなし）"""
+    if user is None or not user.is_authenticated or getattr(user, "is_admin", False):
+        return UNSCOPED
+    return user.tenant_id
+
+
+def scope_queryset(queryset, tenant):
+    """tenant（UNSCOPED / None / id）で QuerySet を絞り込む"""
+    return queryset if tenant is UNSCOPED else queryset.filter(tenant_id=tenant)
+
+
+def activate_tenant(user):
+    """認証したユーザーのテナントをこのリクエストの範囲にする（CookieJWTAuthentication から呼ぶ）"""
+    _current_tenant.set(tenant_for(user))
+
+
+@contextmanager
+def tenant_scope(tenant_id):
+    token = _current_tenant.set(tenant_id)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+
+@receiver(request_started)
+@receiver(request_finished)
+def clear_tenant(**kwargs):
+    # WSGI のスレッドは使い回されるので、前のリクエストのテナントを持ち越さない
+    _current_tenant.set(UNSCOPED)
+
+
+class TenantScopedManagerMixin:
+    def get_queryset(self):
+        return scope_queryset(super().get_queryset(), _current_tenant.get())
+
+
+class TenantManager(TenantScopedManagerMixin, models.Manager):
+    pass
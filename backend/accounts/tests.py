@@ -1,3 +1,1397 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.cache import cache as django_cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.forms.models import model_to_dict
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from points.models import ClassMaster, PointManager
+from . import async_views, audit, export, hashing, images, loadtest, profiling, services, throttling, views
+from . import archive
+from .archive import archive_logs, iter_deleted_logs
+from .benchmarks import ROUTES, BenchContext, client_for, count_queries, data_statements, reset_caches
+from .cache import TTLCache, auth_user_cache, class_totals_key, get_cached_user, me_snapshot_key
+from .events import broker
+from .management.commands import login_rush
+from . import middleware
+from .middleware import ImmutableMediaMiddleware, ReplicaStickyMiddleware, ServerTimingMiddleware
+from .models import AuditEvent, DeletedUserLog, Tenant, TokenRevocation, User, UserProfile
+from .renderers import FastJSONRenderer
+from .revocation import RevocationList, revocations
+from .routers import STICKY_COOKIE, ReplicaReadMixin, ReplicaRouter, replica_cache_timeout
+from .seeding import BENCH_PASSWORD, seed_accounts
+from .services import RegistrationError, bulk_deactivate_students, conflicting_field, register_user
+from .tenancy import is_scoped, tenant_scope
+from .throttling import CacheBucketBackend, LoginThrottle
+
+
+class RegisterUserTests(TestCase):
+    def test_creates_user_profile_and_point_manager_in_three_statements(self):
+        with CaptureQueriesContext(connection) as ctx:
+            user = register_user("taro", "taro@example.com", "pass1234", name="Taro", role="teacher")
+
+        self.assertLessEqual(len(data_statements(ctx.captured_queries)), 3)
+        self.assertEqual(UserProfile.objects.get(user=user).role, "teacher")
+        self.assertTrue(PointManager.objects.filter(user=user).exists())
+        self.assertTrue(User.objects.get(pk=user.pk).check_password("pass1234"))
+
+    def test_duplicate_username_is_reported(self):
+        register_user("taro", "taro@example.com", "pass1234")
+
+        with self.assertRaises(RegistrationError) as ctx:
+            register_user("taro", "other@example.com", "pass1234")
+        self.assertEqual(ctx.exception.field, "username")
+
+    def test_duplicate_email_is_reported(self):
+        register_user("taro", "taro@example.com", "pass1234")
+
+        with self.assertRaises(RegistrationError) as ctx:
+            register_user("jiro", "taro@example.com", "pass1234")
+        self.assertEqual(ctx.exception.field, "email")
+        self.assertFalse(User.objects.filter(username="jiro").exists())
+
+    def test_conflict_is_classified_by_key_name_not_value(self):
+        messages = {
+            "Duplicate entry 'username@x.com' for key 'accounts_user.email'": "email",
+            "Duplicate entry 'email' for key 'username'": "username",
+            'duplicate key value violates unique constraint "accounts_user_email_key"\n'
+            "DETAIL:  Key (email)=(username@x.com) already exists.": "email",
+            "UNIQUE constraint failed: accounts_user.username": "username",
+            "Duplicate entry 'x' for key 'PRIMARY'": None,
+        }
+        for message, field in messages.items():
+            self.assertEqual(conflicting_field(IntegrityError(message)), field, message)
+
+    def test_mysqlclient_errno_and_message_form(self):
+        # mysqlclient は (errno, message) で送出し、Django もその args のまま IntegrityError に包む
+        duplicate = IntegrityError(1062, "Duplicate entry 'taro' for key 'accounts_user.username'")
+        self.assertEqual(conflicting_field(duplicate), "username")
+        self.assertIsNone(conflicting_field(IntegrityError(1452, "Cannot add or update a child row: for key 'username'")))
+
+        with mock.patch.object(User, "save", side_effect=duplicate):
+            with self.assertRaises(RegistrationError) as ctx:
+                register_user("taro", "taro@example.com", "pass1234")
+        self.assertEqual(ctx.exception.field, "username")
+
+
+@override_settings(ACCOUNTS_AUDIT_BACKGROUND=False, ACCOUNTS_REVOCATION_SYNC_INTERVAL=3600)
+class QueryBudgetTests(TestCase):
+    """accounts の全ルートがクエリ予算内に収まること（名簿の件数に依存しないこと）"""
+
+    def assert_within_budget(self, students):
+        ctx = BenchContext(seed_accounts(students=students, teachers=2, deleted_logs=students))
+        for route in ROUTES:
+            with self.subTest(route=route.name, students=students):
+                response, queries = count_queries(ctx, route)
+                self.assertLess(response.status_code, 400, None if response.streaming else response.content)
+                self.assertLessEqual(queries, route.budget)
+
+    def test_small_roster(self):
+        self.assert_within_budget(60)
+
+    def test_larger_roster(self):
+        self.assert_within_budget(240)
+
+
+@override_settings(ACCOUNTS_REVOCATION_SYNC_INTERVAL=3600)
+class ClassRosterTests(TestCase):
+    """クラス名簿のクエリ数が人数に依存せず、移動・残高変更で集計キャッシュが破棄されること"""
+
+    def setUp(self):
+        seeded = seed_accounts(students=8, teachers=1)
+        self.teacher = client_for(seeded["teachers"][0])
+        self.classes = [ClassMaster.objects.create(name=name) for name in ("1-A", "1-B")]
+        self.students = seeded["students"]
+        self.assign(self.students[:3], self.classes[0])
+        self.assign(self.students[3:5], self.classes[1])
+        PointManager.objects.filter(user_id__in=self.students).update(point_balance=10)
+        reset_caches()
+        revocations.sync()
+
+    def assign(self, user_ids, class_master):
+        UserProfile.objects.filter(user_id__in=user_ids).update(class_ref=class_master)
+
+    def roster(self):
+        response = self.teacher.get("/api/account/classes/roster/",
+                                    {"class_ref": [c.pk for c in self.classes]})
+        self.assertEqual(response.status_code, 200, response.content)
+        return {row["class_ref"]: row for row in response.json()["classes"]}
+
+    def totals(self):
+        return {
+            class_id: (row["active_count"], row["total_points"], len(row["students"]))
+            for class_id, row in self.roster().items()
+        }
+
+    def test_query_count_does_not_grow_with_roster(self):
+        # 認証ユーザー・クラス集計・生徒一覧の 3 クエリ
+        with self.assertNumQueries(3):
+            self.roster()
+        # 2 回目は認証ユーザーと集計がキャッシュから出る
+        with self.assertNumQueries(1):
+            self.roster()
+
+        self.assign(self.students[5:], self.classes[0])
+        reset_caches()
+        revocations.sync()
+        with self.assertNumQueries(3):
+            rows = self.roster()
+        self.assertEqual(len(rows[self.classes[0].pk]["students"]), 6)
+
+    def test_totals_follow_class_moves_and_balance_changes(self):
+        first, second = (c.pk for c in self.classes)
+        self.assertEqual(self.totals(), {first: (3, 30, 3), second: (2, 20, 2)})
+
+        # クラスの移動は移動元（_loaded_class_ref_id）と移動先の両方を破棄する
+        profile = UserProfile.objects.get(user_id=self.students[0])
+        profile.class_ref = self.classes[1]
+        profile.save()
+        self.assertIsNone(django_cache.get(class_totals_key(first)))
+        self.assertIsNone(django_cache.get(class_totals_key(second)))
+        self.assertEqual(self.totals(), {first: (2, 20, 2), second: (3, 30, 3)})
+
+        manager = PointManager.objects.get(user_id=self.students[3])
+        manager.point_balance = 100
+        manager.save()
+        self.assertIsNone(django_cache.get(class_totals_key(second)))
+        self.assertEqual(self.totals()[second], (3, 120, 3))
+
+        bulk_deactivate_students([self.students[3]])
+        self.assertEqual(self.totals()[second], (2, 120, 3))
+
+
+class BootstrapTests(TestCase):
+    """/bootstrap/ が CSRF Cookie・トークン・/me/ と同じ内容・設定を 1 回で返すこと"""
+
+    def setUp(self):
+        self.user = User.objects.get(pk=seed_accounts(students=1)["students"][0])
+
+    def test_authenticated(self):
+        client = client_for(self.user)
+        response = client.get(reverse("bootstrap"))
+
+        body = response.json()
+        self.assertTrue(body["authenticated"])
+        self.assertEqual(body["user"], client.get(reverse("me")).json())
+        self.assertTrue(body["csrf_token"])
+        self.assertIn("csrftoken", response.cookies)
+        self.assertIn("media_url", body["config"])
+
+    def test_anonymous_and_expired_token(self):
+        for client in (client_for(), client_for(self.user)):
+            if client.cookies:
+                client.cookies["access_token"] = "expired"
+            with self.subTest(cookie=bool(client.cookies)):
+                response = client.get(reverse("bootstrap"))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["authenticated"], False)
+                self.assertIsNone(response.json()["user"])
+                self.assertIn("csrftoken", response.cookies)
+
+
+class AsyncReadViewTests(TestCase):
+    """非同期版の読み取りビューが同期版と同じレスポンスを返すこと"""
+
+    def setUp(self):
+        seeded = seed_accounts(students=25, teachers=1)
+        self.student = User.objects.get(pk=seeded["students"][0])
+        self.teacher = seeded["teachers"][0]
+
+    def call_pair(self, sync_view, async_view, user, path, **kwargs):
+        token = str(RefreshToken.for_user(user).access_token)
+        sync_factory, async_factory = RequestFactory(), AsyncRequestFactory()
+        sync_factory.cookies["access_token"] = token
+        async_factory.cookies["access_token"] = token
+
+        reset_caches()
+        expected = sync_view.as_view()(sync_factory.get(path), **kwargs)
+        expected.render()
+        reset_caches()
+        actual = async_to_sync(async_view.as_view())(async_factory.get(path), **kwargs)
+        self.assertEqual(actual.status_code, expected.status_code)
+        return json.loads(expected.content), json.loads(actual.content)
+
+    def assert_same(self, *args, **kwargs):
+        expected, actual = self.call_pair(*args, **kwargs)
+        self.assertEqual(actual, expected)
+
+    def test_me(self):
+        self.assert_same(views.MeView, async_views.AsyncMeView, self.student, "/me/")
+
+    def test_profile_me(self):
+        self.assert_same(views.UserProfileMeView, async_views.AsyncUserProfileMeView, self.student, "/profile/me/")
+
+    def test_account_detail(self):
+        self.assert_same(views.AccountDetailView, async_views.AsyncAccountDetailView, self.teacher,
+                         "/account/detail/", user_id=self.student.pk)
+
+    def test_account_list_pages(self):
+        path = "/account/list/?role=student&limit=10"
+        seen = []
+        while path:
+            expected, actual = self.call_pair(
+                views.AccountsListView, async_views.AsyncAccountsListView, self.teacher, path)
+            self.assertEqual(actual["results"], expected["results"])
+            self.assertEqual(actual["next"] is None, expected["next"] is None)
+            seen += [row["username"] for row in actual["results"]]
+            path = actual["next"]
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(seen), 25)
+
+        # 前のページへ戻るカーソルも同期版と同じ結果になる
+        first, _ = self.call_pair(
+            views.AccountsListView, async_views.AsyncAccountsListView, self.teacher, "/account/list/?role=student&limit=10")
+        second, _ = self.call_pair(
+            views.AccountsListView, async_views.AsyncAccountsListView, self.teacher, first["next"])
+        expected, actual = self.call_pair(
+            views.AccountsListView, async_views.AsyncAccountsListView, self.teacher, second["previous"])
+        self.assertEqual(actual["results"], expected["results"])
+        self.assertEqual(actual["results"], first["results"])
+
+    def test_requires_teacher_for_list(self):
+        expected, actual = self.call_pair(
+            views.AccountsListView, async_views.AsyncAccountsListView, self.student, "/account/list/")
+        self.assertEqual(actual, expected)
+
+
+class MeStreamTests(TestCase):
+    """/me/stream/ が保存シグナル経由で残高・プロフィールの変更を送ること"""
+
+    def setUp(self):
+        self.user = User.objects.get(pk=seed_accounts(students=1)["students"][0])
+        factory = AsyncRequestFactory()
+        factory.cookies["access_token"] = str(RefreshToken.for_user(self.user).access_token)
+        self.request = factory.get("/me/stream/")
+
+    def save(self, change):
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+
+    def set_balance(self, value):
+        manager = PointManager.objects.get(user=self.user)
+        manager.point_balance = value
+        manager.save()
+
+    def set_comment(self, value):
+        profile = UserProfile.objects.get(user=self.user)
+        profile.comment = value
+        profile.save()
+
+    def read_event(self, chunk):
+        lines = dict(line.split(": ", 1) for line in chunk.decode().strip().splitlines() if ": " in line)
+        return lines["event"], json.loads(lines["data"])
+
+    def test_pushes_changes_until_deleted(self):
+        async def scenario():
+            response = await async_views.MeStreamView.as_view()(self.request)
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            chunks = aiter(response.streaming_content)
+
+            name, data = self.read_event(await anext(chunks))
+            self.assertEqual(name, "me")
+            self.assertEqual(broker.stats()["subscribers"], 1)
+
+            balance = data["point_balance"] + 42
+            await sync_to_async(self.save)(lambda: self.set_balance(balance))
+            name, data = self.read_event(await anext(chunks))
+            self.assertEqual((name, data["point_balance"]), ("me", balance))
+
+            await sync_to_async(self.save)(lambda: self.set_comment("hello"))
+            name, data = self.read_event(await anext(chunks))
+            self.assertEqual((name, data["username"]), ("me", self.user.username))
+
+            await sync_to_async(self.save)(lambda: self.user.delete())
+            name, _ = self.read_event(await anext(chunks))
+            self.assertEqual(name, "logout")
+
+            with self.assertRaises(StopAsyncIteration):
+                await anext(chunks)
+            self.assertEqual(broker.stats()["subscribers"], 0)
+
+        async_to_sync(scenario)()
+
+    def test_closed_loop_drops_subscriber_without_raising(self):
+        user_id = uuid.uuid4()
+        loop = asyncio.new_event_loop()
+        subscription = broker.subscribe(user_id)
+        loop.run_until_complete(subscription.__aenter__())
+        loop.close()
+        subscribers = broker.stats()["subscribers"]
+
+        broker.publish(user_id, {"type": "balance", "point_balance": 1})
+        self.assertEqual(broker.stats()["subscribers"], subscribers - 1)
+        broker.publish(user_id, {"type": "balance", "point_balance": 2})
+
+    def test_requires_authentication(self):
+        request = AsyncRequestFactory().get("/me/stream/")
+        response = async_to_sync(async_views.MeStreamView.as_view())(request)
+        self.assertEqual(response.status_code, 401)
+
+
+class DeletedLogArchiveTests(TestCase):
+    """古い削除ログをアーカイブへ移しても、エクスポートでは全件が古い順に読めること"""
+
+    def setUp(self):
+        seeded = seed_accounts(students=1, deleted_logs=30)
+        self.teacher = seeded["teachers"][0]
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        for days, log in enumerate(DeletedUserLog.objects.order_by("id")):
+            DeletedUserLog.objects.filter(pk=log.pk).update(deleted_at=now() - timedelta(days=days, hours=1))
+
+    def test_archive_and_export(self):
+        expected = [log.username for log in DeletedUserLog.objects.order_by("deleted_at")]
+
+        archived = archive_logs(now() - timedelta(days=10), root=self.root, batch_size=7)
+
+        self.assertEqual(sum(archived.values()), 20)
+        self.assertEqual(DeletedUserLog.objects.count(), 10)
+        self.assertEqual([row["username"] for row in iter_deleted_logs(root=self.root)], expected)
+
+    def test_failed_delete_leaves_nothing_archived(self):
+        with mock.patch("django.db.models.query.QuerySet.delete", side_effect=RuntimeError("delete failed")):
+            with self.assertRaises(RuntimeError):
+                archive_logs(now() - timedelta(days=10), root=self.root, batch_size=7)
+
+        self.assertEqual(DeletedUserLog.objects.count(), 30)
+        self.assertEqual(archive.archive_files(self.root), [])
+        self.assertEqual(len(list(iter_deleted_logs(root=self.root))), 30)
+
+    def test_interrupted_run_is_recovered(self):
+        # 削除のコミット後、改名の前に止まった場合の代わりに _publish を止める
+        with mock.patch.object(archive, "_publish"):
+            archive_logs(now() - timedelta(days=10), root=self.root, batch_size=50)
+        self.assertEqual(archive.archive_files(self.root), [])
+
+        archive.recover_pending(self.root)
+        self.assertEqual(len(list(iter_deleted_logs(root=self.root))), 30)
+        self.assertEqual(archive_logs(now() - timedelta(days=10), root=self.root), {})
+
+    def test_list_is_paginated_newest_first(self):
+        client = client_for(self.teacher)
+        response = client.get(reverse("deleted-logs") + "?limit=12")
+
+        body = response.json()
+        self.assertEqual(len(body["results"]), 12)
+        self.assertIsNotNone(body["next"])
+        self.assertEqual(body["results"][0]["deleted_by"], self.teacher.username)
+        stamps = [row["deleted_at"] for row in body["results"]]
+        self.assertEqual(stamps, sorted(stamps, reverse=True))
+
+
+@override_settings(ACCOUNTS_AUDIT_BACKGROUND=False)
+class AuditLogTests(TestCase):
+    """監査ログはリクエスト中に書き込まず、flush でまとめて保存されること"""
+
+    def setUp(self):
+        seeded = seed_accounts(students=3, teachers=1)
+        self.teacher = seeded["teachers"][0]
+        self.student = User.objects.get(pk=seeded["students"][0])
+        self.log = audit.AuditLog(flush_size=2)
+        patcher = mock.patch.object(audit, "audit_log", self.log)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_events_are_buffered_then_queryable(self):
+        anonymous = client_for()
+        with CaptureQueriesContext(connection) as ctx:
+            anonymous.post(reverse("login"), {"username": self.student.username, "password": "wrong"}, format="json")
+        self.assertFalse(any("audit" in q["sql"].lower() for q in ctx.captured_queries))
+
+        anonymous.post(reverse("login"), {"username": self.student.username, "password": BENCH_PASSWORD}, format="json")
+        client_for(self.teacher).post(reverse("account-deactivate", args=[self.student.pk]))
+        self.assertEqual(self.log.stats()["buffered"], 3)
+
+        self.assertEqual(self.log.flush(), 3)
+        response = client_for(self.teacher).get(reverse("audit-events"), {"target": str(self.student.pk)})
+        actions = [event["action"] for event in response.json()["results"]]
+        self.assertEqual(actions, ["deactivate", "login_success"])
+
+        # 認証に失敗した場合は対象を引かず、入力された username だけを残す
+        response = client_for(self.teacher).get(reverse("audit-events"), {"action": "login_failure"})
+        self.assertEqual(response.json()["results"][0]["detail"], {"username": self.student.username})
+
+    def test_close_drains_buffer(self):
+        for _ in range(5):
+            self.log.record("logout", actor_id=self.student.pk)
+        self.log.close()
+        self.assertEqual(AuditEvent.objects.filter(action="logout").count(), 5)
+
+    def test_forged_forwarded_for_is_not_trusted(self):
+        request = RequestFactory().get("/", HTTP_X_FORWARDED_FOR="' OR 1=1 --, 10.0.0.1", REMOTE_ADDR="192.0.2.7")
+        self.assertEqual(audit.client_ip(request), "192.0.2.7")
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "NUM_PROXIES": 2}):
+            self.assertIsNone(audit.client_ip(request))
+            request.META["HTTP_X_FORWARDED_FOR"] = "203.0.113.5, 10.0.0.1"
+            self.assertEqual(audit.client_ip(request), "203.0.113.5")
+
+    def test_failed_batch_is_written_row_by_row(self):
+        for _ in range(2):
+            self.log.record("logout", actor_id=self.student.pk)
+        with mock.patch.object(AuditEvent.objects, "bulk_create", side_effect=ValueError("bad row")):
+            self.assertEqual(self.log.flush(), 2)
+        self.assertEqual(AuditEvent.objects.filter(action="logout").count(), 2)
+
+
+class FastJSONRendererTests(TestCase):
+    """orjson の出力が DRF の JSONRenderer と同じ値になり、設定にあるビューだけが使うこと"""
+
+    def test_output_matches_drf_json_renderer(self):
+        data = {
+            "id": uuid.uuid4(),
+            "at": now(),
+            "amount": Decimal("1.50"),
+            "label": gettext_lazy("Student"),
+            "nested": [{"n": 1, "none": None}],
+            3: "non-str key",
+        }
+        fast = FastJSONRenderer().render(data)
+        self.assertIsInstance(fast, bytes)
+        self.assertEqual(json.loads(fast), json.loads(JSONRenderer().render(data)))
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+
+    def test_renderer_is_selected_per_view(self):
+        def first_renderer(view_class):
+            return type(view_class().get_renderers()[0])
+
+        self.assertIs(first_renderer(views.MeView), FastJSONRenderer)
+        self.assertIs(first_renderer(views.AccountsListView), FastJSONRenderer)
+        # JSONRenderer は置き換えられ、重ねて残らない
+        self.assertNotIn(JSONRenderer, [type(r) for r in views.MeView().get_renderers()])
+
+        with override_settings(ACCOUNTS_FAST_JSON_VIEWS=("MeView",)):
+            self.assertIs(first_renderer(views.MeView), FastJSONRenderer)
+            self.assertIs(first_renderer(views.AccountsListView), JSONRenderer)
+
+
+@override_settings(ACCOUNTS_AUDIT_BACKGROUND=False)
+class ProfileImagePipelineTests(TestCase):
+    """アップロードから WebP の縮小版が内容ハッシュ名でファイルシステムに書き出されること"""
+
+    def setUp(self):
+        self.student = User.objects.get(pk=seed_accounts(students=1)["students"][0])
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media_root = media_root
+        patcher = mock.patch.object(images, "PIPELINE_SYNC", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, size=(800, 600)):
+        buffer = io.BytesIO()
+        Image.new("RGB", size, (200, 30, 30)).save(buffer, "PNG")
+        return SimpleUploadedFile("photo.PNG", buffer.getvalue(), content_type="image/png")
+
+    def test_upload_produces_hashed_webp_variants(self):
+        client = client_for(self.student)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch("/api/profile/me/", {"image": self.upload()}, format="multipart")
+        self.assertEqual(response.status_code, 200, response.content)
+
+        profile = UserProfile.objects.get(user=self.student)
+        self.assertRegex(profile.image.name, r"^profile/uploads/[0-9a-f]{20}\.png$")
+
+        for variant, size in images.VARIANT_SIZES.items():
+            name = getattr(profile, f"image_{variant}").name
+            self.assertRegex(name, rf"^profile/variants/[0-9a-f]{{20}}_{variant}\.webp$")
+            path = os.path.join(self.media_root, name)
+            self.assertTrue(os.path.exists(path), path)
+            with open(path, "rb") as f:
+                data = f.read()
+            self.assertTrue(os.path.basename(name).startswith(hashlib.sha256(data).hexdigest()[:20]))
+            with Image.open(io.BytesIO(data)) as image:
+                self.assertEqual((image.format, image.size), ("WEBP", size))
+
+        # /me/ は縮小版を返す（パイプラインがスナップショットを破棄している）
+        me = client.get(reverse("me")).json()["profile"]
+        self.assertTrue(me["image_thumb"].endswith(profile.image_thumb.name))
+        self.assertTrue(me["image_medium"].endswith(profile.image_medium.name))
+
+    def test_same_upload_reuses_files(self):
+        first = images.render_variants(images.store_upload(self.upload()))
+        second = images.render_variants(images.store_upload(self.upload()))
+        self.assertEqual(first, second)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, "profile/variants"))), len(images.VARIANT_SIZES))
+
+
+class ImmutableMediaTests(TestCase):
+    """長期キャッシュは内容ハッシュ名と、発行した版のデフォルト画像だけに付くこと"""
+
+    def cache_control(self, path):
+        response = ImmutableMediaMiddleware(lambda request: HttpResponse("x"))(RequestFactory().get(path))
+        return response.get("Cache-Control")
+
+    def test_only_content_addressed_urls_are_immutable(self):
+        with mock.patch.object(middleware, "default_image_version", return_value=("/media/profile/default.webp", "abc")):
+            self.assertIn("immutable", self.cache_control("/media/profile/variants/6c209bc4c087244f9bc6_thumb.webp"))
+            self.assertIn("immutable", self.cache_control("/media/profile/default.webp?v=abc"))
+            self.assertIsNone(self.cache_control("/media/profile/default.webp?v=other"))
+            self.assertIsNone(self.cache_control("/media/profile/uploads/photo.jpg?v=abc"))
+
+
+class AliasView(ReplicaReadMixin, APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        return Response({"alias": ReplicaRouter().db_for_read(User), "timeout": replica_cache_timeout(300)})
+
+
+@override_settings(ACCOUNTS_READ_REPLICAS=["replica"], ACCOUNTS_REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(TestCase):
+    """読み取りビューはレプリカを読み、書き込んだクライアントはしばらくプライマリを読むこと"""
+
+    def get(self, **cookies):
+        factory = RequestFactory()
+        for key, value in cookies.items():
+            factory.cookies[key] = value
+        return AliasView.as_view()(factory.get("/")).data
+
+    def test_reads_go_to_replica_with_short_cache_timeout(self):
+        self.assertEqual(self.get(), {"alias": "replica", "timeout": 5})
+        # ビューの外（書き込み・シグナル・コマンド）はプライマリ
+        self.assertEqual(ReplicaRouter().db_for_read(User), "default")
+        self.assertEqual(ReplicaRouter().db_for_write(User), "default")
+
+    def test_successful_write_pins_client_to_primary(self):
+        middleware = ReplicaStickyMiddleware(lambda request: HttpResponse(status=201))
+        response = middleware(RequestFactory().post("/"))
+        pinned = response.cookies[STICKY_COOKIE].value
+
+        self.assertEqual(self.get(**{STICKY_COOKIE: pinned}), {"alias": "default", "timeout": 300})
+        self.assertEqual(self.get(**{STICKY_COOKIE: "0"})["alias"], "replica")
+
+    def test_failed_write_does_not_pin(self):
+        middleware = ReplicaStickyMiddleware(lambda request: HttpResponse(status=400))
+        self.assertNotIn(STICKY_COOKIE, middleware(RequestFactory().post("/")).cookies)
+
+    def test_async_chain_stays_async(self):
+        async def view(request):
+            return HttpResponse(status=201)
+
+        middleware = ReplicaStickyMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertIn(STICKY_COOKIE, async_to_sync(middleware)(AsyncRequestFactory().post("/")).cookies)
+
+
+class MeSnapshotTests(TestCase):
+    """/me/ の ETag による 304 と、User / UserProfile / PointManager の保存でのスナップショット破棄"""
+
+    def setUp(self):
+        self.student = User.objects.get(pk=seed_accounts(students=1)["students"][0])
+        self.client = client_for(self.student)
+        reset_caches()
+
+    def get_me(self, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get(reverse("me"), **headers)
+
+    def test_conditional_get(self):
+        response = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+        etag = response["ETag"]
+
+        for header in (etag, f'"other", {etag}', "*"):
+            cached = self.get_me(header)
+            self.assertEqual(cached.status_code, 304, header)
+            self.assertEqual(cached.content, b"")
+            self.assertEqual(cached["ETag"], etag)
+            self.assertEqual(cached["Cache-Control"], "private, no-cache")
+
+        self.assertEqual(self.get_me('"stale"').status_code, 200)
+
+    def test_saves_drop_snapshot(self):
+        def change_name():
+            self.student.name = "renamed"
+            self.student.save()
+
+        def change_profile():
+            profile = UserProfile.objects.get(user=self.student)
+            profile.comment = "hello"
+            profile.save()
+
+        def change_balance():
+            manager = PointManager.objects.get(user=self.student)
+            manager.point_balance = 12345
+            manager.save()
+
+        for change in (change_name, change_profile, change_balance):
+            etag = self.get_me()["ETag"]
+            self.assertIsNotNone(django_cache.get(me_snapshot_key(self.student.pk)))
+            change()
+            self.assertIsNone(django_cache.get(me_snapshot_key(self.student.pk)), change.__name__)
+
+        response = self.get_me(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["name"], response.json()["point_balance"]), ("renamed", 12345))
+
+
+@override_settings(ACCOUNTS_AUDIT_BACKGROUND=False)
+class AuthUserCacheTests(TestCase):
+    """認証ユーザーのプロセス内キャッシュのヒット・期限と、書き込みごとの破棄"""
+
+    def setUp(self):
+        seeded = seed_accounts(students=3, teachers=1)
+        self.teacher = seeded["teachers"][0]
+        self.teacher_client = client_for(self.teacher)
+        self.students = list(User.objects.filter(pk__in=seeded["students"]).order_by("username"))
+        reset_caches()
+
+    def prime(self, user):
+        client = client_for(user)
+        self.assertEqual(client.get(reverse("me")).status_code, 200)
+        self.assertIsNotNone(get_cached_user(user.pk))
+        return client
+
+    def test_hit_and_miss(self):
+        client = client_for(self.students[0])
+        client.get(reverse("me"))
+        self.assertEqual(auth_user_cache.stats(), {"hits": 0, "misses": 1, "size": 1})
+
+        with CaptureQueriesContext(connection) as ctx:
+            client.get(reverse("me"))
+        self.assertEqual(auth_user_cache.stats()["hits"], 1)
+        self.assertFalse(any('from "accounts_user"' in q["sql"].lower() for q in ctx.captured_queries))
+
+        # 共有インスタンスを書き換えてもキャッシュ側は変わらない
+        get_cached_user(self.students[0].pk).name = "changed"
+        self.assertNotEqual(get_cached_user(self.students[0].pk).name, "changed")
+
+    def test_entries_expire_after_ttl(self):
+        ttl_cache = TTLCache(maxsize=2, ttl=30)
+        with mock.patch("accounts.cache.time.monotonic", return_value=1000):
+            ttl_cache.set("a", 1)
+            ttl_cache.set("b", 2, ttl=5)
+        with mock.patch("accounts.cache.time.monotonic", return_value=1010):
+            self.assertEqual(ttl_cache.get("a"), 1)
+            self.assertIsNone(ttl_cache.get("b"))
+        with mock.patch("accounts.cache.time.monotonic", return_value=1031):
+            self.assertIsNone(ttl_cache.get("a"))
+        self.assertEqual(ttl_cache.stats()["size"], 0)
+
+    def test_lru_evicts_oldest(self):
+        ttl_cache = TTLCache(maxsize=2, ttl=30)
+        ttl_cache.set("a", 1)
+        ttl_cache.set("b", 2)
+        ttl_cache.get("a")
+        ttl_cache.set("c", 3)
+        self.assertIsNone(ttl_cache.get("b"))
+        self.assertEqual((ttl_cache.get("a"), ttl_cache.get("c")), (1, 3))
+
+    def test_single_account_actions_invalidate(self):
+        student = self.students[0]
+        paths = [
+            ("post", reverse("account-deactivate", args=[student.pk])),
+            ("post", f"/api/account/{student.pk}/reactivate/"),
+        ]
+        for method, path in paths:
+            self.prime(student)
+            self.assertEqual(getattr(self.teacher_client, method)(path).status_code, 200)
+            self.assertIsNone(get_cached_user(student.pk), path)
+
+        self.prime(student)
+        self.teacher_client.post(reverse("account-deactivate", args=[student.pk]))
+        self.prime(self.students[1])
+        self.assertEqual(self.teacher_client.delete(f"/api/account/{student.pk}/delete/").status_code, 200)
+        self.assertIsNone(get_cached_user(student.pk))
+
+    def test_bulk_actions_invalidate(self):
+        ids = [student.pk for student in self.students[:2]]
+        for action in (services.bulk_deactivate_students, services.bulk_reactivate_students,
+                       services.bulk_deactivate_students):
+            for student in self.students[:2]:
+                self.prime(student)
+            action(ids)
+            self.assertEqual([get_cached_user(user_id) for user_id in ids], [None, None], action.__name__)
+
+        for student in self.students[:2]:
+            self.prime(student)
+        services.bulk_delete_students(self.teacher, ids)
+        self.assertEqual([get_cached_user(user_id) for user_id in ids], [None, None])
+
+    def test_role_change_takes_effect_immediately(self):
+        self.assertEqual(self.teacher_client.get("/api/account/list/").status_code, 200)
+        self.assertIsNotNone(get_cached_user(self.teacher.pk))
+
+        profile = UserProfile.objects.get(user=self.teacher)
+        profile.role = "student"
+        profile.save()
+        self.assertIsNone(get_cached_user(self.teacher.pk))
+        self.assertEqual(self.teacher_client.get("/api/account/list/").status_code, 403)
+
+    def test_user_and_profile_saves_invalidate(self):
+        student = self.students[0]
+        client = self.prime(student)
+        self.assertEqual(client.patch("/api/profile/me/", {"comment": "hi"}, format="json").status_code, 200)
+        self.assertIsNone(get_cached_user(student.pk))
+
+        self.prime(student)
+        student.is_active = False
+        student.save()
+        self.assertIsNone(get_cached_user(student.pk))
+        self.assertEqual(client.get(reverse("me")).status_code, 401)
+
+
+@override_settings(ACCOUNTS_AUDIT_BACKGROUND=False)
+class HashingExecutorTests(TestCase):
+    """ハッシュ実行器が workers + queue_limit を超えた分を 503 + Retry-After で断ること"""
+
+    def setUp(self):
+        self.student = User.objects.get(pk=seed_accounts(students=1)["students"][0])
+        self.executor = hashing.HashingExecutor(workers=1, queue_limit=1, timeout=5, retry_after=3)
+        self.addCleanup(self.executor._executor.shutdown)
+        for target in (hashing, views):
+            patcher = mock.patch.object(target, "password_executor", self.executor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fill(self, release):
+        """実行中 1 件 + 待ち 1 件で枠を埋める"""
+        threads = [threading.Thread(target=self.executor.run, args=(release.wait,)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while self.executor.metrics()["in_flight"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return threads
+
+    def test_overflow_returns_503_with_retry_after(self):
+        release = threading.Event()
+        threads = self.fill(release)
+        try:
+            metrics = self.executor.metrics()
+            self.assertEqual((metrics["in_flight"], metrics["queue_depth"]), (2, 1))
+
+            response = client_for().post(reverse("login"), {"username": self.student.username,
+                                                            "password": BENCH_PASSWORD}, format="json")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "3")
+            self.assertEqual(response.json()["detail"], hashing.HashingBusy.default_detail)
+        finally:
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        metrics = self.executor.metrics()
+        self.assertEqual((metrics["in_flight"], metrics["completed"], metrics["rejected"]), (0, 2, 1))
+        self.assertIsNotNone(metrics["latency_ms"]["p50"])
+
+        # 枠が空けば通常どおりログインできる
+        response = client_for().post(reverse("login"), {"username": self.student.username,
+                                                        "password": BENCH_PASSWORD}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.executor.metrics()["completed"], 3)
+
+
+@override_settings(ACCOUNTS_AUDIT_BACKGROUND=False)
+class LoginThrottleTests(TestCase):
+    """制限を超えたログインは authenticate() の前に 429 で返ること"""
+
+    def setUp(self):
+        throttling.backend.clear()
+        self.addCleanup(throttling.backend.clear)
+        self.student = User.objects.get(pk=seed_accounts(students=1, teachers=1)["students"][0])
+
+    def login(self, username, password="wrong", ip="10.0.0.1"):
+        return client_for().post(reverse("login"), {"username": username, "password": password},
+                                 format="json", REMOTE_ADDR=ip)
+
+    @override_settings(ACCOUNTS_THROTTLE_RATES={"login_username": "3/min"})
+    def test_username_limit_rejects_before_authenticate(self):
+        for _ in range(3):
+            self.assertEqual(self.login(self.student.username).status_code, 401)
+
+        with mock.patch.object(views, "authenticate") as authenticate:
+            # 大文字小文字・別の IP でも同じユーザー名として数える
+            response = self.login(self.student.username.upper(), password=BENCH_PASSWORD, ip="10.0.0.2")
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        authenticate.assert_not_called()
+
+    @override_settings(ACCOUNTS_THROTTLE_RATES={"login_ip": "2/min"})
+    def test_ip_limit_applies_across_usernames(self):
+        self.assertEqual(self.login("a").status_code, 401)
+        self.assertEqual(self.login("b").status_code, 401)
+        self.assertEqual(self.login("c").status_code, 429)
+        self.assertEqual(self.login(self.student.username, BENCH_PASSWORD, ip="10.0.0.2").status_code, 200)
+
+    @override_settings(ACCOUNTS_THROTTLE_RATES={"login_ip": "2/min"})
+    def test_forged_forwarded_for_does_not_reset_ip_bucket(self):
+        statuses = [
+            client_for().post(reverse("login"), {"username": f"user{i}", "password": "wrong"}, format="json",
+                              REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR=f"198.51.100.{i}").status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [401, 401, 429])
+
+    @override_settings(ACCOUNTS_THROTTLE_RATES={"login_username": "2/min"})
+    def test_cache_backend_is_shared_between_workers(self):
+        request = views.LoginView().initialize_request(
+            RequestFactory().post("/", {"username": "taro"}, content_type="application/json"))
+        # 同じキャッシュを見る別々のバックエンド（別ワーカーの代わり）
+        workers = [LoginThrottle(CacheBucketBackend()), LoginThrottle(CacheBucketBackend())]
+        allowed = [workers[i % 2].allow_request(request, None) for i in range(3)]
+        self.assertEqual(allowed, [True, True, False])
+        self.assertGreater(workers[0].wait(), 0)
+
+
+class BulkRegisterStudentsTests(TestCase):
+    """重複は大文字小文字を区別せずに行ごとのエラーにし、取り込み全体は失敗させないこと"""
+
+    def setUp(self):
+        register_user("taro", "taro@example.com", "pass1234")
+
+    def row(self, username, email=None):
+        return {"username": username, "email": email or f"{username}@example.net", "password": "pass1234"}
+
+    def test_parallel_hashing_uses_spawned_processes(self):
+        with mock.patch.object(hashing, "HASH_PROCESSES", 2), mock.patch.object(hashing, "_process_pool", None):
+            hashed = hashing.hash_passwords(["a-pass", "b-pass", "c-pass"])
+            pool = hashing._process_pool
+            self.addCleanup(pool.shutdown)
+        # マルチスレッドのワーカーから fork しない
+        self.assertEqual(pool._mp_context.get_start_method(), "spawn")
+        self.assertEqual(
+            [hashers.check_password(raw, encoded) for raw, encoded in zip(["a-pass", "b-pass", "c-pass"], hashed)],
+            [True, True, True],
+        )
+
+    def test_duplicates_in_file_ignore_case(self):
+        created, errors = services.bulk_register_students([
+            self.row("hanako"), self.row("HANAKO"), self.row("jiro", "Hanako@example.net"),
+        ])
+        self.assertEqual([row["username"] for row in created], ["hanako"])
+        self.assertEqual([error["row"] for error in errors], [2, 3])
+
+    def test_existing_rows_returned_in_other_case_are_rejected(self):
+        # MySQL の照合順序では "Taro" の検索で既存の "taro" が返る
+        existing = mock.MagicMock()
+        existing.filter.return_value.values_list.return_value = [("taro", "taro@example.com")]
+        errors = []
+        with mock.patch.object(User, "all_tenants", existing):
+            fresh = services._reject_existing([{"row": 1, **self.row("Taro")}], errors)
+        self.assertEqual((fresh, [error["error"] for error in errors]), ([], ["この username は既に存在します"]))
+
+    def test_conflict_after_check_is_reported_per_row(self):
+        # 確認と INSERT の間に登録された場合の代わりに、確認を素通りさせる
+        with mock.patch.object(services, "_reject_existing", lambda batch, errors: batch):
+            created, errors = services.bulk_register_students([self.row("jiro"), self.row("taro")])
+        self.assertEqual([row["username"] for row in created], ["jiro"])
+        self.assertEqual(errors, [{"row": 2, "username": "taro", "error": "この username は既に存在します"}])
+        self.assertTrue(User.objects.filter(username="jiro").exists())
+
+
+class BulkAccountsActionTests(TestCase):
+    """一括処理は対象をロックして読み直し、重複した id は 1 件として扱うこと"""
+
+    def test_duplicate_ids_are_reported_once(self):
+        student = seed_accounts(students=1)["students"][0]
+        results = bulk_deactivate_students(user_ids=[student, str(student), student])
+        self.assertEqual(results, [{"user_id": str(student), "status": "deactivated"}])
+        self.assertFalse(UserProfile.objects.get(user_id=student).is_active_student)
+
+    def test_targets_are_read_for_update(self):
+        student = seed_accounts(students=1)["students"][0]
+        with mock.patch.object(UserProfile.objects, "select_for_update",
+                               wraps=UserProfile.objects.select_for_update) as select_for_update:
+            bulk_deactivate_students(user_ids=[student])
+        select_for_update.assert_called_once()
+
+
+@override_settings(ACCOUNTS_AUDIT_BACKGROUND=False)
+class TokenRevocationTests(TestCase):
+    """ログアウト・退会したトークンは使えず、判定でクエリが増えないこと"""
+
+    def setUp(self):
+        seeded = seed_accounts(students=2, teachers=1)
+        self.teacher = seeded["teachers"][0]
+        self.student = User.objects.get(pk=seeded["students"][0])
+        # 前のテストで読んだ id はロールバックで採番し直される
+        revocations.reset()
+
+    def test_logout_revokes_access_and_refresh_tokens(self):
+        client = client_for(self.student)
+        access, refresh = client.cookies["access_token"].value, client.cookies["refresh_token"].value
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.post(reverse("logout")).status_code, 200)
+
+        replay = client_for()
+        replay.cookies["access_token"] = access
+        self.assertEqual(replay.get(reverse("me")).status_code, 401)
+        response = client_for().post(reverse("token-refresh"), {"refresh": refresh}, format="json")
+        self.assertEqual(response.status_code, 401)
+
+    def issued_earlier(self, user, seconds=2):
+        # 失効と同じ秒に発行したトークンは残るので、前の秒に発行したものとして作る
+        with mock.patch("rest_framework_simplejwt.tokens.aware_utcnow",
+                        return_value=now() - timedelta(seconds=seconds)):
+            return client_for(user)
+
+    def test_deactivate_revokes_existing_tokens(self):
+        client = self.issued_earlier(self.student)
+        self.assertEqual(client.get(reverse("me")).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            client_for(self.teacher).post(reverse("account-deactivate", args=[self.student.pk]))
+        self.assertEqual(client.get(reverse("me")).status_code, 401)
+
+    def test_user_revocation_compares_whole_seconds(self):
+        revocation_list = RevocationList()
+        revoked_at = int(now().timestamp()) + 0.7
+        revocation_list._apply(None, self.student.pk, revoked_at, revoked_at + 3600)
+
+        token = {"user_id": str(self.student.pk)}
+        self.assertTrue(revocation_list.is_revoked({**token, "iat": int(revoked_at) - 1}))
+        # 同じ秒に発行したトークン（再開直後の再ログイン）は有効
+        self.assertFalse(revocation_list.is_revoked({**token, "iat": int(revoked_at)}))
+
+    @override_settings(ACCOUNTS_AUDIT_BACKGROUND=False)
+    def test_login_right_after_reactivate(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_deactivate_students([self.student.pk])
+            services.bulk_reactivate_students([self.student.pk])
+
+        client = client_for()
+        response = client.post(reverse("login"), {"username": self.student.username, "password": BENCH_PASSWORD},
+                               format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(client.get(reverse("me")).status_code, 200)
+
+    def test_rolled_back_revocation_is_not_applied(self):
+        revocation_list = RevocationList()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            revocation_list.revoke_users(self.student.pk)
+            raise RuntimeError
+        self.assertFalse(revocation_list.is_revoked({"user_id": str(self.student.pk), "iat": 0}))
+
+    def test_late_commit_with_lower_id_is_read_on_next_sync(self):
+        revocation_list = RevocationList()
+        revocation_list.sync()
+        # 先に採番されたが後からコミットされる行（時計が遅れたプロセスの revoked_at も付けておく）
+        late = TokenRevocation.objects.create(user_id=self.student.pk, revoked_at=now() - timedelta(hours=1),
+                                              expires_at=now() + timedelta(days=1))
+        TokenRevocation.objects.create(user_id=uuid.uuid4(), revoked_at=now(), expires_at=now() + timedelta(days=1))
+        late_row = model_to_dict(late)
+        late.delete()
+
+        revocation_list.sync()
+        token = {"user_id": str(self.student.pk), "iat": (now() - timedelta(hours=2)).timestamp()}
+        self.assertFalse(revocation_list.is_revoked(token))
+        self.assertEqual(revocation_list.stats()["gaps"], 1)
+
+        TokenRevocation.objects.create(**late_row)
+        revocation_list.sync()
+        self.assertTrue(revocation_list.is_revoked(token))
+        self.assertEqual(revocation_list.stats()["gaps"], 0)
+
+    def test_revocations_from_other_processes_arrive_on_sync(self):
+        client = self.issued_earlier(self.student)
+        revocations.sync()
+        # 別プロセスでの退会の代わりに直接記録する
+        TokenRevocation.objects.create(user_id=self.student.pk, revoked_at=now(),
+                                       expires_at=now() + timedelta(days=1))
+
+        with override_settings(ACCOUNTS_REVOCATION_SYNC_INTERVAL=3600):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(client.get(reverse("me")).status_code, 200)
+            self.assertFalse(any("revocation" in q["sql"].lower() for q in ctx.captured_queries))
+
+        with override_settings(ACCOUNTS_REVOCATION_SYNC_INTERVAL=0):
+            self.assertEqual(client.get(reverse("me")).status_code, 401)
+
+
+class LoginRushTests(TestCase):
+    """負荷シミュレーターが途中の例外を数え、--seed を繰り返しても落ちないこと"""
+
+    def test_flow_exceptions_are_reported(self):
+        def broken_flow(*args):
+            raise RuntimeError("boom")
+
+        with mock.patch.object(loadtest, "_student_flow", broken_flow):
+            result = loadtest.run_login_rush("http://127.0.0.1:9/", ["s1", "s2"], [], "x", concurrency=2)
+        self.assertEqual(len(result["failed_flows"]), 2)
+        self.assertIn("failed flows: 2", loadtest.format_report(result))
+
+    def test_request_exceptions_count_against_their_endpoint(self):
+        with mock.patch.object(loadtest.Session, "request", side_effect=ValueError("bad response")):
+            result = loadtest.run_login_rush("http://127.0.0.1:9/", ["s1", "s2"], [], "x", concurrency=2)
+        self.assertEqual(len(result["failed_flows"]), 2)
+        self.assertEqual(list(result["endpoints"]), ["csrf"])
+        self.assertEqual((result["endpoints"]["csrf"]["requests"], result["endpoints"]["csrf"]["error_rate"]), (2, 1.0))
+
+    def test_seed_is_idempotent(self):
+        options = {"students": 3, "teachers": 1, "password": BENCH_PASSWORD, "prefix": "rush"}
+        command = login_rush.Command(stdout=io.StringIO())
+        command.seed(options)
+        command.seed(options)
+        self.assertEqual(User.all_tenants.filter(username__startswith="rush_").count(), 5)
+
+        with self.assertRaises(CommandError):
+            command.seed({**options, "students": 10})
+
+
+class AccountsListPaginationTests(TestCase):
+    """名簿一覧のカーソルページングが username 順で重複・抜けなく進み、絞り込みが効くこと"""
+
+    def setUp(self):
+        seeded = seed_accounts(students=25, teachers=2)
+        self.teacher = client_for(seeded["teachers"][0])
+        self.klass = ClassMaster.objects.create(name="2-A")
+        self.students = list(User.objects.filter(pk__in=seeded["students"]).order_by("username"))
+        UserProfile.objects.filter(user__in=self.students[:10]).update(class_ref=self.klass)
+        UserProfile.objects.filter(user__in=self.students[5:9]).update(is_active_student=False)
+
+    def walk(self, **params):
+        pages = []
+        response = self.teacher.get("/api/account/list/", params)
+        while True:
+            self.assertEqual(response.status_code, 200, response.content)
+            body = response.json()
+            pages.append([row["username"] for row in body["results"]])
+            if not body["next"]:
+                return pages
+            response = self.teacher.get(body["next"])
+
+    def test_pages_are_ordered_without_duplicates_or_gaps(self):
+        pages = self.walk(role="student", limit=10)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        usernames = [username for page in pages for username in page]
+        self.assertEqual(usernames, [student.username for student in self.students])
+
+    def test_rows_added_mid_walk_do_not_shift_pages(self):
+        first = self.teacher.get("/api/account/list/", {"role": "student", "limit": 10}).json()
+        # 読み終えた範囲と、まだ読んでいない範囲にそれぞれ 1 人ずつ追加する
+        register_user(self.students[3].username + "a", "early@example.com", "pass1234")
+        register_user(self.students[15].username + "a", "late@example.com", "pass1234")
+
+        rest = []
+        response = self.teacher.get(first["next"])
+        while True:
+            body = response.json()
+            rest.extend(row["username"] for row in body["results"])
+            if not body["next"]:
+                break
+            response = self.teacher.get(body["next"])
+
+        seen = [row["username"] for row in first["results"]] + rest
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(seen, sorted(seen))
+        self.assertIn(self.students[15].username + "a", rest)
+        self.assertNotIn(self.students[3].username + "a", seen)
+        self.assertTrue({s.username for s in self.students} <= set(seen))
+
+    def test_filters(self):
+        def usernames(**params):
+            return [username for page in self.walk(limit=4, **params) for username in page]
+
+        self.assertEqual(len(usernames(role="teacher")), 2)
+        self.assertEqual(usernames(role="student", class_ref=str(self.klass.pk)),
+                         [s.username for s in self.students[:10]])
+        self.assertEqual(usernames(role="student", class_ref=str(self.klass.pk), is_active_student="false"),
+                         [s.username for s in self.students[5:9]])
+        self.assertEqual(self.teacher.get("/api/account/list/", {"class_ref": "x"}).status_code, 400)
+        self.assertEqual(self.teacher.get("/api/account/list/", {"cursor": "bogus"}).status_code, 404)
+
+
+@override_settings(ACCOUNTS_AUDIT_BACKGROUND=False)
+class AccountDeltaSyncTests(TestCase):
+    """?since= で前回以降に変更・削除されたアカウントだけが返ること"""
+
+    def setUp(self):
+        seeded = seed_accounts(students=20, teachers=1)
+        self.teacher = client_for(seeded["teachers"][0])
+        self.students = User.objects.filter(pk__in=seeded["students"]).order_by("username")
+        # 重ねて返す区間があるとシード直後の全員が含まれてしまう
+        patcher = mock.patch.object(views, "DELTA_OVERLAP", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def list(self, **params):
+        response = self.teacher.get("/api/account/list/", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_delta_returns_only_changed_and_removed_accounts(self):
+        cursor = self.list(role="student", is_active_student="true")["cursor"]
+        renamed, deactivated, deleted = self.students[:3]
+
+        renamed.name = "renamed"
+        renamed.save()
+        self.teacher.post(reverse("account-deactivate", args=[deactivated.pk]))
+        deleted.profile.is_active_student = False
+        deleted.profile.save()
+        self.teacher.delete(f"/api/account/{deleted.pk}/delete/")
+
+        delta = self.list(role="student", is_active_student="true", since=cursor)
+        self.assertFalse(delta["reset"])
+        self.assertEqual([row["name"] for row in delta["results"]], ["renamed"])
+        self.assertEqual(delta["removed"], sorted([str(deactivated.pk), str(deleted.pk)]))
+
+        # 次のカーソル以降は何も変わっていない
+        self.assertEqual(self.list(since=delta["cursor"])["results"], [])
+
+    def test_stale_or_invalid_cursor(self):
+        stale = views.encode_sync_cursor(now() - timedelta(days=30))
+        self.assertTrue(self.list(since=stale)["reset"])
+        self.assertEqual(self.teacher.get("/api/account/list/", {"since": "bogus"}).status_code, 400)
+
+
+class ServerTimingTests(TestCase):
+    """Server-Timing の内訳と、管理者だけのサンプリングプロファイル"""
+
+    def setUp(self):
+        seeded = seed_accounts(students=1, teachers=1)
+        self.admin = seeded["admin"]
+        self.student = User.objects.get(pk=seeded["students"][0])
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        middleware = override_settings(
+            MIDDLEWARE=["accounts.middleware.ServerTimingMiddleware", *settings.MIDDLEWARE],
+            ACCOUNTS_PROFILE_DIR=self.profile_dir,
+        )
+        middleware.enable()
+        self.addCleanup(middleware.disable)
+
+    def test_disabled_by_default(self):
+        response = client_for(self.student).get(reverse("me"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertIsNone(profiling.current_timings())
+
+    @override_settings(ACCOUNTS_SERVER_TIMING=True)
+    def test_header_breaks_down_request(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = client_for(self.student).get(reverse("me"))
+
+        timing = response["Server-Timing"]
+        for phase in ("auth;dur=", "db;dur=", "serialize;dur=", "total;dur="):
+            self.assertIn(phase, timing)
+        # render は DRF の Response（描画が後回しになるもの）だけに付く（ASYNC_VIEWS では JsonResponse）
+        self.assertEqual("render;dur=" in timing, hasattr(response, "render"))
+        self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', timing)
+
+    @override_settings(ACCOUNTS_SERVER_TIMING=True)
+    def test_async_chain_stays_async_and_skips_streaming(self):
+        async def view(request):
+            return HttpResponse("ok")
+
+        middleware = ServerTimingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(AsyncRequestFactory().get("/"))
+        self.assertIn("total;dur=", response["Server-Timing"])
+
+        teacher = User.objects.filter(profile__role="teacher").first()
+        response = client_for(teacher).get(reverse("account-export"))
+        self.assertTrue(response.streaming)
+        self.assertNotIn("Server-Timing", response)
+
+    @override_settings(ACCOUNTS_PROFILE_SAMPLE_RATE=1.0)
+    def test_profiles_only_admin_requests(self):
+        client_for(self.student).get(reverse("me"), HTTP_X_PROFILE="1")
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+        response = client_for(self.admin).get(reverse("me"), HTTP_X_PROFILE="1")
+        self.assertEqual(os.listdir(self.profile_dir), [response["X-Profile-File"]])
+
+
+class AccountExportTests(TestCase):
+    """エクスポートはチャンクごとに読みながら流し、残高・クラスを含むこと"""
+
+    def setUp(self):
+        seeded = seed_accounts(students=25, teachers=1)
+        self.teacher = client_for(seeded["teachers"][0])
+        patcher = mock.patch.object(export, "EXPORT_CHUNK_SIZE", 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_csv_streams_every_account_in_chunks(self):
+        response = self.teacher.get(reverse("account-export"))
+        self.assertTrue(response.streaming)
+
+        # ヘッダを返した時点ではまだ名簿を読んでいない
+        with CaptureQueriesContext(connection) as ctx:
+            body = b"".join(response.streaming_content).decode("utf-8-sig")
+        self.assertEqual(len(ctx.captured_queries), 3)  # 27 件 / 10 件ずつ
+
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual(len(rows), User.objects.count())
+        balances = dict(PointManager.objects.values_list("user_id", "point_balance"))
+        for row in rows:
+            self.assertEqual(int(row["point_balance"]), balances[uuid.UUID(row["id"])])
+
+    def test_jsonl_applies_list_filters(self):
+        response = self.teacher.get(reverse("account-export"), {"output": "jsonl", "role": "student"})
+        records = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(len(records), 25)
+        self.assertEqual({record["role"] for record in records}, {"student"})
+
+        self.assertEqual(self.teacher.get(reverse("account-export"), {"output": "xml"}).status_code, 400)
+
+    def test_asgi_streams_without_buffering(self):
+        factory = AsyncRequestFactory()
+        factory.cookies["access_token"] = self.teacher.cookies["access_token"].value
+        response = views.AccountExportView.as_view()(factory.get("/", {"output": "jsonl"}))
+        self.assertTrue(response.is_async)
+
+        async def first_chunk():
+            return await anext(aiter(response.streaming_content))
+
+        with mock.patch.object(export, "ASYNC_STREAM_LINES", 5), CaptureQueriesContext(connection) as ctx:
+            chunk = async_to_sync(first_chunk)()
+        self.assertEqual(len(ctx.captured_queries), 1)  # 最初のチャンク分だけ読む
+        self.assertTrue(chunk.startswith(b"{"))
+
+    def test_csv_neutralises_formula_cells(self):
+        student = User.objects.filter(profile__role="student").first()
+        student.name = '=HYPERLINK("http://example.com","x")'
+        student.save()
+
+        body = b"".join(self.teacher.get(reverse("account-export")).streaming_content).decode("utf-8-sig")
+        row = next(row for row in csv.DictReader(io.StringIO(body)) if row["id"] == str(student.pk))
+        self.assertEqual(row["name"], "'" + student.name)
+        self.assertEqual(export.csv_cell("-5"), "'-5")
+        self.assertEqual(export.csv_cell(-5), -5)
+
+
+class TenantScopingTests(TestCase):
+    """教師のリクエストは自テナントの名簿・削除ログだけを見ること"""
+
+    def setUp(self):
+        self.tenants = [Tenant.objects.create(name=name) for name in ("east", "west")]
+        self.seeded = [
+            seed_accounts(students=3, teachers=1, deleted_logs=2, prefix=tenant.name, tenant=tenant)
+            for tenant in self.tenants
+        ]
+        self.teacher = client_for(self.seeded[0]["teachers"][0])
+
+    def test_list_and_detail_are_limited_to_own_tenant(self):
+        response = self.teacher.get("/api/account/list/")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual({row["username"].split("_")[0] for row in response.json()["results"]}, {"east"})
+
+        own, other = self.seeded[0]["students"][0], self.seeded[1]["students"][0]
+        self.assertEqual(self.teacher.get(f"/api/account/{own}/detail/").status_code, 200)
+        self.assertEqual(self.teacher.get(f"/api/account/{other}/detail/").status_code, 404)
+        self.assertEqual(self.teacher.post(reverse("account-deactivate", args=[other])).status_code, 404)
+        self.assertTrue(UserProfile.objects.get(user_id=other).is_active_student)
+
+        # リクエストの後にテナントは残らない
+        self.assertFalse(is_scoped())
+
+    @override_settings(ACCOUNTS_AUDIT_BACKGROUND=False)
+    def test_login_with_stale_cookie_from_another_tenant(self):
+        # 同じブラウザに east の教師の Cookie が残ったまま、west の教師がログインする
+        west_teacher = self.seeded[1]["teachers"][0]
+        response = self.teacher.post(
+            reverse("login"), {"username": west_teacher.username, "password": BENCH_PASSWORD}, format="json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            client_for(west_teacher).get(reverse("me")).json()["username"], west_teacher.username,
+        )
+
+    def test_admin_sees_every_tenant(self):
+        response = client_for(self.seeded[0]["admin"]).get("/api/account/list/", {"role": "student"})
+        self.assertEqual(len(response.json()["results"]), 6)
+
+    def test_deleted_logs_are_scoped_and_require_teacher(self):
+        response = self.teacher.get(reverse("deleted-logs"))
+        self.assertEqual({row["username"].split("_")[0] for row in response.json()["results"]}, {"east"})
+
+        records = [
+            json.loads(line) for line in
+            b"".join(self.teacher.get("/api/account/deleted/logs/export/").streaming_content).splitlines()
+        ]
+        self.assertEqual(len(records), 2)
+        self.assertEqual({record["tenant_id"] for record in records}, {self.tenants[0].pk})
+
+        student = User.objects.get(pk=self.seeded[0]["students"][0])
+        self.assertEqual(client_for(student).get(reverse("deleted-logs")).status_code, 403)
+
+    def test_registered_students_join_the_teachers_tenant(self):
+        response = self.teacher.post("/api/register/bulk/", [
+            {"username": "east_new", "email": "east_new@example.com", "password": "pass1234"},
+        ], format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+
+        profile = UserProfile.all_tenants.select_related("user").get(user__username="east_new")
+        self.assertEqual((profile.user.tenant_id, profile.tenant_id), (self.tenants[0].pk, self.tenants[0].pk))
+
+        # 一意性は全テナントで確かめる
+        response = self.teacher.post("/api/register/bulk/", [
+            {"username": "west_student_000000", "email": "x@example.com", "password": "pass1234"},
+        ], format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_scoped_queries_lead_with_tenant(self):
+        with tenant_scope(self.tenants[1].pk):
+            self.assertEqual(User.objects.count(), 4)
+            with CaptureQueriesContext(connection) as ctx:
+                list(UserProfile.objects.filter(role="student", is_active_student=True))
+        self.assertIn('"tenant_id" =', ctx.captured_queries[0]["sql"])
+        self.assertEqual(User.objects.count(), 10)
+
+    def test_user_without_tenant_sees_only_unassigned_rows(self):
+        legacy = seed_accounts(students=2, teachers=1, prefix="legacy")
+        response = client_for(legacy["teachers"][0]).get("/api/account/list/", {"role": "student"})
+        self.assertEqual({row["username"].split("_")[0] for row in response.json()["results"]}, {"legacy"})
+
+    @override_settings(ACCOUNTS_AUDIT_BACKGROUND=False)
+    def test_audit_events_are_scoped(self):
+        log = audit.AuditLog()
+        patcher = mock.patch.object(audit, "audit_log", log)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for seeded in self.seeded:
+            student = seeded["students"][0]
+            client_for(seeded["admin"]).post(reverse("account-deactivate", args=[student]))
+        log.flush()
+
+        response = self.teacher.get(reverse("audit-events"), {"action": "deactivate"})
+        self.assertEqual([event["target_id"] for event in response.json()["results"]],
+                         [str(self.seeded[0]["students"][0])])
+
+    def test_class_totals_count_only_own_tenant(self):
+        shared = ClassMaster.objects.create()
+        UserProfile.all_tenants.filter(user_id__in=[s["students"][0] for s in self.seeded]).update(class_ref=shared)
+        PointManager.objects.filter(user_id=self.seeded[1]["students"][0]).update(point_balance=1000)
+
+        response = self.teacher.get("/api/account/classes/roster/", {"class_ref": shared.pk})
+        east = response.json()["classes"][0]
+        self.assertEqual(east["active_count"], 1)
+        self.assertEqual(len(east["students"]), 1)
+        own_balance = PointManager.objects.get(user_id=self.seeded[0]["students"][0]).point_balance
+        self.assertEqual(east["total_points"], own_balance)
+
+        admin = client_for(self.seeded[0]["admin"]).get("/api/account/classes/roster/", {"class_ref": shared.pk})
+        self.assertEqual(admin.json()["classes"][0]["active_count"], 2)
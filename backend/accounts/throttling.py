@@ -0,0 +1,150 @@
+"""
+ログイン・登録のレート制限（トークンバケット）。
+DRF の throttle としてビューの initial() で判定するので、超過したリクエストは
+authenticate()（パスワードハッシュの計算）より前に 429 で返る。
+
+クライアント IP（REST_FRAMEWORK["NUM_PROXIES"] に従う）と username の両方で数える。
+バケットの保存先は ACCOUNTS_THROTTLE_BACKEND で切り替える:
+    "accounts.throttling.LocalBucketBackend"  プロセス内（既定）
+    "accounts.throttling.CacheBucketBackend"  Django のキャッシュ（Redis などを使えばワーカー間で共有）
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+THROTTLE_BACKEND = getattr(settings, "ACCOUNTS_THROTTLE_BACKEND", "accounts.throttling.LocalBucketBackend")
+THROTTLE_CACHE_ALIAS = getattr(settings, "ACCOUNTS_THROTTLE_CACHE", "default")
+# 学校の NAT の内側から一斉にログインしても止まらない程度に IP 側は緩くする
+DEFAULT_RATES = {
+    "login_ip": "200/min",
+    "login_username": "10/min",
+    "register_ip": "100/hour",
+    "register_username": "10/hour",
+}
+PERIODS = {"s": 1, "sec": 1, "m": 60, "min": 60, "h": 3600, "hour": 3600, "d": 86400, "day": 86400}
+
+
+def client_ident(request):
+    """
+    クライアントの識別子。REST_FRAMEWORK["NUM_PROXIES"]（信頼するプロキシの段数）が未設定なら
+    X-Forwarded-For はクライアントが自由に書けるので使わず REMOTE_ADDR を返す。
+    """
+    if api_settings.NUM_PROXIES is None:
+        return request.META.get("REMOTE_ADDR")
+    return BaseThrottle().get_ident(request)
+
+
+def parse_rate(rate):
+    """"10/min" → (容量 10, 1 秒あたりの補充量 10/60)"""
+    count, period = rate.split("/")
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period]
+
+
+def _take(state, capacity, refill, now):
+    """(tokens, updated_at) から 1 つ取り出し、(allowed, 待ち秒数, 新しい状態) を返す"""
+    tokens, updated_at = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + (now - updated_at) * refill)
+    if tokens >= 1:
+        return True, 0, (tokens - 1, now)
+    return False, (1 - tokens) / refill, (tokens, now)
+
+
+class LocalBucketBackend:
+    """プロセス内の LRU つきバケット（ワーカーごとに独立して数える）"""
+
+    def __init__(self, maxsize=getattr(settings, "ACCOUNTS_THROTTLE_MAX_KEYS", 100000)):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill):
+        with self._lock:
+            allowed, wait, state = _take(self._buckets.get(key), capacity, refill, time.monotonic())
+            self._buckets[key] = state
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketBackend:
+    """
+    Django のキャッシュに (tokens, updated_at) を置く。
+    get → set の間に他のワーカーが更新すると 1 回分ずれることがあるが、制限の目安としては十分。
+    """
+
+    def __init__(self, alias=THROTTLE_CACHE_ALIAS):
+        self.cache = caches[alias]
+        self.generation = 0
+
+    def take(self, key, capacity, refill):
+        key = f"accounts:throttle:{self.generation}:{key}"
+        allowed, wait, state = _take(self.cache.get(key), capacity, refill, time.time())
+        # 満タンに戻るまでの時間だけ保持する
+        self.cache.set(key, state, int((capacity - state[0]) / refill) + 1)
+        return allowed, wait
+
+    def clear(self):
+        # キャッシュ全体は消さずにキーを切り替える（古いキーは TTL で消える。他のワーカーには効かない）
+        self.generation += 1
+
+
+backend = import_string(THROTTLE_BACKEND)()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """scope_prefix + "_ip" / "_username" のレートで、IP と username の両方のバケットから 1 つずつ取る"""
+    scope_prefix = None
+
+    def __init__(self, bucket_backend=None):
+        self.backend = bucket_backend or backend
+
+    def get_rate(self, kind):
+        rates = {**DEFAULT_RATES, **getattr(settings, "ACCOUNTS_THROTTLE_RATES", {})}
+        return rates.get(f"{self.scope_prefix}_{kind}")
+
+    def get_ident(self, request):
+        # DRF の既定では X-Forwarded-For を付け替えるたびに新しい IP のバケットになる
+        return client_ident(request)
+
+    def get_username(self, request):
+        username = request.data.get("username") if hasattr(request.data, "get") else None
+        return username.strip().lower() if isinstance(username, str) and username.strip() else None
+
+    def allow_request(self, request, view):
+        if not getattr(settings, "ACCOUNTS_THROTTLE_ENABLED", True):
+            return True
+
+        self.wait_seconds = 0
+        keys = [("ip", self.get_ident(request)), ("username", self.get_username(request))]
+        for kind, ident in keys:
+            rate = self.get_rate(kind)
+            if ident is None or rate is None:
+                continue
+            allowed, wait = self.backend.take(f"{self.scope_prefix}:{kind}:{ident}", *parse_rate(rate))
+            if not allowed:
+                self.wait_seconds = wait
+                return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class LoginThrottle(TokenBucketThrottle):
+    scope_prefix = "login"
+
+
+class RegisterThrottle(TokenBucketThrottle):
+    scope_prefix = "register"
@@ -1,42 +1,75 @@
+from django.conf import settings
 from django.urls import path
-from rest_framework_simplejwt.views import TokenRefreshView
 from .views import (LoginView,
                     LogoutView,
+                    TokenRefreshView,
                     MeView,
                     SignupView,
                     ClearTokenView,
                     CSRFCookieView,
+                    BootstrapView,
                     UserProfileMeView,
                     RegisterStudentByTeacherView,
                     RegisterView,
+                    BulkRegisterStudentsView,
                     AccountsListView,
                     AccountDetailView,
+                    AccountExportView,
                     DeactivateAccountsView,
                     ReactivateAccountsView,
                     DeleteAccountsView,
-                    DeletedAccountListView
+                    DeletedAccountListView,
+                    DeletedAccountExportView,
+                    BulkDeactivateAccountsView,
+                    BulkReactivateAccountsView,
+                    BulkDeleteAccountsView,
+                    AccountsMetricsView,
+                    AuditEventListView,
+                    ClassRosterView,
                     
                     
                     )
 
+if getattr(settings, "ACCOUNTS_ASYNC_READ_VIEWS", False):
+    # ASGI で動かすときは読み取り系を非同期版に差し替える（パスは同じ）
+    from .async_views import AsyncAccountDetailView as AccountDetailView
+    from .async_views import AsyncAccountsListView as AccountsListView
+    from .async_views import AsyncMeView as MeView
+    from .async_views import AsyncUserProfileMeView as UserProfileMeView
+
 urlpatterns = [
     path('signup/', SignupView.as_view(), name='signup'),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
-    path('token/refresh/', TokenRefreshView.as_view()),
+    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
     path('clear-tokens/', ClearTokenView.as_view(), name='clear-tokens'),
     path('csrf/', CSRFCookieView.as_view(), name='csrf'),
     path('me/', MeView.as_view(), name='me'),
+    path('bootstrap/', BootstrapView.as_view(), name='bootstrap'),
     path("profile/me/", UserProfileMeView.as_view()),
     # path("register/", RegisterStudentByTeacherView.as_view()),
     path("register/", RegisterView.as_view()),
+    path("register/bulk/", BulkRegisterStudentsView.as_view()),
     path("account/list/",AccountsListView.as_view()),
+    path("account/export/", AccountExportView.as_view(), name="account-export"),
     path("account/<uuid:user_id>/detail/",AccountDetailView.as_view()),
-    path("account/<uuid:user_id>/deactivate/", DeactivateAccountsView.as_view()),
+    path("account/<uuid:user_id>/deactivate/", DeactivateAccountsView.as_view(), name="account-deactivate"),
     path("account/<uuid:user_id>/reactivate/", ReactivateAccountsView.as_view()),
     path("account/<uuid:user_id>/delete/", DeleteAccountsView.as_view()),
-    path("account/deleted/logs/", DeletedAccountListView.as_view()),
+    path("account/deleted/logs/", DeletedAccountListView.as_view(), name="deleted-logs"),
+    path("account/deleted/logs/export/", DeletedAccountExportView.as_view()),
+    path("account/bulk/deactivate/", BulkDeactivateAccountsView.as_view()),
+    path("account/bulk/reactivate/", BulkReactivateAccountsView.as_view()),
+    path("account/bulk/delete/", BulkDeleteAccountsView.as_view()),
+    path("account/classes/roster/", ClassRosterView.as_view()),
+    path("metrics/", AccountsMetricsView.as_view()),
+    path("audit/", AuditEventListView.as_view(), name="audit-events"),
+
 
 
+]
 
-]
\ No newline at end of file
+if getattr(settings, "ACCOUNTS_ASYNC_READ_VIEWS", False):
+    # 接続を保持し続けるので ASGI のときだけ公開する
+    from .async_views import MeStreamView
+    urlpatterns.append(path("me/stream/", MeStreamView.as_view(), name="me-stream"))
@@ -1,17 +1,57 @@
+import base64
+import binascii
+import csv
+import io
+import json
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
 from django.shortcuts import render
 from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.models import AnonymousUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework_simplejwt.exceptions import TokenError
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenRefreshView as BaseTokenRefreshView
 from rest_framework import generics
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.parsers import JSONParser, MultiPartParser
 from django.middleware.csrf import get_token
 from django.http import JsonResponse
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.utils.decorators import method_decorator
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
+from django.utils.timezone import now
 
-from .serializers import SignupSerializer, UserSerializer
+from .serializers import RevocableTokenRefreshSerializer, SignupSerializer
 from .models import User, UserProfile, DeletedUserLog
+from . import audit
+from .archive import iter_deleted_logs
+from .export import iter_accounts, iter_csv, iter_jsonl, streaming_response
+from .cache import auth_user_cache, get_class_totals, get_me_snapshot, with_point_balance
+from .events import broker
+from .hashing import password_executor
+from .images import image_pipeline, image_url, is_image, profile_image_urls, store_upload, variant_urls
+from .pagination import AuditEventCursorPagination, DeletedLogCursorPagination, UsernameCursorPagination
+from .renderers import FastJSONMixin
+from .revocation import revocations
+from .routers import ReplicaReadMixin
+from .tenancy import current_tenant, is_scoped
+from .throttling import LoginThrottle, RegisterThrottle
+from .services import (
+    RegistrationError,
+    register_user,
+    bulk_register_students,
+    bulk_deactivate_students,
+    bulk_reactivate_students,
+    bulk_delete_students,
+)
 from points.permissions import IsTeacherOrAdmin
 
 User = get_user_model()
@@ -21,6 +61,8 @@ User = get_user_model()
 # =======================================
 class LoginView(APIView):
     permission_classes = [AllowAny]
+    # 超過分は initial() で 429 を返すので authenticate()（ハッシュ計算）まで届かない
+    throttle_classes = [LoginThrottle]
 
     def post(self, request):
 
@@ -30,13 +72,17 @@ class LoginView(APIView):
         user = authenticate(request, username=username, password=password)
 
         if user is None:
+            audit.record("login_failure", request=request, username=username)
             return Response({"error": "Invalid credentials"}, status=401)
 
         # ❗退会済みはログイン禁止
         if hasattr(user, "profile") and user.profile.role == "student":
             if not user.profile.is_active_student:
+                audit.record("login_failure", target_id=user.pk, request=request, tenant_id=user.tenant_id,
+                             reason="inactive")
                 return Response({"error": "退会済みの生徒です"}, status=403)
 
+        audit.record("login_success", actor_id=user.pk, target_id=user.pk, request=request, tenant_id=user.tenant_id)
         refresh = RefreshToken.for_user(user)
 
         response = Response({"message": "Login successful"})
@@ -45,6 +91,10 @@ class LoginView(APIView):
 
         return response
     
+class TokenRefreshView(BaseTokenRefreshView):
+    serializer_class = RevocableTokenRefreshSerializer
+
+
 class ClearTokenView(APIView):
     authentication_classes = []  # 認証スキップ
     permission_classes = [AllowAny]
@@ -68,6 +118,14 @@ class ClearTokenView(APIView):
 # =======================================
 class LogoutView(APIView):
     def post(self, request):
+        # Cookie を消すだけでは控えられたトークンが期限まで使えるので、access / refresh とも失効させる
+        try:
+            refresh = RefreshToken(request.COOKIES["refresh_token"])
+        except (KeyError, TokenError):
+            refresh = None
+        revocations.revoke_tokens(request.auth, refresh)
+
+        audit.record("logout", actor_id=request.user.pk, target_id=request.user.pk, request=request)
         response = Response({"message": "Logged out"}, status=200)
         response.delete_cookie("access_token")
         response.delete_cookie("refresh_token")
@@ -77,12 +135,23 @@ class LogoutView(APIView):
 # =======================================
 # Me
 # =======================================
-class MeView(APIView):
+class MeView(ReplicaReadMixin, FastJSONMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        serializer = UserSerializer(request.user, context={"request": request})
-        return Response(serializer.data)
+        snapshot = get_me_snapshot(request)
+        etag = snapshot["etag"]
+
+        # If-None-Match が一致すれば本文なしの 304（API クライアント向け。フロントは /bootstrap/ から読むので使わない）
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+        if etag in if_none_match or "*" in if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(snapshot["data"])
+
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
 
 
 # =======================================
@@ -90,8 +159,13 @@ class MeView(APIView):
 # =======================================
 class SignupView(generics.CreateAPIView):
     permission_classes = [AllowAny]
+    throttle_classes = [RegisterThrottle]
     serializer_class = SignupSerializer
 
+    def perform_create(self, serializer):
+        user = serializer.save()
+        audit.record("register", target_id=user.pk, request=self.request, via="signup")
+
 
 
 # =======================================
@@ -105,6 +179,41 @@ class CSRFCookieView(APIView):
         return Response({"detail": "CSRF cookie set"})
 
 
+# =======================================
+# Bootstrap（config → csrf → me を 1 往復にまとめる）
+# =======================================
+def client_config(request):
+    return {
+        "event_stream": getattr(settings, "ACCOUNTS_ASYNC_READ_VIEWS", False),
+        "csrf_header_name": "X-CSRFToken",
+        "media_url": request.build_absolute_uri(settings.MEDIA_URL),
+        **getattr(settings, "ACCOUNTS_CLIENT_CONFIG", {}),
+    }
+
+
+@method_decorator(ensure_csrf_cookie, name='dispatch')
+class BootstrapView(FastJSONMixin, APIView):
+    permission_classes = [AllowAny]
+
+    def perform_authentication(self, request):
+        try:
+            request.user
+        except AuthenticationFailed:
+            # 期限切れ・無効な Cookie は匿名として返す（フロントはログイン画面へ）
+            request.user, request.auth = AnonymousUser(), None
+
+    def get(self, request):
+        authenticated = request.user.is_authenticated
+        response = Response({
+            "authenticated": authenticated,
+            "user": get_me_snapshot(request)["data"] if authenticated else None,
+            "csrf_token": get_token(request),
+            "config": client_config(request),
+        })
+        response["Cache-Control"] = "private, no-store"
+        return response
+
+
 # =======================================
 # User Profile Me
 # =======================================
@@ -118,12 +227,17 @@ class UserProfileMeView(APIView):
         return Response({
             "name": user.name or user.username,
             "comment": profile.comment,
-            "image": profile.image.url if profile.image else None,
+            "image": image_url(profile.image),
+            **profile_image_urls(profile),
         })
 
     def patch(self, request):
         user = request.user
         profile = user.profile
+        upload = request.FILES.get("image")
+
+        if upload is not None and not is_image(upload):
+            return Response({"error": "画像ファイルを指定してください"}, status=400)
 
         if "name" in request.data:
             user.name = request.data["name"]
@@ -132,11 +246,21 @@ class UserProfileMeView(APIView):
         if "comment" in request.data:
             profile.comment = request.data["comment"]
 
-        if "image" in request.FILES:
-            profile.image = request.FILES["image"]
+        if upload is not None:
+            # 元画像はそのまま保存し、縮小版はバックグラウンドで作る
+            profile.image = store_upload(upload)
+            profile.image_thumb = ""
+            profile.image_medium = ""
 
         profile.save()
 
+        audit.record("profile_update", actor_id=user.pk, target_id=user.pk, request=request,
+                     fields=sorted(key for key in ("name", "comment", "image") if key in request.data))
+
+        if upload is not None:
+            source_name = profile.image.name
+            transaction.on_commit(lambda: image_pipeline.submit(profile.pk, user.pk, source_name))
+
         return Response({"message": "Profile updated"})
 
 
@@ -145,6 +269,7 @@ class UserProfileMeView(APIView):
 # =======================================
 class RegisterView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [RegisterThrottle]
 
     def post(self, request):
         username = request.data.get("username")
@@ -153,23 +278,23 @@ class RegisterView(APIView):
         name = request.data.get("name")
         role = request.data.get("role", "student")
 
-        # --- 🔥 追加：username & email の重複チェック ---
-        if User.objects.filter(username=username).exists():
-            return Response({"error": "ユーザー名は既に使われています"}, status=400)
+        if not username or not email or not password:
+            return Response({"error": "username, email, password は必須です"}, status=400)
 
-        if User.objects.filter(email=email).exists():
+        try:
+            user = register_user(
+                username=username,
+                email=email,
+                password=password,
+                name=name,
+                role=role,
+            )
+        except RegistrationError as exc:
+            if exc.field == "username":
+                return Response({"error": "ユーザー名は既に使われています"}, status=400)
             return Response({"error": "このメールアドレスは既に登録されています"}, status=400)
 
-        user = User.objects.create_user(
-            username=username,
-            email=email,
-            password=password,
-            name=name,
-        )
-
-        profile = user.profile
-        profile.role = role
-        profile.save()
+        audit.record("register", target_id=user.pk, request=request, via="register", role=role)
 
         return Response({"message": "登録完了", "role": role}, status=201)
 
@@ -190,28 +315,69 @@ class RegisterStudentByTeacherView(APIView):
         if not username or not email or not password:
             return Response({"error": "username, email, password は必須です"}, status=400)
 
-        if User.objects.filter(username=username).exists():
-            return Response({"error": "この username は既に存在します"}, status=400)
-        if User.objects.filter(email=email).exists():
+        try:
+            user = register_user(
+                username=username,
+                email=email,
+                password=password,
+                name=name,
+                role="student",
+                tenant_id=request.user.tenant_id,
+            )
+        except RegistrationError as exc:
+            if exc.field == "username":
+                return Response({"error": "この username は既に存在します"}, status=400)
             return Response({"error": "この email は既に登録済みです"}, status=400)
 
-        user = User.objects.create_user(
-            username=username,
-            email=email,
-            password=password,
-            name=name,
-        )
-
-        profile = user.profile
-        profile.role = "student"
-        profile.save()
-
+        audit.record("register", actor_id=request.user.pk, target_id=user.pk, request=request, via="teacher")
         return Response({
             "message": "生徒アカウントを作成しました",
             "user_id": str(user.id),
         }, status=201)
 
 
+# =======================================
+# Teacher/Admin → Student Bulk Registration（CSV / JSON）
+# =======================================
+class BulkRegisterStudentsView(APIView):
+    permission_classes = [IsAuthenticated, IsTeacherOrAdmin]
+    parser_classes = [JSONParser, MultiPartParser]
+
+    max_rows = getattr(settings, "ACCOUNTS_BULK_MAX_ROWS", 5000)
+
+    def get_rows(self, request):
+        upload = request.FILES.get("file")
+        if upload is not None:
+            return list(csv.DictReader(io.TextIOWrapper(upload, encoding="utf-8-sig")))
+
+        if isinstance(request.data, list):
+            return request.data
+        return request.data.get("students") or []
+
+    def post(self, request):
+        try:
+            rows = self.get_rows(request)
+        except (UnicodeDecodeError, csv.Error):
+            return Response({"error": "CSV を読み込めません"}, status=400)
+
+        if not rows:
+            return Response({"error": "登録する生徒がありません"}, status=400)
+        if len(rows) > self.max_rows:
+            return Response({"error": f"一度に登録できるのは {self.max_rows} 件までです"}, status=400)
+        if not all(isinstance(row, dict) for row in rows):
+            return Response({"error": "各行はオブジェクトで指定してください"}, status=400)
+
+        created, errors = bulk_register_students(rows, tenant_id=request.user.tenant_id)
+        for row in created:
+            audit.record("register", actor_id=request.user.pk, target_id=row["user_id"], request=request, via="bulk")
+
+        return Response({
+            "message": f"{len(created)} 件の生徒アカウントを作成しました",
+            "created": created,
+            "errors": errors,
+        }, status=201 if created else 400)
+
+
 # =======================================
 # 退会（deactivate）
 # =======================================
@@ -232,6 +398,9 @@ class DeactivateAccountsView(APIView):
 
         target.profile.is_active_student = False
         target.profile.save()
+        revocations.revoke_users(target.pk)
+        audit.record("deactivate", actor_id=request.user.pk, target_id=target.pk, request=request,
+                     tenant_id=target.tenant_id)
 
         return Response({"message": "退会処理が完了しました"}, status=200)
 
@@ -253,6 +422,8 @@ class ReactivateAccountsView(APIView):
 
         target.profile.is_active_student = True
         target.profile.save()
+        audit.record("reactivate", actor_id=request.user.pk, target_id=target.pk, request=request,
+                     tenant_id=target.tenant_id)
 
         return Response({"message": "在籍状態を再開しました"}, status=200)
 
@@ -282,85 +453,426 @@ class DeleteAccountsView(APIView):
             username=target.username,
             email=target.email,
             name=target.name,
-            deleted_by=request.user
+            deleted_by=request.user,
+            tenant_id=target.tenant_id,
         )
 
         # Profile → User を削除
         target.profile.delete()
         target.delete()
+        revocations.revoke_users(user_id)
+        audit.record("delete", actor_id=request.user.pk, target_id=user_id, request=request, tenant_id=target.tenant_id)
 
         return Response({"message": "完全削除しました"}, status=200)
 
-class DeletedAccountListView(APIView):
-    permission_classes = [IsAuthenticated]
+# =======================================
+# 一括 退会 / 再開 / 削除
+# body: {"user_ids": [...]} または {"class_ref": 1}
+# =======================================
+class BulkAccountsActionView(APIView):
+    permission_classes = [IsAuthenticated, IsTeacherOrAdmin]
+
+    max_rows = getattr(settings, "ACCOUNTS_BULK_MAX_ROWS", 5000)
+
+    def get_targets(self, request):
+        class_ref = request.data.get("class_ref")
+        if class_ref not in (None, ""):
+            if not str(class_ref).isdigit():
+                raise ValidationError({"class_ref": "数値で指定してください"})
+            return {"class_ref": int(class_ref)}
+
+        user_ids = request.data.get("user_ids")
+        if not isinstance(user_ids, list) or not user_ids:
+            raise ValidationError({"error": "user_ids または class_ref を指定してください"})
+        if len(user_ids) > self.max_rows:
+            raise ValidationError({"error": f"一度に処理できるのは {self.max_rows} 件までです"})
+
+        try:
+            return {"user_ids": [uuid.UUID(str(user_id)) for user_id in user_ids]}
+        except ValueError:
+            raise ValidationError({"user_ids": "不正な user_id が含まれています"})
+
+    # 状態が変わった対象だけ監査ログに残す
+    audit_action = None
+    audit_status = None
+
+    def target_tenants(self, user_ids):
+        return dict(User.all_tenants.filter(id__in=user_ids).values_list("id", "tenant_id"))
+
+    def respond(self, results):
+        done = [result["user_id"] for result in results if result["status"] == self.audit_status]
+        # 管理者の操作は対象の生徒のテナントで記録する（教師の操作はリクエストのテナント）
+        tenants = {} if is_scoped() or not done else {
+            str(user_id): tenant_id for user_id, tenant_id in self.target_tenants(done).items()
+        }
+        for user_id in done:
+            audit.record(self.audit_action, actor_id=self.request.user.pk, target_id=user_id,
+                         request=self.request, tenant_id=tenants.get(user_id), bulk=True)
+        return Response({
+            "results": results,
+            "summary": dict(Counter(r["status"] for r in results)),
+        }, status=200)
+
+
+class BulkDeactivateAccountsView(BulkAccountsActionView):
+    audit_action, audit_status = "deactivate", "deactivated"
+
+    def post(self, request):
+        return self.respond(bulk_deactivate_students(**self.get_targets(request)))
+
+
+class BulkReactivateAccountsView(BulkAccountsActionView):
+    audit_action, audit_status = "reactivate", "reactivated"
+
+    def post(self, request):
+        return self.respond(bulk_reactivate_students(**self.get_targets(request)))
+
+
+class BulkDeleteAccountsView(BulkAccountsActionView):
+    audit_action, audit_status = "delete", "deleted"
+
+    def target_tenants(self, user_ids):
+        return dict(DeletedUserLog.all_tenants.filter(user_id__in=user_ids).values_list("user_id", "tenant_id"))
+
+    def post(self, request):
+        return self.respond(bulk_delete_students(request.user, **self.get_targets(request)))
+
+
+class DeletedAccountListView(ReplicaReadMixin, FastJSONMixin, APIView):
+    permission_classes = [IsAuthenticated, IsTeacherOrAdmin]
+    pagination_class = DeletedLogCursorPagination
 
     def get(self, request):
-        logs = DeletedUserLog.objects.order_by("-deleted_at")
+        paginator = self.pagination_class()
+        # 削除した教師の username も同じ SELECT で JOIN して取る
+        logs = paginator.paginate_queryset(
+            DeletedUserLog.objects.values("user_id", "username", "email", "name", "deleted_at", "deleted_by__username"),
+            request, view=self,
+        )
         data = [
             {
-                "user_id": log.user_id,
-                "username": log.username,
-                "email": log.email,
-                "name": log.name,
-                "deleted_at": log.deleted_at,
-                "deleted_by": log.deleted_by.username if log.deleted_by else None,
+                "user_id": log["user_id"],
+                "username": log["username"],
+                "email": log["email"],
+                "name": log["name"],
+                "deleted_at": log["deleted_at"],
+                "deleted_by": log["deleted_by__username"],
             }
             for log in logs
         ]
 
-        return Response(data)
+        return paginator.get_paginated_response(data)
+
+
+class DeletedAccountExportView(APIView):
+    """アーカイブ済みの分も含めて JSONL で流す（?since= / ?until= は YYYY-MM-DD）"""
+    permission_classes = [IsAuthenticated, IsTeacherOrAdmin]
+
+    def get(self, request):
+        try:
+            since, until = (
+                date.fromisoformat(request.query_params[key]) if request.query_params.get(key) else None
+                for key in ("since", "until")
+            )
+        except ValueError:
+            raise ValidationError({"detail": "since / until は YYYY-MM-DD で指定してください"})
+
+        lines = (
+            json.dumps(record, ensure_ascii=False) + "\n"
+            for record in iter_deleted_logs(since=since, until=until, tenant=current_tenant())
+        )
+        response = streaming_response(request, lines, "application/x-ndjson; charset=utf-8")
+        response["Content-Disposition"] = 'attachment; filename="deleted_accounts.jsonl"'
+        return response
+
+
+# =======================================
+# 監査ログ
+# ?actor= / ?target= / ?action=login_failure,deactivate / ?since= / ?until=（ISO 8601）
+# =======================================
+class AuditEventListView(APIView):
+    permission_classes = [IsAuthenticated, IsTeacherOrAdmin]
+    pagination_class = AuditEventCursorPagination
+
+    def get(self, request):
+        params = request.query_params
+
+        def parse(key, parser):
+            if not params.get(key):
+                return None
+            value = parser(params[key])
+            if value is None:
+                raise ValueError(key)
+            return value
+
+        try:
+            filters = {
+                "actor_id": parse("actor", uuid.UUID),
+                "target_id": parse("target", uuid.UUID),
+                "since": parse("since", parse_datetime),
+                "until": parse("until", parse_datetime),
+            }
+        except ValueError:
+            raise ValidationError({"error": "actor / target は UUID、since / until は ISO 8601 で指定してください"})
+        actions = [action for action in params.get("action", "").split(",") if action]
+
+        paginator = self.pagination_class()
+        events = paginator.paginate_queryset(
+            audit.query_events(actions=actions, **filters)
+            .values("action", "actor_id", "target_id", "ip", "detail", "created_at"),
+            request, view=self,
+        )
+        return paginator.get_paginated_response(list(events))
 
 
 # =======================================
 # アカウント一覧
 # =======================================
-class AccountsListView(APIView):
+def account_list_queryset(params):
+    return filter_accounts(User.objects.order_by("username"), params).values(
+        "id", "username", "name", "profile__is_active_student",
+    )
+
+
+def filter_accounts(users, params):
+    """一覧・エクスポート共通の絞り込み（?role= / ?is_active_student= / ?class_ref=）"""
+    if params.get("role"):
+        users = users.filter(profile__role=params["role"])
+
+    if params.get("is_active_student") in ("true", "false"):
+        users = users.filter(profile__is_active_student=params["is_active_student"] == "true")
+
+    if params.get("class_ref"):
+        if not params["class_ref"].isdigit():
+            raise ValidationError({"class_ref": "数値で指定してください"})
+        users = users.filter(profile__class_ref_id=params["class_ref"])
+
+    return users
+
+
+def account_list_row(u):
+    return {
+        "user": str(u["id"]),
+        "username": u["username"],
+        "name": u["name"],
+        "profile": {
+            "is_active_student": (
+                u["profile__is_active_student"] if u["profile__is_active_student"] is not None else True
+            )
+        }
+    }
+
+
+# ---- 差分同期（?since=<cursor>） ----
+# 一覧の応答に含まれる cursor を次回 since に渡すと、それ以降に変更・削除されたアカウントだけを返す。
+# コミットの遅れやレプリカの遅延で取りこぼさないよう、DELTA_OVERLAP 秒分は重ねて返す（クライアントは上書きするだけ）
+DELTA_OVERLAP = getattr(settings, "ACCOUNTS_DELTA_OVERLAP_SECONDS", 5)
+# これより古いカーソル・多い変更は差分にせず、全件の取り直し（reset）を指示する
+DELTA_MAX_AGE = getattr(settings, "ACCOUNTS_DELTA_MAX_AGE_DAYS", 7)
+DELTA_MAX_ROWS = getattr(settings, "ACCOUNTS_DELTA_MAX_ROWS", 500)
+
+
+def encode_sync_cursor(at):
+    return base64.urlsafe_b64encode(str(int(at.timestamp() * 1_000_000)).encode()).decode()
+
+
+def decode_sync_cursor(value):
+    try:
+        micros = int(base64.urlsafe_b64decode(value.encode()))
+        return datetime.fromtimestamp(micros / 1_000_000, tz=dt_timezone.utc)
+    except (binascii.Error, ValueError, OverflowError, OSError):
+        raise ValidationError({"since": "不正なカーソルです"})
+
+
+def account_delta_querysets(since):
+    """since 以降に変更された user_id（User / UserProfile それぞれの索引で引く）と削除された user_id"""
+    since = since - timedelta(seconds=DELTA_OVERLAP)
+    limit = DELTA_MAX_ROWS + 1
+    return (
+        User.objects.filter(updated_at__gte=since).values_list("id", flat=True)[:limit],
+        UserProfile.objects.filter(updated_at__gte=since).values_list("user_id", flat=True)[:limit],
+        DeletedUserLog.objects.filter(deleted_at__gte=since).values_list("user_id", flat=True)[:limit],
+    )
+
+
+def account_delta_payload(rows, changed_ids, deleted_ids, cursor):
+    """
+    changed_ids のうち絞り込み条件に合う行は results に、合わなくなった（退会など）ものと削除されたものは removed に入れる
+    """
+    results = [account_list_row(u) for u in rows]
+    present = {row["user"] for row in results}
+    removed = {str(user_id) for user_id in changed_ids} - present | {str(user_id) for user_id in deleted_ids}
+    return {"reset": False, "cursor": cursor, "results": results, "removed": sorted(removed)}
+
+
+def delta_is_stale(since):
+    # これより古い削除ログはアーカイブへ移っている可能性がある
+    return now() - since > timedelta(days=DELTA_MAX_AGE)
+
+
+def delta_is_too_large(changed_ids, deleted_ids):
+    return len(changed_ids) > DELTA_MAX_ROWS or len(deleted_ids) > DELTA_MAX_ROWS
+
+
+RESET_PAYLOAD = {"reset": True, "cursor": None, "results": [], "removed": []}
+
+
+class AccountsListView(ReplicaReadMixin, FastJSONMixin, APIView):
     permission_classes = [IsAuthenticated, IsTeacherOrAdmin]
+    pagination_class = UsernameCursorPagination
+
+    def get_queryset(self):
+        return account_list_queryset(self.request.query_params)
 
     def get(self, request):
-        users = User.objects.all().order_by("username")
+        # 読み始める前の時刻を次回のカーソルにする
+        cursor = encode_sync_cursor(now())
+        if "since" in request.query_params:
+            return self.get_delta(request, cursor)
+
+        paginator = self.pagination_class()
+        users = paginator.paginate_queryset(self.get_queryset(), request, view=self)
+
+        data = [account_list_row(u) for u in users]
+
+        response = paginator.get_paginated_response(data)
+        response.data["cursor"] = cursor
+        return response
+
+    def get_delta(self, request, cursor):
+        since = decode_sync_cursor(request.query_params["since"])
+        if delta_is_stale(since):
+            return Response(RESET_PAYLOAD)
+
+        user_ids, profile_ids, deleted_ids = (list(qs) for qs in account_delta_querysets(since))
+        changed_ids = set(user_ids) | set(profile_ids)
+        if delta_is_too_large(changed_ids, deleted_ids):
+            return Response(RESET_PAYLOAD)
+
+        rows = self.get_queryset().filter(id__in=changed_ids) if changed_ids else []
+        return Response(account_delta_payload(rows, changed_ids, deleted_ids, cursor))
+
 
-        data = []
-        for u in users:
-            p = getattr(u, "profile", None)
+# =======================================
+# アカウントのエクスポート（?output=csv|jsonl、一覧と同じ絞り込み）
+# =======================================
+class AccountExportView(APIView):
+    permission_classes = [IsAuthenticated, IsTeacherOrAdmin]
 
-            data.append({
-                "user": str(u.id),
-                "username": u.username,
-                "name": u.name,
-                "profile": {
-                    "is_active_student": p.is_active_student if p else True
-                }
-            })
+    # ?format= は DRF のレンダラー選択に使われるので別名にする
+    outputs = {
+        "csv": (iter_csv, "text/csv; charset=utf-8"),
+        "jsonl": (iter_jsonl, "application/x-ndjson; charset=utf-8"),
+    }
 
-        return Response(data)
+    def get(self, request):
+        output = request.query_params.get("output", "csv")
+        if output not in self.outputs:
+            raise ValidationError({"output": "csv または jsonl を指定してください"})
+        # 絞り込みの検証はストリームを始める前に済ませる
+        users = filter_accounts(User.objects.all(), request.query_params)
+
+        write, content_type = self.outputs[output]
+        response = streaming_response(request, write(iter_accounts(users)), content_type)
+        response["Content-Disposition"] = f'attachment; filename="accounts.{output}"'
+        return response
 
 
 # =======================================
 # アカウント詳細
 # =======================================
-class AccountDetailView(APIView):
+ACCOUNT_DETAIL_FIELDS = (
+    "id", "username", "name", "email", "created_at",
+    "profile__role", "profile__comment", "profile__image", "profile__image_thumb",
+    "profile__image_medium", "profile__is_active_student", "profile__is_totp_verified",
+)
+
+
+def account_detail_payload(user):
+    return {
+        "id": str(user["id"]),
+        "username": user["username"],
+        "name": user["name"],
+        "email": user["email"],
+        "profile": {
+            "role": user["profile__role"],
+            "comment": user["profile__comment"],
+            "image": image_url(user["profile__image"]),
+            **variant_urls(user["profile__image"], user["profile__image_thumb"], user["profile__image_medium"]),
+            "is_active_student": user["profile__is_active_student"],
+            "is_totp_verified": user["profile__is_totp_verified"],
+            "created_at": user["created_at"],
+        }
+    }
+
+
+class AccountDetailView(ReplicaReadMixin, FastJSONMixin, APIView):
     permission_classes = [IsAuthenticated, IsTeacherOrAdmin]
 
     def get(self, request, user_id):
-        try:
-            user = User.objects.get(id=user_id)
-        except User.DoesNotExist:
+        user = User.objects.filter(id=user_id).values(*ACCOUNT_DETAIL_FIELDS).first()
+        if user is None:
             return Response({"error": "ユーザーが存在しません"}, status=404)
 
-        profile = user.profile
+        return Response(account_detail_payload(user))
+
+
+# =======================================
+# クラス別名簿
+# ?class_ref=1&class_ref=2（include_students=false で集計のみ）
+# =======================================
+class ClassRosterView(APIView):
+    permission_classes = [IsAuthenticated, IsTeacherOrAdmin]
+
+    max_classes = 50
 
+    def get(self, request):
+        raw_ids = request.query_params.getlist("class_ref")
+        if not raw_ids or not all(raw.isdigit() for raw in raw_ids):
+            return Response({"error": "class_ref を数値で指定してください"}, status=400)
+
+        class_ids = list(dict.fromkeys(int(raw) for raw in raw_ids))
+        if len(class_ids) > self.max_classes:
+            return Response({"error": f"一度に指定できるクラスは {self.max_classes} 件までです"}, status=400)
+
+        totals = get_class_totals(class_ids)
+        classes = {
+            class_id: {"class_ref": class_id, **totals[class_id], "students": []}
+            for class_id in class_ids
+        }
+
+        if request.query_params.get("include_students", "true") != "false":
+            students = (
+                with_point_balance(User.objects.select_related("profile"))
+                .filter(profile__class_ref_id__in=class_ids, profile__role="student")
+                .order_by("username")
+            )
+            for u in students:
+                profile = u.profile
+                classes[profile.class_ref_id]["students"].append({
+                    "id": str(u.id),
+                    "username": u.username,
+                    "name": u.name,
+                    "comment": profile.comment,
+                    "image_thumb": profile_image_urls(profile)["image_thumb"],
+                    "is_active_student": profile.is_active_student,
+                    "point_balance": u.prefetched_point_balance or 0,
+                })
+
+        return Response({"classes": list(classes.values())})
+
+
+# =======================================
+# 内部メトリクス（管理者のみ）
+# =======================================
+class AccountsMetricsView(APIView):
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
         return Response({
-            "id": str(user.id),
-            "username": user.username,
-            "name": user.name,
-            "email": user.email,
-            "profile": {
-                "role": profile.role,
-                "comment": profile.comment,
-                "image": profile.image.url if profile.image else None,
-                "is_active_student": profile.is_active_student,
-                "is_totp_verified": profile.is_totp_verified,
-                "created_at": user.created_at,
-            }
+            "auth_user_cache": auth_user_cache.stats(),
+            "password_hashing": password_executor.metrics(),
+            "event_stream": broker.stats(),
+            "audit_log": audit.audit_log.stats(),
+            "token_revocations": revocations.stats(),
         })
@@ -20,11 +20,27 @@ export type UserType = {
   point_balance: number;
   profile: {
     image: string | null;
+    image_thumb: string | null;
+    image_medium: string | null;
     role: "student" | "teacher" | "admin";
     is_totp_verified: boolean;
   };
 };
 
+/* ======================================
+   BootstrapType（/api/bootstrap/ 準拠）
+====================================== */
+type BootstrapType = {
+  authenticated: boolean;
+  user: UserType | null;
+  csrf_token: string;
+  config: {
+    event_stream: boolean;
+    csrf_header_name: string;
+    media_url: string;
+  };
+};
+
 /* ======================================
    AuthContextType
 ====================================== */
@@ -75,6 +91,7 @@ export const AuthProvider = ({ children }: { children: React.ReactNode }) => {
   const [user, setUser] = useState<UserType | null>(null);
   const [role, setRole] =
     useState<"student" | "teacher" | "admin" | null>(null);
+  const [eventStream, setEventStream] = useState(false);
 
   /* ======================================
      🔵 Cookie削除
@@ -85,13 +102,20 @@ export const AuthProvider = ({ children }: { children: React.ReactNode }) => {
   };
 
   /* ======================================
-     runtime API URL 取得（1回のみ）
+     runtime API URL 取得（1回のみ、タブ内ではキャッシュ）
   ====================================== */
   useEffect(() => {
+    const cached = sessionStorage.getItem("apiBaseUrl");
+    if (cached) {
+      setApiBaseUrl(cached);
+      return;
+    }
+
     (async () => {
       try {
         const res = await fetch("/api/config", { cache: "no-store" });
         const data = await res.json();
+        sessionStorage.setItem("apiBaseUrl", data.apiBaseUrl);
         setApiBaseUrl(data.apiBaseUrl);
       } catch (e) {
         console.error("Failed to load api config", e);
@@ -114,16 +138,18 @@ export const AuthProvider = ({ children }: { children: React.ReactNode }) => {
   );
 
   /* ======================================
-     /api/me/
+     /api/bootstrap/（CSRF Cookie + /me/ を 1 往復で取得）
   ====================================== */
   const loadUser = useCallback(async () => {
     if (!apiBaseUrl) return null;
 
     try {
-      await apiFetch("/api/csrf/");
+      const res = await apiFetch("/api/bootstrap/", { cache: "no-store" });
+      if (!res.ok) throw new Error("Failed to fetch /api/bootstrap/");
 
-      const res = await apiFetch("/api/me/");
-      if (res.status === 401) {
+      const data: BootstrapType = await res.json();
+      setEventStream(data.config.event_stream);
+      if (!data.authenticated || !data.user) {
         setIsAuthenticated(false);
         setUsername(null);
         setUser(null);
@@ -131,16 +157,12 @@ export const AuthProvider = ({ children }: { children: React.ReactNode }) => {
         return null;
       }
 
-      if (!res.ok) throw new Error("Failed to fetch /api/me/");
-
-      const data: UserType = await res.json();
-
       setIsAuthenticated(true);
-      setUsername(data.username);
-      setUser(data);
-      setRole(data.profile.role);
+      setUsername(data.user.username);
+      setUser(data.user);
+      setRole(data.user.profile.role);
 
-      return data;
+      return data.user;
     } catch (e) {
       console.error("loadUser error:", e);
       setIsAuthenticated(false);
@@ -165,12 +187,44 @@ export const AuthProvider = ({ children }: { children: React.ReactNode }) => {
     })();
   }, [apiBaseUrl, pathname, loadUser, router]);
 
+  /* ======================================
+     /api/me/stream/（残高・プロフィールの変更を受け取る）
+     サーバーが ASGI でない場合（config.event_stream = false）は従来どおり loadUser のみで動く
+  ====================================== */
+  useEffect(() => {
+    if (!apiBaseUrl || !isAuthenticated || !eventStream) return;
+
+    const source = new EventSource(`${apiBaseUrl}/api/me/stream/`, {
+      withCredentials: true,
+    });
+
+    source.addEventListener("me", (e) => {
+      const data: UserType = JSON.parse((e as MessageEvent).data);
+      setUsername(data.username);
+      setUser(data);
+      setRole(data.profile.role);
+    });
+
+    source.addEventListener("logout", () => {
+      source.close();
+      clearCookies();
+      setIsAuthenticated(false);
+      setUsername(null);
+      setUser(null);
+      setRole(null);
+      router.push("/login");
+    });
+
+    return () => source.close();
+  }, [apiBaseUrl, isAuthenticated, eventStream, router]);
+
   /* ======================================
      login
   ====================================== */
   const login = async (username: string, password: string) => {
     try {
-      await apiFetch("/api/csrf/");
+      // bootstrap で CSRF Cookie が付いていれば取り直さない
+      if (!getCookie("csrftoken")) await apiFetch("/api/csrf/");
       const csrfToken = getCookie("csrftoken");
 
       const res = await apiFetch("/api/login/", {
@@ -211,7 +265,8 @@ export const AuthProvider = ({ children }: { children: React.ReactNode }) => {
   ) => {
     try {
       clearCookies();
-      await apiFetch("/api/csrf/");
+      // bootstrap で CSRF Cookie が付いていれば取り直さない
+      if (!getCookie("csrftoken")) await apiFetch("/api/csrf/");
       const csrfToken = getCookie("csrftoken");
 
       const res = await apiFetch("/api/signup/", {